@@ -4,21 +4,41 @@ FastAPI service for serving the fine-tuned Llama model locally
 """
 
 import asyncio
+import functools
+import hmac
 import json
 import logging
 import os
 import sys
+import time
 from contextlib import asynccontextmanager
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import torch
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.routing import Match
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from peft import PeftModel
 
+from model_artifact import MERGED_MODEL_PATH, find_merged_artifact, load_merged_model
+from quantization import quantize_model
+from inference_backends import GENERATION_SETTINGS, MAX_PROMPT_TOKENS, LlamaCppBackend, RemoteBackend, StubBackend, TransformersBackend
+from ipc_protocol import DEFAULT_SOCKET_PATH
+from speculative import speculative_stats
+from structured_generation import QUIZ_LAYOUTS, generate_content_structured, generate_quiz_structured, structured_stats
+from warmup import warm_generation, warm_retrieval, warmup_samples
+from metrics import CACHE_REQUESTS, INFLIGHT, PARSE_PATH, PROMPT_FITS, STAGE_SECONDS, observe_stage, render as render_metrics
+from tracing import finish_trace, span, start_trace, writer as trace_writer
+from async_retrieval import AsyncRetrievalClient, RetrievalUnavailable
+from json_scanner import scan_json_objects
+from token_budget import TokenBudget
+import profiling
+
 # ChromaDB imports
 import chromadb
 from chromadb.utils import embedding_functions
@@ -34,20 +54,55 @@ logger = logging.getLogger(__name__)
 # Configuration
 BASE_MODEL = "meta-llama/Llama-3.2-1B"
 FINETUNED_MODEL_PATH = "./llama3.2-1b-syllabus-finetuned"
-MAX_LENGTH = 1024
 TEMPERATURE = 0.7
 TOP_P = 0.9
+QUANTIZATION = os.getenv("QUANTIZATION", "none")  # "none" or "int8" (CPU only)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "transformers")  # "transformers", "llama_cpp", "remote" or "stub"
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", DEFAULT_SOCKET_PATH)  # inference_server.py socket for "remote"
+GGUF_MODEL_PATH = os.getenv("GGUF_MODEL_PATH", "./llama3.2-1b-syllabus-merged.Q4_K_M.gguf")
+SPECULATIVE_DECODING = os.getenv("SPECULATIVE_DECODING", "0") == "1"  # Prompt-lookup drafting
+SPECULATIVE_DRAFT_TOKENS = int(os.getenv("SPECULATIVE_DRAFT_TOKENS", "8"))
+STRUCTURED_GENERATION = os.getenv("STRUCTURED_GENERATION", "0") == "1"  # Server-built JSON skeleton, model fills slots
+TOKEN_BUDGET = os.getenv("TOKEN_BUDGET", "1") == "1"  # max_new_tokens predicted per request instead of fixed
+TOKEN_BUDGET_MIN = int(os.getenv("TOKEN_BUDGET_MIN", "64"))
+TOKEN_BUDGET_MAX = int(os.getenv("TOKEN_BUDGET_MAX", "1024"))
+CONTENT_CURRICULUM_CHARS = 1500  # Curriculum excerpt in content prompts, before token fitting
+QUIZ_CURRICULUM_CHARS = 800
+CONTINUE_TRUNCATED = os.getenv("CONTINUE_TRUNCATED", "0") == "1"  # Resume JSON cut off by max_new_tokens
+MAX_CONTINUATIONS = int(os.getenv("MAX_CONTINUATIONS", "1"))
+WARMUP = os.getenv("WARMUP", "1") == "1"  # Run representative requests before reporting ready
+WARMUP_BATCH_SIZES = [int(n) for n in os.getenv("WARMUP_BATCH_SIZES", "1").split(",")]
+WARMUP_MAX_NEW_TOKENS = int(os.getenv("WARMUP_MAX_NEW_TOKENS", "64"))
+STUB_SECONDS_PER_TOKEN = float(os.getenv("STUB_SECONDS_PER_TOKEN", "0"))  # Simulated decode time for "stub"
+STUB_PREFILL_SECONDS_PER_TOKEN = float(os.getenv("STUB_PREFILL_SECONDS_PER_TOKEN", "0"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # Enables /admin/* endpoints (sent as X-Admin-Token)
 
 # ChromaDB Configuration
 CHROMADB_PATH = os.getenv("CHROMADB_PATH", "./syllabusvectordb")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "syllabus_collection")
+CHROMA_QUERY_TIMEOUT = float(os.getenv("CHROMA_QUERY_TIMEOUT", "5"))  # Seconds per query, including the wait for a slot
+CHROMA_MAX_CONCURRENCY = int(os.getenv("CHROMA_MAX_CONCURRENCY", "4"))  # Queries running at once (worker threads)
+CHROMA_BREAKER_FAILURES = int(os.getenv("CHROMA_BREAKER_FAILURES", "5"))  # Consecutive failures that open the breaker
+CHROMA_BREAKER_RESET_SECONDS = float(os.getenv("CHROMA_BREAKER_RESET_SECONDS", "30"))
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 
 # Global variables
 model = None
 tokenizer = None
+backend = None  # InferenceBackend used by generate_text
+budget_model = TokenBudget(TOKEN_BUDGET_MIN, TOKEN_BUDGET_MAX)
+model_source = None  # "merged-artifact" or "base+adapter"
+model_load_seconds = None
 chroma_client = None
 chroma_collection = None
+retrieval = None  # AsyncRetrievalClient around chroma_collection used by the endpoints
+
+# Background loading progress per component; state is "pending", "loading", "ready" or "failed"
+load_status = {
+    component: {"state": "pending", "stage": None, "stages": [], "seconds": None, "error": None}
+    for component in ("model", "chromadb", "warmup")
+}
+_stage_started = {}
 
 # Request/Response Models
 class ContentRequest(BaseModel):
@@ -57,6 +112,7 @@ class ContentRequest(BaseModel):
     grade_id: str
     user_level: int = 1
     num_cards: int = 5
+    structured: Optional[bool] = None  # Override STRUCTURED_GENERATION for this request
 
 class QuizRequest(BaseModel):
     topic_id: str
@@ -65,6 +121,7 @@ class QuizRequest(BaseModel):
     grade_id: str
     quiz_type: str  # "mid" or "final"
     difficulty: int = 1
+    structured: Optional[bool] = None  # Override STRUCTURED_GENERATION for this request
 
 class TopicDescriptionRequest(BaseModel):
     subject_id: str
@@ -105,6 +162,22 @@ class TopicDescriptionResponse(BaseModel):
     topics: List[TopicDescription]
     metadata: Dict[str, Union[str, int]]
 
+class LessonBundleRequest(BaseModel):
+    topic_id: str
+    subtopic_id: str
+    subject_id: str
+    grade_id: str
+    user_level: int = 1
+    num_cards: int = 5
+    difficulty: int = 1
+    stream: bool = False  # NDJSON, one line per part as soon as it is ready
+
+class LessonBundleResponse(BaseModel):
+    success: bool
+    content: ContentResponse
+    mid_quiz: QuizResponse
+    final_quiz: QuizResponse
+
 # ChromaDB Models
 class SearchRequest(BaseModel):
     query: str
@@ -123,34 +196,166 @@ class SearchResponse(BaseModel):
     documents: List[ChromaDocument]
     total_results: int
 
+class ProfileRequest(BaseModel):
+    mode: str = "cprofile"  # "cprofile", "pyinstrument" or "torch"
+    requests: Optional[int] = None  # Profile the next N requests...
+    seconds: Optional[float] = None  # ...and/or the next T seconds
+
 class SystemStatusResponse(BaseModel):
     ai_service: Dict[str, Union[str, bool]]
     chromadb: Dict[str, Union[str, bool, int]]
-    cache: Dict[str, Union[str, int]]
+    cache: Dict[str, Union[str, int, float]]
+
+def _close_load_stage(component: str):
+    stages = load_status[component]["stages"]
+    if stages and stages[-1]["seconds"] is None:
+        stages[-1]["seconds"] = round(time.perf_counter() - _stage_started[component], 2)
+
+def mark_load_stage(component: str, stage: str):
+    """Record the current step of a component load and close the timing of the previous one."""
+    _close_load_stage(component)
+    load_status[component]["stage"] = stage
+    load_status[component]["stages"].append({"stage": stage, "seconds": None})
+    _stage_started[component] = time.perf_counter()
+
+def run_component_load(component: str, loader):
+    """Run a blocking loader (in a worker thread) and record its state and timings."""
+    status = load_status[component]
+    status.update(state="loading", error=None, stages=[])
+    start_time = time.perf_counter()
+    try:
+        loader()
+    except Exception as e:
+        status["error"] = str(e)
+    finally:
+        _close_load_stage(component)
+        status["stage"] = None
+        status["seconds"] = round(time.perf_counter() - start_time, 2)
+    status["state"] = "failed" if status["error"] else "ready"
+    logger.info(f"Component '{component}' {status['state']} after {status['seconds']}s")
+
+async def load_components():
+    """Load the LLM and ChromaDB concurrently without blocking the event loop."""
+    loads = [asyncio.to_thread(run_component_load, "chromadb", load_chromadb)]
+    if load_status["model"]["state"] != "ready":
+        loads.append(asyncio.to_thread(run_component_load, "model", load_model_and_tokenizer))
+    await asyncio.gather(*loads)
+    if WARMUP:
+        await asyncio.to_thread(run_component_load, "warmup", warmup_service)
+    else:
+        load_status["warmup"]["state"] = "skipped"
+    logger.info("Model service ready!" if load_status["model"]["state"] == "ready" else "Model service started without a model")
+
+def warmup_service(batch_sizes: List[int] = WARMUP_BATCH_SIZES):
+    """Run sample retrieval queries and representative endpoint prompts so first requests are warm."""
+    samples = warmup_samples()
+    report = {}
+    
+    curriculum = {}
+    if chroma_collection is not None:
+        mark_load_stage("warmup", "retrieval")
+        queries = [f"{s['subject_id']} {s['topic_id']} {s['subtopic_id']} quiz questions" for s in samples]
+        report["retrieval"] = warm_retrieval(chroma_collection, queries)
+        curriculum = {query: "\n".join(docs) for query, docs in report["retrieval"].pop("documents").items()}
+    
+    # A remote backend warms itself in inference_server.py
+    if backend is not None and not isinstance(backend, RemoteBackend):
+        mark_load_stage("warmup", "generation")
+        sample = samples[0]
+        curriculum_content = next(iter(curriculum.values()), "")
+        quiz_request = QuizRequest(**sample, quiz_type="mid")
+        content_request = ContentRequest(**sample)
+        prompts = {
+            "generate-quiz": create_quiz_prompt_with_rag(quiz_request, curriculum_content) if curriculum_content
+                             else create_quiz_prompt_coseaq_fallback(quiz_request),
+            "generate-content": create_content_prompt_with_rag(content_request, curriculum_content) if curriculum_content
+                                else create_content_prompt(content_request),
+        }
+        report["generation"] = warm_generation(backend, prompts, batch_sizes, WARMUP_MAX_NEW_TOKENS)
+    
+    load_status["warmup"]["report"] = report
 
 def load_model_and_tokenizer():
     """Load the base model, fine-tuned adapter, and tokenizer."""
-    global model, tokenizer
+    global model, tokenizer, backend, model_source, model_load_seconds
     
     try:
-        logger.info("Loading tokenizer...")
-        tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
+        start_time = time.perf_counter()
+        prompt_template_tokens.cache_clear()  # Counts depend on the backend's tokenizer
+        
+        if INFERENCE_BACKEND == "remote":
+            # The model lives in inference_server.py; this process only forwards requests
+            logger.info(f"Connecting to inference server at {INFERENCE_SOCKET}...")
+            mark_load_stage("model", "connect inference server")
+            backend = RemoteBackend(INFERENCE_SOCKET)
+            model, tokenizer = None, None
+            model_source = "remote"
+            model_load_seconds = round(time.perf_counter() - start_time, 2)
+            return model, tokenizer
+        
+        if INFERENCE_BACKEND == "stub":
+            # Canned responses without weights, for CI and load_test.py
+            logger.info("Using the stub backend (no model)")
+            mark_load_stage("model", "stub")
+            backend = StubBackend(STUB_SECONDS_PER_TOKEN, STUB_PREFILL_SECONDS_PER_TOKEN)
+            model, tokenizer = None, None
+            model_source = "stub"
+            model_load_seconds = round(time.perf_counter() - start_time, 2)
+            return model, tokenizer
+        
+        if INFERENCE_BACKEND == "llama_cpp":
+            logger.info(f"Loading GGUF model for llama.cpp from {GGUF_MODEL_PATH}...")
+            mark_load_stage("model", "gguf")
+            backend = LlamaCppBackend(GGUF_MODEL_PATH, speculative=SPECULATIVE_DECODING,
+                                      num_draft_tokens=SPECULATIVE_DRAFT_TOKENS)
+            model, tokenizer = backend.llm, None
+            model_source = "gguf"
+            model_load_seconds = round(time.perf_counter() - start_time, 2)
+            logger.info(f"Model loaded successfully from {model_source} in {model_load_seconds}s!")
+            return model, tokenizer
+        
+        # Fast path: pre-merged safetensors written by `python model_artifact.py export`
+        manifest = find_merged_artifact(MERGED_MODEL_PATH, BASE_MODEL, FINETUNED_MODEL_PATH)
+        if manifest is not None:
+            logger.info(f"Loading pre-merged model from {MERGED_MODEL_PATH}...")
+            mark_load_stage("model", "merged artifact")
+            tokenizer = AutoTokenizer.from_pretrained(MERGED_MODEL_PATH)
+            model = load_merged_model(MERGED_MODEL_PATH, manifest)
+            if torch.cuda.is_available():
+                model = model.to("cuda", dtype=torch.float16)
+            model_source = "merged-artifact"
+        else:
+            logger.info("Loading tokenizer...")
+            mark_load_stage("model", "tokenizer")
+            tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
+            
+            logger.info("Loading base model...")
+            mark_load_stage("model", "base model")
+            base_model = AutoModelForCausalLM.from_pretrained(
+                BASE_MODEL,
+                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                device_map="auto" if torch.cuda.is_available() else "cpu"
+            )
+            
+            logger.info("Loading fine-tuned adapter...")
+            mark_load_stage("model", "adapter merge")
+            model = PeftModel.from_pretrained(base_model, FINETUNED_MODEL_PATH)
+            model = model.merge_and_unload()  # Merge adapter with base model
+            model_source = "base+adapter"
+            logger.info("Tip: run 'python model_artifact.py export' once to skip the merge on every startup")
         
         if tokenizer.pad_token is None:
             tokenizer.pad_token = tokenizer.eos_token
         
-        logger.info("Loading base model...")
-        base_model = AutoModelForCausalLM.from_pretrained(
-            BASE_MODEL,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else "cpu"
-        )
-        
-        logger.info("Loading fine-tuned adapter...")
-        model = PeftModel.from_pretrained(base_model, FINETUNED_MODEL_PATH)
-        model = model.merge_and_unload()  # Merge adapter with base model
+        if QUANTIZATION != "none":
+            mark_load_stage("model", f"quantize {QUANTIZATION}")
+            model = quantize_model(model, QUANTIZATION)
+        backend = TransformersBackend(model, tokenizer, speculative=SPECULATIVE_DECODING,
+                                      num_draft_tokens=SPECULATIVE_DRAFT_TOKENS,
+                                      keep_generation_state=CONTINUE_TRUNCATED)
         
-        logger.info("Model loaded successfully!")
+        model_load_seconds = round(time.perf_counter() - start_time, 2)
+        logger.info(f"Model loaded successfully from {model_source} in {model_load_seconds}s!")
         return model, tokenizer
         
     except Exception as e:
@@ -159,17 +364,19 @@ def load_model_and_tokenizer():
 
 def load_chromadb():
     """Initialize ChromaDB client and collection."""
-    global chroma_client, chroma_collection
+    global chroma_client, chroma_collection, retrieval
     
     try:
         logger.info("Initializing ChromaDB...")
         
         # Initialize embedding function
+        mark_load_stage("chromadb", "embedding model")
         sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
             model_name=EMBEDDING_MODEL_NAME
         )
         
         # Initialize ChromaDB client
+        mark_load_stage("chromadb", "open collection")
         chroma_client = chromadb.PersistentClient(path=CHROMADB_PATH)
         
         # Get the collection
@@ -179,37 +386,36 @@ def load_chromadb():
         )
         
         doc_count = chroma_collection.count()
+        retrieval = AsyncRetrievalClient(chroma_collection, max_concurrency=CHROMA_MAX_CONCURRENCY,
+                                         timeout=CHROMA_QUERY_TIMEOUT, failure_threshold=CHROMA_BREAKER_FAILURES,
+                                         reset_seconds=CHROMA_BREAKER_RESET_SECONDS)
         logger.info(f"ChromaDB initialized successfully! Collection '{COLLECTION_NAME}' has {doc_count} documents.")
         
         return chroma_client, chroma_collection
         
     except Exception as e:
         logger.error(f"Error loading ChromaDB: {e}")
+        load_status["chromadb"]["error"] = str(e)
         logger.warning("ChromaDB unavailable - AI service will work without RAG enhancement")
         return None, None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
-    # Startup
+    # Startup: load in the background so /livez and /health answer immediately
     logger.info("Starting SmartClass AI Model Service...")
-    try:
-        # Load AI model
-        load_model_and_tokenizer()
-        logger.info("AI model ready!")
-        
-        # Load ChromaDB
-        load_chromadb()
-        
-        logger.info("Model service ready!")
-    except Exception as e:
-        logger.error(f"Failed to load model: {e}")
-        raise e
+    if backend is not None:
+        # A pre-forking launcher already loaded the model in the parent
+        load_status["model"].update(state="ready", seconds=model_load_seconds)
+    loading_task = asyncio.create_task(load_components())
     
     yield
     
     # Shutdown
     logger.info("Shutting down model service...")
+    trace_writer.flush()
+    if not loading_task.done():
+        logger.warning("Shutting down while components are still loading")
 
 # Create FastAPI app
 app = FastAPI(
@@ -226,39 +432,91 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id"],  # Let the Next.js client read span timings
 )
 
-def generate_text(prompt: str, max_length: int = MAX_LENGTH) -> str:
+def endpoint_label(request: Request) -> str:
+    """Metrics and trace label: the path of the route serving the request, "other" for unknown paths"""
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match != Match.NONE:
+            return route.path.strip("/") or "root"
+    return "other"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Total latency and in-flight count per endpoint; trace spans go to TRACE_FILE and Server-Timing"""
+    endpoint = endpoint_label(request)
+    start_time = time.perf_counter()
+    trace = start_trace(endpoint)
+    INFLIGHT.inc(endpoint=endpoint)
+    try:
+        response = await call_next(request)
+    finally:
+        INFLIGHT.dec(endpoint=endpoint)
+        observe_stage(endpoint, "total", start_time)
+        finish_trace(trace)
+        if profiling.active_session is not None and not endpoint.startswith("admin/"):
+            profiling.active_session.request_done()
+    if trace is not None:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Trace-Id"] = trace.trace_id
+    return response
+
+async def run_blocking(func: Callable, *args):
+    """Run func in the thread pool, where an active profiling session profiles it."""
+    return await run_in_threadpool(profiling.call, func, *args)
+
+def fit_curriculum(endpoint: str, build_prompt: Callable[[str], str], curriculum_content: str, max_chars: int) -> str:
+    """Shrink curriculum_content until build_prompt(curriculum_content) fits MAX_PROMPT_TOKENS.
+
+    Only the curriculum section is cut, at a word boundary, so the instructions and the JSON cue after it
+    stay intact. Returns "" (use the non-RAG prompt) if not even the template fits.
+    """
+    curriculum = curriculum_content[:max_chars]
+    if not curriculum.strip():
+        return curriculum
+    limit = MAX_PROMPT_TOKENS
+    tokens = backend.count_prompt_tokens(build_prompt(curriculum))
+    if tokens <= limit:
+        PROMPT_FITS.inc(endpoint=endpoint, result="fit")
+        return curriculum
+    
+    template_tokens = prompt_template_tokens(build_prompt("-"))
+    while tokens > limit and curriculum:
+        available = limit - template_tokens
+        # Cut in proportion to the overshoot, slightly more so one pass is usually enough
+        keep = int(len(curriculum) * available / max(tokens - template_tokens, 1) * 0.95) if available > 0 else 0
+        curriculum = curriculum[:keep].rsplit(None, 1)[0].rstrip() if keep > 0 and curriculum[:keep].strip() else ""
+        if curriculum:
+            tokens = backend.count_prompt_tokens(build_prompt(curriculum))
+    
+    result = "shrunk" if curriculum else "dropped"
+    PROMPT_FITS.inc(endpoint=endpoint, result=result)
+    logger.warning(f"Prompt over {limit} tokens: curriculum {result} to {len(curriculum)} characters")
+    return curriculum
+
+@functools.lru_cache(maxsize=1024)
+def prompt_template_tokens(template: str) -> int:
+    """Prompt tokens of a template (built with a placeholder curriculum), counted once per template."""
+    return backend.count_prompt_tokens(template)
+
+def generation_budget(endpoint: str, items: int) -> int:
+    """max_new_tokens for a request producing items objects (fixed when TOKEN_BUDGET=0)."""
+    return budget_model.predict(endpoint, items) if TOKEN_BUDGET else GENERATION_SETTINGS["max_new_tokens"]
+
+def generated_tokens(responses: List[str]) -> List[int]:
+    """New tokens the backend generated for responses, from its own count (re-tokenized only if it has none)."""
+    counts = backend.last_generated_tokens()
+    return counts if len(counts) == len(responses) else [backend.count_tokens(response) for response in responses]
+
+def generate_text(prompt: str, endpoint: str = "default", items: int = 1) -> str:
     """Generate text using the fine-tuned model"""
     try:
-        # Encode the prompt with attention mask
-        inputs = tokenizer(prompt, return_tensors="pt", padding=True, truncation=True, max_length=512)
-        
-        # Move to same device as model
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
-        
-        # Generate response with more constrained settings for better JSON
-        with torch.no_grad():
-            outputs = model.generate(
-                input_ids=inputs["input_ids"],
-                attention_mask=inputs["attention_mask"],
-                max_new_tokens=300,  # Increased for complete JSON
-                temperature=0.3,     # Much lower for more deterministic output
-                top_p=0.8,
-                do_sample=True,
-                pad_token_id=tokenizer.eos_token_id,
-                eos_token_id=tokenizer.eos_token_id,
-                num_return_sequences=1,
-                repetition_penalty=1.1  # Prevent repetition
-            )
-        
-        # Decode the response
-        generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Remove the original prompt from the response
-        original_prompt = tokenizer.decode(inputs["input_ids"][0], skip_special_tokens=True)
-        response = generated_text[len(original_prompt):].strip()
+        max_new_tokens = generation_budget(endpoint, items)
+        response = backend.generate(prompt, max_new_tokens, endpoint=endpoint)
+        if TOKEN_BUDGET:
+            budget_model.record(endpoint, items, max_new_tokens, generated_tokens([response])[0])
         
         # Log the raw response for debugging
         logger.info(f"Raw model response: {response[:200]}...")
@@ -269,6 +527,109 @@ def generate_text(prompt: str, max_length: int = MAX_LENGTH) -> str:
         logger.error(f"Error generating text: {e}")
         raise HTTPException(status_code=500, detail=f"Text generation failed: {str(e)}")
 
+def extract_json_items(prompt: str, response_text: str, endpoint: str, expected_items: int,
+                       required_keys: Tuple[str, ...]) -> Tuple[Optional[List[Dict]], str]:
+    """Parse the model's JSON array; returns (items or None, parse method).
+
+    Complete objects before a cut-off are kept ("salvaged"). With CONTINUE_TRUNCATED the generation
+    is resumed from where it stopped until expected_items objects exist ("continued").
+    """
+    scanned = scan_json_objects(response_text)
+    continuations = 0
+    while (CONTINUE_TRUNCATED and scanned.truncated and len(scanned.items) < expected_items
+           and continuations < MAX_CONTINUATIONS):
+        stage_start = time.perf_counter()
+        try:
+            remaining = expected_items - len(scanned.items)
+            continuation = backend.generate_continuation(prompt, response_text, generation_budget(endpoint, remaining),
+                                                         endpoint=endpoint)
+        except Exception as e:
+            logger.error(f"Continuing truncated generation failed: {e}")
+            break
+        observe_stage(endpoint, "continue", stage_start)
+        continuations += 1
+        if not continuation.strip():
+            break
+        response_text += continuation
+        scanned = scan_json_objects(response_text)
+    # The output is final now, so a kept KV cache would only hold memory
+    backend.release_generation_state(prompt)
+    
+    if scanned.complete:
+        logger.info(f"Successfully parsed JSON array with {len(scanned.items)} items")
+        return scanned.items, "continued" if continuations else "json_array"
+    items = [obj for obj in scanned.items if all(key in obj for key in required_keys)]
+    if not items:
+        return None, "canned"
+    if continuations:
+        parse_method = "continued"
+    else:
+        parse_method = "salvaged" if scanned.truncated else "json_objects"
+    logger.info(f"Recovered {len(items)} of {expected_items} JSON objects ({parse_method})")
+    return items, parse_method
+
+def generate_texts(prompts: List[str], endpoints: List[str], items: List[int]) -> List[str]:
+    """Generate several prompts as one batch; the batch gets the largest of their budgets"""
+    try:
+        max_new_tokens = max(generation_budget(endpoint, count) for endpoint, count in zip(endpoints, items))
+        responses = backend.generate_batch(prompts, max_new_tokens, endpoints)
+        if TOKEN_BUDGET:
+            # Each sequence could run to the batch's cap, so that is the budget it fit in or hit
+            for endpoint, count, generated in zip(endpoints, items, generated_tokens(responses)):
+                budget_model.record(endpoint, count, max_new_tokens, generated)
+        return responses
+        
+    except Exception as e:
+        logger.error(f"Error generating batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Text generation failed: {str(e)}")
+
+def generate_structured_items(prompt: str, request: Union[ContentRequest, QuizRequest]) -> Optional[List[Dict]]:
+    """Fill a server-built JSON skeleton when structured generation is enabled; None means use free generation."""
+    enabled = STRUCTURED_GENERATION if request.structured is None else request.structured
+    if not enabled:
+        return None
+    if not isinstance(backend, TransformersBackend):
+        logger.warning(f"Structured generation needs the transformers backend, not {INFERENCE_BACKEND}")
+        return None
+    
+    try:
+        if isinstance(request, QuizRequest):
+            return generate_quiz_structured(model, tokenizer, prompt, request.quiz_type)
+        return generate_content_structured(model, tokenizer, prompt, request.num_cards)
+    except Exception as e:
+        logger.error(f"Structured generation failed, falling back to free generation: {e}")
+        return None
+
+async def query_curriculum(queries: List[str], n_results: int) -> List[str]:
+    """Documents for all queries, run concurrently on the retrieval pool"""
+    async def run_query(query: str) -> List[str]:
+        with span("chroma_query", query=query):
+            results = await retrieval.query(
+                query_texts=[query],
+                n_results=n_results,
+                include=["documents", "metadatas"]
+            )
+        return results['documents'][0] if results['documents'] and results['documents'][0] else []
+    
+    return [doc for docs in await asyncio.gather(*(run_query(query) for query in queries)) for doc in docs]
+
+def content_search_queries(request: ContentRequest) -> List[str]:
+    """Comprehensive search queries for content retrieval"""
+    return [
+        f"{request.subject_id} {request.topic_id} {request.subtopic_id}",
+        f"{request.subject_id} grade {request.grade_id} {request.subtopic_id}",
+        f"{request.subtopic_id} {request.subject_id} curriculum",
+        f"{request.topic_id} {request.subtopic_id} learning content"
+    ]
+
+def quiz_search_queries(request: QuizRequest) -> List[str]:
+    """COSEAQ-inspired search queries for quiz retrieval"""
+    return [
+        f"{request.subject_id} {request.topic_id} {request.subtopic_id} quiz questions",
+        f"{request.subject_id} grade {request.grade_id} {request.subtopic_id} assessment",
+        f"{request.subtopic_id} {request.subject_id} learning objectives"
+    ]
+
 def create_content_prompt(request: ContentRequest) -> str:
     """Create a prompt for content generation"""
     prompt = f"""Generate {request.num_cards} educational content cards for {request.subject_id} Grade {request.grade_id}.
@@ -292,7 +653,7 @@ def create_content_prompt_with_rag(request: ContentRequest, curriculum_content:
         curriculum_section = f"""
 
 CURRICULUM CONTENT FROM SYLLABUS:
-{curriculum_content[:1500]}...
+{curriculum_content[:CONTENT_CURRICULUM_CHARS]}...
 
 Based on this curriculum content, create educational content for {request.subtopic_id}."""
     
@@ -310,36 +671,127 @@ JSON:"""
 
     return prompt
 
+def build_quiz_response(request: QuizRequest, prompt: str, response_text: str,
+                        quiz_data: Optional[List[Dict]], parse_method: str, stage_start: float) -> QuizResponse:
+    """Parse the model output into quiz questions (with COSEAQ fallbacks) and record the parse path"""
+    layout = QUIZ_LAYOUTS.get(request.quiz_type, QUIZ_LAYOUTS["final"])
+    
+    # Step 4: Enhanced JSON parsing with COSEAQ principles
+    try:
+        # Method 1: Extract the JSON array, or its complete questions if it is cut off or malformed
+        if not quiz_data:
+            quiz_data, parse_method = extract_json_items(prompt, response_text, "generate-quiz",
+                                                         len(layout), ("question",))
+        
+        # Method 2: COSEAQ-inspired fallback questions
+        if not quiz_data:
+            logger.warning("Creating COSEAQ-inspired fallback questions")
+            if request.quiz_type == "mid":
+                quiz_data = [{
+                    "question": f"What is the main concept in {request.subtopic_id.replace('-', ' ')}?",
+                    "question_type": "multiple_choice",
+                    "options": ["Basic understanding", "Advanced concepts", "Practical skills", "All of the above"],
+                    "correct_answer": "All of the above",
+                    "explanation": f"This subtopic covers multiple important aspects of {request.subtopic_id.replace('-', ' ')}."
+                }]
+            else:  # final quiz
+                quiz_data = [
+                    {
+                        "question": f"What did you learn about {request.subtopic_id.replace('-', ' ')}?",
+                        "question_type": "multiple_choice",
+                        "options": ["Key concepts", "Important skills", "Practical applications", "All of the above"],
+                        "correct_answer": "All of the above",
+                        "explanation": f"This topic covers comprehensive learning about {request.subtopic_id.replace('-', ' ')}."
+                    },
+                    {
+                        "question": f"True or False: {request.subtopic_id.replace('-', ' ')} is important for Grade {request.grade_id} students.",
+                        "question_type": "true_false",
+                        "options": ["True", "False"],
+                        "correct_answer": "True",
+                        "explanation": f"{request.subtopic_id.replace('-', ' ')} is indeed important for students at this grade level."
+                    }
+                ]
+        
+        # Validate and create QuizQuestion objects
+        quiz_questions = []
+        for question_data in quiz_data:
+            try:
+                # Ensure required fields exist
+                if 'question' not in question_data:
+                    question_data['question'] = f"Question about {request.subtopic_id.replace('-', ' ')}"
+                if 'question_type' not in question_data:
+                    question_data['question_type'] = "multiple_choice"
+                if 'correct_answer' not in question_data:
+                    question_data['correct_answer'] = "Option A"
+                if 'explanation' not in question_data:
+                    question_data['explanation'] = "This is the correct answer."
+                
+                # Handle options
+                if question_data['question_type'] == "multiple_choice" and 'options' not in question_data:
+                    question_data['options'] = ["Option A", "Option B", "Option C", "Option D"]
+                elif question_data['question_type'] == "true_false" and 'options' not in question_data:
+                    question_data['options'] = ["True", "False"]
+                
+                quiz_questions.append(QuizQuestion(**question_data))
+            except Exception as question_error:
+                logger.warning(f"Error creating quiz question: {question_error}")
+                continue
+        
+        # Ensure we have at least one question
+        if not quiz_questions:
+            parse_method = "canned"
+            quiz_questions = [QuizQuestion(
+                question=f"What is important about {request.subtopic_id.replace('-', ' ')}?",
+                question_type="multiple_choice",
+                options=["It's educational", "It's relevant", "It's useful", "All of the above"],
+                correct_answer="All of the above",
+                explanation=f"All aspects of {request.subtopic_id.replace('-', ' ')} are important for learning."
+            )]
+        
+    except Exception as e:
+        logger.error(f"Quiz parsing error: {e}")
+        parse_method = "canned"
+        # Ultimate COSEAQ fallback
+        quiz_questions = [QuizQuestion(
+            question=f"What did you learn about {request.subtopic_id.replace('-', ' ')}?",
+            question_type="multiple_choice",
+            options=["New concepts", "Important skills", "Practical knowledge", "All of the above"],
+            correct_answer="All of the above",
+            explanation="This question covers the key learning points of the topic."
+        )]
+    
+    PARSE_PATH.inc(endpoint="generate-quiz", method=parse_method)
+    observe_stage("generate-quiz", "parse", stage_start)
+    
+    return QuizResponse(
+        success=True,
+        questions=quiz_questions,
+        quiz_type=request.quiz_type,
+        metadata={
+            "topic_id": request.topic_id,
+            "subtopic_id": request.subtopic_id,
+            "grade_id": request.grade_id,
+            "num_questions": len(quiz_questions)
+        }
+    )
+
+
 @app.post("/generate-quiz", response_model=QuizResponse)
 async def generate_quiz(request: QuizRequest):
     """Generate quiz questions using COSEAQ-inspired RAG approach"""
     try:
-        if model is None or tokenizer is None:
-            raise HTTPException(status_code=503, detail="Model not loaded")
+        if backend is None:
+            raise HTTPException(status_code=503, detail=f"Model not loaded ({load_status['model']['state']})")
         
         logger.info(f"Generating {request.quiz_type} quiz for {request.topic_id}/{request.subtopic_id}")
         
+        stage_start = time.perf_counter()
+        
         # Step 1: Query ChromaDB for curriculum content (COSEAQ Foundation)
         curriculum_content = ""
         try:
-            if chroma_collection is not None:
-                # COSEAQ-inspired search queries
-                search_queries = [
-                    f"{request.subject_id} {request.topic_id} {request.subtopic_id} quiz questions",
-                    f"{request.subject_id} grade {request.grade_id} {request.subtopic_id} assessment",
-                    f"{request.subtopic_id} {request.subject_id} learning objectives"
-                ]
-                
-                all_documents = []
-                for query in search_queries:
-                    results = chroma_collection.query(
-                        query_texts=[query],
-                        n_results=3,
-                        include=["documents", "metadatas"]
-                    )
-                    
-                    if results['documents'] and results['documents'][0]:
-                        all_documents.extend(results['documents'][0])
+            if retrieval is not None:
+                all_documents = await query_curriculum(quiz_search_queries(request), n_results=3)
                 
                 if all_documents:
                     curriculum_content = "\n".join(set(all_documents))
@@ -353,6 +805,12 @@ async def generate_quiz(request: QuizRequest):
             logger.error(f"ChromaDB query failed during quiz generation: {e}")
             curriculum_content = ""
         
+        stage_start = observe_stage("generate-quiz", "retrieval", stage_start)
+        # Token counting may be a round trip to the inference server, so it runs in the thread pool
+        curriculum_content = await run_blocking(fit_curriculum, "generate-quiz",
+                                                lambda text: create_quiz_prompt_with_rag(request, text),
+                                                curriculum_content, QUIZ_CURRICULUM_CHARS)
+        
         # Step 2: Create COSEAQ-inspired prompt
         if curriculum_content.strip():
             prompt = create_quiz_prompt_with_rag(request, curriculum_content)
@@ -361,112 +819,21 @@ async def generate_quiz(request: QuizRequest):
             prompt = create_quiz_prompt_coseaq_fallback(request)
             logger.info("Using COSEAQ fallback prompt for quiz generation")
         
-        # Step 3: Generate quiz with simpler settings
-        response_text = generate_text(prompt, max_length=1024)  # Reduced for cleaner output
+        stage_start = observe_stage("generate-quiz", "prompt_build", stage_start)
         
-        # Step 4: Enhanced JSON parsing with COSEAQ principles
-        try:
-            quiz_data = None
-            
-            # Method 1: Extract JSON array
-            if '[' in response_text and ']' in response_text:
-                start_idx = response_text.find('[')
-                end_idx = response_text.rfind(']') + 1
-                json_str = response_text[start_idx:end_idx]
-                
-                try:
-                    quiz_data = json.loads(json_str)
-                    logger.info(f"Successfully parsed quiz JSON with {len(quiz_data)} questions")
-                except json.JSONDecodeError as e:
-                    logger.warning(f"JSON parsing failed: {e}")
-            
-            # Method 2: COSEAQ-inspired fallback questions
-            if not quiz_data:
-                logger.warning("Creating COSEAQ-inspired fallback questions")
-                if request.quiz_type == "mid":
-                    quiz_data = [{
-                        "question": f"What is the main concept in {request.subtopic_id.replace('-', ' ')}?",
-                        "question_type": "multiple_choice",
-                        "options": ["Basic understanding", "Advanced concepts", "Practical skills", "All of the above"],
-                        "correct_answer": "All of the above",
-                        "explanation": f"This subtopic covers multiple important aspects of {request.subtopic_id.replace('-', ' ')}."
-                    }]
-                else:  # final quiz
-                    quiz_data = [
-                        {
-                            "question": f"What did you learn about {request.subtopic_id.replace('-', ' ')}?",
-                            "question_type": "multiple_choice",
-                            "options": ["Key concepts", "Important skills", "Practical applications", "All of the above"],
-                            "correct_answer": "All of the above",
-                            "explanation": f"This topic covers comprehensive learning about {request.subtopic_id.replace('-', ' ')}."
-                        },
-                        {
-                            "question": f"True or False: {request.subtopic_id.replace('-', ' ')} is important for Grade {request.grade_id} students.",
-                            "question_type": "true_false",
-                            "options": ["True", "False"],
-                            "correct_answer": "True",
-                            "explanation": f"{request.subtopic_id.replace('-', ' ')} is indeed important for students at this grade level."
-                        }
-                    ]
-            
-            # Validate and create QuizQuestion objects
-            quiz_questions = []
-            for question_data in quiz_data:
-                try:
-                    # Ensure required fields exist
-                    if 'question' not in question_data:
-                        question_data['question'] = f"Question about {request.subtopic_id.replace('-', ' ')}"
-                    if 'question_type' not in question_data:
-                        question_data['question_type'] = "multiple_choice"
-                    if 'correct_answer' not in question_data:
-                        question_data['correct_answer'] = "Option A"
-                    if 'explanation' not in question_data:
-                        question_data['explanation'] = "This is the correct answer."
-                    
-                    # Handle options
-                    if question_data['question_type'] == "multiple_choice" and 'options' not in question_data:
-                        question_data['options'] = ["Option A", "Option B", "Option C", "Option D"]
-                    elif question_data['question_type'] == "true_false" and 'options' not in question_data:
-                        question_data['options'] = ["True", "False"]
-                    
-                    quiz_questions.append(QuizQuestion(**question_data))
-                except Exception as question_error:
-                    logger.warning(f"Error creating quiz question: {question_error}")
-                    continue
-            
-            # Ensure we have at least one question
-            if not quiz_questions:
-                quiz_questions = [QuizQuestion(
-                    question=f"What is important about {request.subtopic_id.replace('-', ' ')}?",
-                    question_type="multiple_choice",
-                    options=["It's educational", "It's relevant", "It's useful", "All of the above"],
-                    correct_answer="All of the above",
-                    explanation=f"All aspects of {request.subtopic_id.replace('-', ' ')} are important for learning."
-                )]
-            
-        except Exception as e:
-            logger.error(f"Quiz parsing error: {e}")
-            # Ultimate COSEAQ fallback
-            quiz_questions = [QuizQuestion(
-                question=f"What did you learn about {request.subtopic_id.replace('-', ' ')}?",
-                question_type="multiple_choice",
-                options=["New concepts", "Important skills", "Practical knowledge", "All of the above"],
-                correct_answer="All of the above",
-                explanation="This question covers the key learning points of the topic."
-            )]
+        # Step 3: Generate quiz with simpler settings (or fill a server-built skeleton)
+        layout = QUIZ_LAYOUTS.get(request.quiz_type, QUIZ_LAYOUTS["final"])
+        # Generation (and any continuation while parsing) blocks, so it runs in the thread pool
+        quiz_data = await run_blocking(generate_structured_items, prompt, request)
+        parse_method = "structured" if quiz_data else "canned"
+        response_text = "" if quiz_data else await run_blocking(generate_text, prompt, "generate-quiz", len(layout))
+        stage_start = observe_stage("generate-quiz", "generate", stage_start)
         
-        return QuizResponse(
-            success=True,
-            questions=quiz_questions,
-            quiz_type=request.quiz_type,
-            metadata={
-                "topic_id": request.topic_id,
-                "subtopic_id": request.subtopic_id,
-                "grade_id": request.grade_id,
-                "num_questions": len(quiz_questions)
-            }
-        )
+        return await run_blocking(build_quiz_response, request, prompt, response_text, quiz_data, parse_method,
+                                  stage_start)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Quiz generation error: {e}")
         raise HTTPException(status_code=500, detail=f"Quiz generation failed: {str(e)}")
@@ -479,7 +846,7 @@ def create_quiz_prompt_with_rag(request: QuizRequest, curriculum_content: str) -
         curriculum_section = f"""
 
 CURRICULUM CONTENT:
-{curriculum_content[:800]}...
+{curriculum_content[:QUIZ_CURRICULUM_CHARS]}...
 
 Based on this curriculum content, create quiz questions for {request.subtopic_id}."""
     
@@ -557,43 +924,136 @@ async def health_check():
     """Detailed health check"""
     return {
         "status": "healthy",
-        "model_loaded": model is not None,
+        "model_loaded": backend is not None,
+        "backend": INFERENCE_BACKEND,
         "tokenizer_loaded": tokenizer is not None,
         "cuda_available": torch.cuda.is_available(),
-        "device": "cuda" if torch.cuda.is_available() else "cpu"
+        "device": "cuda" if torch.cuda.is_available() else "cpu",
+        "model_source": model_source,
+        "model_load_seconds": model_load_seconds,
+        "quantization": QUANTIZATION,
+        "components": load_status
     }
 
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up; fails only if the model load failed for good"""
+    if load_status["model"]["state"] == "failed":
+        return JSONResponse(status_code=503, content={"status": "failed", "error": load_status["model"]["error"]})
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: the model is loaded, ChromaDB has finished loading (or failed, RAG is optional) and warmup is done"""
+    ready = (load_status["model"]["state"] == "ready" and load_status["chromadb"]["state"] in ("ready", "failed")
+             and load_status["warmup"]["state"] in ("ready", "failed", "skipped"))
+    content = {"ready": ready, "components": load_status}
+    return content if ready else JSONResponse(status_code=503, content=content)
+
+def build_content_response(request: ContentRequest, prompt: str, response_text: str,
+                           content_data: Optional[List[Dict]], parse_method: str, stage_start: float) -> ContentResponse:
+    """Parse the model output into content cards (with text fallbacks) and record the parse path"""
+    # Parse JSON response with enhanced extraction
+    try:
+        # Method 1: The JSON array, or failing that every complete card object in the response
+        if content_data is None:
+            content_data, parse_method = extract_json_items(prompt, response_text, "generate-content",
+                                                            request.num_cards, ("title", "body"))
+        
+        # Method 2: If still no valid JSON, create structured content from text
+        if not content_data:
+            logger.warning("No valid JSON found, creating structured content from response")
+            lines = [line.strip() for line in response_text.split('\n') if line.strip()]
+            
+            if len(lines) >= 2:
+                parse_method = "text"
+                # Try to extract title and body from text
+                title = lines[0].replace('"', '').replace('Title:', '').strip()
+                body_lines = lines[1:]
+                body = '<p>' + '</p><p>'.join(body_lines) + '</p>'
+                
+                content_data = [{
+                    "title": title or f"{request.subtopic_id.replace('-', ' ').title()} Content",
+                    "body": body,
+                    "card_type": "content"
+                }]
+            else:
+                parse_method = "canned"
+                # Last resort fallback
+                content_data = [{
+                    "title": f"{request.subtopic_id.replace('-', ' ').title()} Content",
+                    "body": f"<p>{response_text}</p>",
+                    "card_type": "content"
+                }]
+        
+        # Validate and create ContentCard objects
+        content_cards = []
+        for card_data in content_data:
+            try:
+                # Ensure required fields exist
+                if 'title' not in card_data:
+                    card_data['title'] = f"Content Card {len(content_cards) + 1}"
+                if 'body' not in card_data:
+                    card_data['body'] = "<p>Content will be available soon.</p>"
+                if 'card_type' not in card_data:
+                    card_data['card_type'] = "content"
+                
+                content_cards.append(ContentCard(**card_data))
+            except Exception as card_error:
+                logger.warning(f"Error creating content card: {card_error}")
+                continue
+        
+        # Ensure we have at least one card
+        if not content_cards:
+            parse_method = "canned"
+            content_cards = [ContentCard(
+                title=f"{request.subtopic_id.replace('-', ' ').title()} Content",
+                body=f"<p>Learning content for {request.subtopic_id.replace('-', ' ')}.</p>",
+                card_type="content"
+            )]
+        
+    except Exception as e:
+        logger.error(f"Content parsing error: {e}")
+        parse_method = "canned"
+        # Ultimate fallback
+        content_cards = [ContentCard(
+            title=f"{request.subtopic_id.replace('-', ' ').title()} Content",
+            body=f"<p>Welcome to the lesson on {request.subtopic_id.replace('-', ' ')}.</p>",
+            card_type="content"
+        )]
+    
+    PARSE_PATH.inc(endpoint="generate-content", method=parse_method)
+    observe_stage("generate-content", "parse", stage_start)
+    
+    return ContentResponse(
+        success=True,
+        content=content_cards,
+        metadata={
+            "topic_id": request.topic_id,
+            "subtopic_id": request.subtopic_id,
+            "grade_id": request.grade_id,
+            "num_cards": len(content_cards)
+        }
+    )
+
+
 @app.post("/generate-content", response_model=ContentResponse)
 async def generate_content(request: ContentRequest):
     """Generate educational content cards using RAG"""
     try:
-        if model is None or tokenizer is None:
-            raise HTTPException(status_code=503, detail="Model not loaded")
+        if backend is None:
+            raise HTTPException(status_code=503, detail=f"Model not loaded ({load_status['model']['state']})")
         
         logger.info(f"Generating content for {request.topic_id}/{request.subtopic_id}")
         
+        stage_start = time.perf_counter()
+        
         # Step 1: Query ChromaDB for relevant curriculum content (RAG Retrieval)
         curriculum_content = ""
         try:
-            if chroma_collection is not None:
-                # Create comprehensive search queries for better retrieval
-                search_queries = [
-                    f"{request.subject_id} {request.topic_id} {request.subtopic_id}",
-                    f"{request.subject_id} grade {request.grade_id} {request.subtopic_id}",
-                    f"{request.subtopic_id} {request.subject_id} curriculum",
-                    f"{request.topic_id} {request.subtopic_id} learning content"
-                ]
-                
-                all_documents = []
-                for query in search_queries:
-                    results = chroma_collection.query(
-                        query_texts=[query],
-                        n_results=3,  # Get 3 results per query
-                        include=["documents", "metadatas"]
-                    )
-                    
-                    if results['documents'] and results['documents'][0]:
-                        all_documents.extend(results['documents'][0])
+            if retrieval is not None:
+                # 3 results per query
+                all_documents = await query_curriculum(content_search_queries(request), n_results=3)
                 
                 # Combine and deduplicate documents
                 if all_documents:
@@ -608,6 +1068,12 @@ async def generate_content(request: ContentRequest):
             logger.error(f"ChromaDB query failed during content generation: {e}")
             curriculum_content = ""
         
+        stage_start = observe_stage("generate-content", "retrieval", stage_start)
+        # Token counting may be a round trip to the inference server, so it runs in the thread pool
+        curriculum_content = await run_blocking(fit_curriculum, "generate-content",
+                                                lambda text: create_content_prompt_with_rag(request, text),
+                                                curriculum_content, CONTENT_CURRICULUM_CHARS)
+        
         # Step 2: Create RAG-enhanced prompt with retrieved content
         if curriculum_content.strip():
             prompt = create_content_prompt_with_rag(request, curriculum_content)
@@ -616,130 +1082,154 @@ async def generate_content(request: ContentRequest):
             prompt = create_content_prompt(request)
             logger.info("Using fallback prompt for content generation")
         
-        # Step 3: Generate content with the model
-        response_text = generate_text(prompt, max_length=2048)
+        stage_start = observe_stage("generate-content", "prompt_build", stage_start)
         
-        # Parse JSON response with enhanced extraction
-        try:
-            # Multiple attempts to extract JSON
-            content_data = None
-            
-            # Method 1: Look for JSON array
-            start_idx = response_text.find('[')
-            end_idx = response_text.rfind(']') + 1
-            
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response_text[start_idx:end_idx]
-                try:
-                    content_data = json.loads(json_str)
-                    logger.info(f"Successfully parsed JSON array with {len(content_data)} items")
-                except json.JSONDecodeError:
-                    logger.warning("Failed to parse extracted JSON array")
-            
-            # Method 2: If no array, try to extract JSON objects and wrap in array
-            if content_data is None:
-                import re
-                # Look for individual JSON objects
-                json_objects = re.findall(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response_text)
-                if json_objects:
-                    content_data = []
-                    for obj_str in json_objects:
-                        try:
-                            obj = json.loads(obj_str)
-                            if 'title' in obj and 'body' in obj:
-                                content_data.append(obj)
-                        except json.JSONDecodeError:
-                            continue
-                    
-                    if content_data:
-                        logger.info(f"Extracted {len(content_data)} JSON objects")
-            
-            # Method 3: If still no valid JSON, create structured content from text
-            if not content_data:
-                logger.warning("No valid JSON found, creating structured content from response")
-                lines = [line.strip() for line in response_text.split('\n') if line.strip()]
-                
-                if len(lines) >= 2:
-                    # Try to extract title and body from text
-                    title = lines[0].replace('"', '').replace('Title:', '').strip()
-                    body_lines = lines[1:]
-                    body = '<p>' + '</p><p>'.join(body_lines) + '</p>'
-                    
-                    content_data = [{
-                        "title": title or f"{request.subtopic_id.replace('-', ' ').title()} Content",
-                        "body": body,
-                        "card_type": "content"
-                    }]
-                else:
-                    # Last resort fallback
-                    content_data = [{
-                        "title": f"{request.subtopic_id.replace('-', ' ').title()} Content",
-                        "body": f"<p>{response_text}</p>",
-                        "card_type": "content"
-                    }]
-            
-            # Validate and create ContentCard objects
-            content_cards = []
-            for card_data in content_data:
-                try:
-                    # Ensure required fields exist
-                    if 'title' not in card_data:
-                        card_data['title'] = f"Content Card {len(content_cards) + 1}"
-                    if 'body' not in card_data:
-                        card_data['body'] = "<p>Content will be available soon.</p>"
-                    if 'card_type' not in card_data:
-                        card_data['card_type'] = "content"
-                    
-                    content_cards.append(ContentCard(**card_data))
-                except Exception as card_error:
-                    logger.warning(f"Error creating content card: {card_error}")
-                    continue
-            
-            # Ensure we have at least one card
-            if not content_cards:
-                content_cards = [ContentCard(
-                    title=f"{request.subtopic_id.replace('-', ' ').title()} Content",
-                    body=f"<p>Learning content for {request.subtopic_id.replace('-', ' ')}.</p>",
-                    card_type="content"
-                )]
-            
-        except Exception as e:
-            logger.error(f"Content parsing error: {e}")
-            # Ultimate fallback
-            content_cards = [ContentCard(
-                title=f"{request.subtopic_id.replace('-', ' ').title()} Content",
-                body=f"<p>Welcome to the lesson on {request.subtopic_id.replace('-', ' ')}.</p>",
-                card_type="content"
-            )]
+        # Step 3: Generate content with the model (or fill a server-built skeleton)
+        # Generation (and any continuation while parsing) blocks, so it runs in the thread pool
+        content_data = await run_blocking(generate_structured_items, prompt, request)
+        parse_method = "structured" if content_data else "canned"
+        response_text = "" if content_data else await run_blocking(generate_text, prompt, "generate-content",
+                                                                     request.num_cards)
+        stage_start = observe_stage("generate-content", "generate", stage_start)
         
-        return ContentResponse(
-            success=True,
-            content=content_cards,
-            metadata={
-                "topic_id": request.topic_id,
-                "subtopic_id": request.subtopic_id,
-                "grade_id": request.grade_id,
-                "num_cards": len(content_cards)
-            }
-        )
+        return await run_blocking(build_content_response, request, prompt, response_text, content_data,
+                                  parse_method, stage_start)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Content generation error: {e}")
         raise HTTPException(status_code=500, detail=f"Content generation failed: {str(e)}")
 
+BUNDLE_PARTS = ("content", "mid_quiz", "final_quiz")
+
+async def retrieve_bundle_curriculum(content_queries: List[str], quiz_queries: List[str]) -> Tuple[str, str]:
+    """Content and quiz curriculum for a lesson bundle from one batched ChromaDB query"""
+    if retrieval is None:
+        logger.warning("ChromaDB not available for lesson bundle generation")
+        return "", ""
+    try:
+        with span("chroma_query", queries=len(content_queries) + len(quiz_queries)):
+            results = await retrieval.query(
+                query_texts=content_queries + quiz_queries,
+                n_results=3,
+                include=["documents", "metadatas"]
+            )
+    except Exception as e:
+        logger.error(f"ChromaDB query failed during lesson bundle generation: {e}")
+        return "", ""
+    
+    documents = results['documents'] or []
+    content_documents = [doc for docs in documents[:len(content_queries)] for doc in docs]
+    quiz_documents = [doc for docs in documents[len(content_queries):] for doc in docs]
+    logger.info(f"Retrieved {len(content_documents)} content and {len(quiz_documents)} quiz curriculum documents")
+    return "\n".join(set(content_documents)), "\n".join(set(quiz_documents))
+
+def generate_bundle_parts(parts: Tuple[str, ...], bundle_requests: Dict, prompts: Dict[str, str],
+                          stage_start: float) -> Dict[str, Union[ContentResponse, QuizResponse]]:
+    """Generate the given lesson bundle parts as one batch and parse each into its response"""
+    structured = {part: generate_structured_items(prompts[part], bundle_requests[part]) for part in parts}
+    pending = [part for part in parts if structured[part] is None]
+    texts = dict.fromkeys(parts, "")
+    if pending:
+        endpoints = ["generate-content" if part == "content" else "generate-quiz" for part in pending]
+        items = [bundle_requests[part].num_cards if part == "content"
+                 else len(QUIZ_LAYOUTS.get(bundle_requests[part].quiz_type, QUIZ_LAYOUTS["final"])) for part in pending]
+        texts.update(zip(pending, generate_texts([prompts[part] for part in pending], endpoints, items)))
+    observe_stage("generate-lesson-bundle", "generate", stage_start)
+    
+    responses = {}
+    for part in parts:
+        parse_method = "structured" if structured[part] else "canned"
+        build_response = build_content_response if part == "content" else build_quiz_response
+        responses[part] = build_response(bundle_requests[part], prompts[part], texts[part], structured[part],
+                                         parse_method, time.perf_counter())
+    return responses
+
+async def stream_lesson_bundle(bundle_requests: Dict, prompts: Dict[str, str]):
+    """NDJSON lines: content first so it can render, then both quizzes generated as one batch
+
+    Two sequential generations instead of the non-streaming three-way batch: earlier content, later completion.
+    """
+    for parts in (("content",), ("mid_quiz", "final_quiz")):
+        try:
+            responses = await run_blocking(generate_bundle_parts, parts, bundle_requests, prompts,
+                                           time.perf_counter())
+        except Exception as e:
+            logger.error(f"Lesson bundle generation error: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield json.dumps({"part": "error", "detail": f"Lesson bundle generation failed: {detail}"}) + "\n"
+            return
+        for part in parts:
+            yield json.dumps({"part": part, "data": responses[part].model_dump()}) + "\n"
+
+@app.post("/generate-lesson-bundle", response_model=LessonBundleResponse)
+async def generate_lesson_bundle(request: LessonBundleRequest):
+    """Content plus mid and final quizzes for a subtopic from one retrieval and one batched generation"""
+    try:
+        if backend is None:
+            raise HTTPException(status_code=503, detail=f"Model not loaded ({load_status['model']['state']})")
+        
+        logger.info(f"Generating lesson bundle for {request.topic_id}/{request.subtopic_id}")
+        
+        stage_start = time.perf_counter()
+        fields = request.model_dump(include={"topic_id", "subtopic_id", "subject_id", "grade_id"})
+        bundle_requests = {
+            "content": ContentRequest(**fields, user_level=request.user_level, num_cards=request.num_cards),
+            "mid_quiz": QuizRequest(**fields, quiz_type="mid", difficulty=request.difficulty),
+            "final_quiz": QuizRequest(**fields, quiz_type="final", difficulty=request.difficulty),
+        }
+        
+        # Step 1: One ChromaDB round trip for all searches (mid and final quizzes share theirs)
+        content_curriculum, quiz_curriculum = await retrieve_bundle_curriculum(
+            content_search_queries(bundle_requests["content"]), quiz_search_queries(bundle_requests["mid_quiz"]))
+        stage_start = observe_stage("generate-lesson-bundle", "retrieval", stage_start)
+        
+        # Step 2: Prompts as the single-part endpoints build them
+        content_curriculum = await run_blocking(
+            fit_curriculum, "generate-content", lambda text: create_content_prompt_with_rag(bundle_requests["content"], text),
+            content_curriculum, CONTENT_CURRICULUM_CHARS)
+        if content_curriculum.strip():
+            prompts = {"content": create_content_prompt_with_rag(bundle_requests["content"], content_curriculum)}
+        else:
+            prompts = {"content": create_content_prompt(bundle_requests["content"])}
+        for part in ("mid_quiz", "final_quiz"):
+            part_curriculum = await run_blocking(
+                fit_curriculum, "generate-quiz", lambda text: create_quiz_prompt_with_rag(bundle_requests[part], text),
+                quiz_curriculum, QUIZ_CURRICULUM_CHARS)
+            if part_curriculum.strip():
+                prompts[part] = create_quiz_prompt_with_rag(bundle_requests[part], part_curriculum)
+            else:
+                prompts[part] = create_quiz_prompt_coseaq_fallback(bundle_requests[part])
+        stage_start = observe_stage("generate-lesson-bundle", "prompt_build", stage_start)
+        
+        # Step 3: Generate and parse
+        if request.stream:
+            return StreamingResponse(stream_lesson_bundle(bundle_requests, prompts), media_type="application/x-ndjson")
+        responses = await run_blocking(generate_bundle_parts, BUNDLE_PARTS, bundle_requests, prompts, stage_start)
+        return LessonBundleResponse(success=True, **responses)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Lesson bundle generation error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lesson bundle generation failed: {str(e)}")
+
 @app.post("/generate-topics", response_model=TopicDescriptionResponse)
 async def generate_topics(request: TopicDescriptionRequest):
     """Generate topic descriptions for a subject and grade using RAG"""
     try:
-        if model is None or tokenizer is None:
-            raise HTTPException(status_code=503, detail="Model not loaded")
+        if backend is None:
+            raise HTTPException(status_code=503, detail=f"Model not loaded ({load_status['model']['state']})")
         
         logger.info(f"Generating topics for {request.subject_id}, Grade {request.grade_id}")
         
+        stage_start = time.perf_counter()
+        
         # Step 1: Query ChromaDB for relevant curriculum content (RAG Retrieval)
         curriculum_content = ""
         try:
-            if chroma_collection is not None:
+            if retrieval is not None:
                 # Create comprehensive search queries for better retrieval
                 search_queries = [
                     f"{request.subject_id} grade {request.grade_id} topics curriculum",
@@ -748,16 +1238,7 @@ async def generate_topics(request: TopicDescriptionRequest):
                     f"physical education {request.grade_id}" if request.subject_id == "physical-education" else f"{request.subject_id} {request.grade_id}"
                 ]
                 
-                all_documents = []
-                for query in search_queries:
-                    results = chroma_collection.query(
-                        query_texts=[query],
-                        n_results=5,  # Get 5 results per query
-                        include=["documents", "metadatas"]
-                    )
-                    
-                    if results['documents'] and results['documents'][0]:
-                        all_documents.extend(results['documents'][0])
+                all_documents = await query_curriculum(search_queries, n_results=5)  # 5 results per query
                 
                 # Combine and deduplicate documents
                 if all_documents:
@@ -772,6 +1253,8 @@ async def generate_topics(request: TopicDescriptionRequest):
             logger.error(f"ChromaDB query failed: {e}")
             curriculum_content = ""
         
+        stage_start = observe_stage("generate-topics", "retrieval", stage_start)
+        
         # Step 2: Create RAG-enhanced prompt with retrieved content
         if curriculum_content.strip():
             prompt = create_topic_descriptions_prompt_with_rag(request, curriculum_content)
@@ -780,44 +1263,21 @@ async def generate_topics(request: TopicDescriptionRequest):
             prompt = create_topic_descriptions_prompt(request)
             logger.info("Using fallback prompt without RAG")
         
+        stage_start = observe_stage("generate-topics", "prompt_build", stage_start)
+        
         # Step 3: Generate topics with the model
-        response_text = generate_text(prompt, max_length=2048)
+        response_text = await run_blocking(generate_text, prompt, "generate-topics", request.num_topics)
+        stage_start = observe_stage("generate-topics", "generate", stage_start)
+        parse_method = "canned"
         
         # Parse JSON response with enhanced extraction
         try:
-            # Multiple attempts to extract JSON
-            topics_data = None
-            
-            # Method 1: Look for JSON array
-            start_idx = response_text.find('[')
-            end_idx = response_text.rfind(']') + 1
-            
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response_text[start_idx:end_idx]
-                try:
-                    topics_data = json.loads(json_str)
-                    logger.info(f"Successfully parsed topics JSON array with {len(topics_data)} topics")
-                except json.JSONDecodeError:
-                    logger.warning("Failed to parse extracted topics JSON array")
-            
-            # Method 2: If no array, try to extract JSON objects
-            if topics_data is None:
-                import re
-                json_objects = re.findall(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response_text)
-                if json_objects:
-                    topics_data = []
-                    for obj_str in json_objects:
-                        try:
-                            obj = json.loads(obj_str)
-                            if 'title' in obj and 'description' in obj:
-                                topics_data.append(obj)
-                        except json.JSONDecodeError:
-                            continue
-                    
-                    if topics_data:
-                        logger.info(f"Extracted {len(topics_data)} topics JSON objects")
+            # Method 1: The JSON array, or failing that every complete topic object in the response
+            topics_data, parse_method = await run_blocking(extract_json_items, prompt, response_text,
+                                                           "generate-topics", request.num_topics,
+                                                           ("title", "description"))
             
-            # Method 3: Create fallback topics if no valid JSON
+            # Method 2: Create fallback topics if no valid JSON
             if not topics_data:
                 logger.warning("No valid topics JSON found, creating fallback topics")
                 subject_examples = {
@@ -864,6 +1324,7 @@ async def generate_topics(request: TopicDescriptionRequest):
             
             # Ensure we have at least one topic
             if not topic_descriptions:
+                parse_method = "canned"
                 topic_descriptions = [TopicDescription(
                     topic_id="general-topic",
                     title=f"{request.subject_id.title()} Fundamentals",
@@ -873,6 +1334,7 @@ async def generate_topics(request: TopicDescriptionRequest):
             
         except Exception as e:
             logger.error(f"Topics parsing error: {e}")
+            parse_method = "canned"
             # Ultimate fallback
             topic_descriptions = [TopicDescription(
                 topic_id="fallback-topic",
@@ -881,6 +1343,9 @@ async def generate_topics(request: TopicDescriptionRequest):
                 level=1
             )]
         
+        PARSE_PATH.inc(endpoint="generate-topics", method=parse_method)
+        observe_stage("generate-topics", "parse", stage_start)
+        
         return TopicDescriptionResponse(
             success=True,
             topics=topic_descriptions,
@@ -891,6 +1356,8 @@ async def generate_topics(request: TopicDescriptionRequest):
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Topic generation error: {e}")
         raise HTTPException(status_code=500, detail=f"Topic generation failed: {str(e)}")
@@ -900,16 +1367,23 @@ async def generate_topics(request: TopicDescriptionRequest):
 async def search_curriculum(request: SearchRequest):
     """Search ChromaDB for curriculum content"""
     try:
-        if chroma_collection is None:
-            raise HTTPException(status_code=503, detail="ChromaDB not available")
+        if retrieval is None:
+            state = load_status["chromadb"]["state"]
+            raise HTTPException(status_code=503, detail="ChromaDB still loading" if state in ("pending", "loading") else "ChromaDB not available")
         
         logger.info(f"Searching curriculum for: {request.query}")
         
         # Query ChromaDB (simplified - no where clause to avoid operator errors)
-        results = chroma_collection.query(
-            query_texts=[request.query],
-            n_results=request.n_results
-        )
+        stage_start = time.perf_counter()
+        try:
+            with span("chroma_query", query=request.query):
+                results = await retrieval.query(
+                    query_texts=[request.query],
+                    n_results=request.n_results
+                )
+        except RetrievalUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        observe_stage("search-curriculum", "retrieval", stage_start)
         
         # Convert to response format
         documents = []
@@ -929,10 +1403,87 @@ async def search_curriculum(request: SearchRequest):
             total_results=len(documents)
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Curriculum search error: {e}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+@app.get("/generation-stats")
+async def get_generation_stats():
+    """Speculative decoding and structured generation statistics per endpoint"""
+    stats = {
+        "speculative_decoding": SPECULATIVE_DECODING,
+        "num_draft_tokens": SPECULATIVE_DRAFT_TOKENS,
+        "endpoints": speculative_stats.snapshot(),
+        "structured_generation": STRUCTURED_GENERATION,
+        "structured": structured_stats.snapshot(),
+        "token_budget": TOKEN_BUDGET,
+        "budgets": budget_model.snapshot()
+    }
+    if isinstance(backend, RemoteBackend):
+        # Decoding happens in the inference server, so its counters live there
+        try:
+            stats["inference_server"] = (await run_in_threadpool(backend.describe))["server"]
+        except Exception as e:
+            logger.error(f"Inference server stats unavailable: {e}")
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics: per-stage latency histograms, token, parse-path, cache and in-flight counters"""
+    text = render_metrics()
+    if isinstance(backend, RemoteBackend):
+        # Tokenize/prefill/decode and queue depth are recorded in the inference server
+        try:
+            text += await run_in_threadpool(backend.metrics_text)
+        except Exception as e:
+            logger.error(f"Inference server metrics unavailable: {e}")
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+def require_admin(token: Optional[str]):
+    """Admin endpoints are off unless ADMIN_TOKEN is set, and then need a matching X-Admin-Token header"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not hmac.compare_digest(token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/admin/profile")
+async def start_profiling(request: ProfileRequest, x_admin_token: Optional[str] = Header(None)):
+    """Profile the next N requests and/or T seconds (cProfile, pyinstrument or torch.profiler)"""
+    require_admin(x_admin_token)
+    try:
+        session = profiling.start_session(request.mode, request.requests, request.seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.describe()
+
+@app.get("/admin/profile")
+async def get_profiling_result(format: str = "json", x_admin_token: Optional[str] = Header(None)):
+    """State of the current or last profiling session; format=html returns the pyinstrument flamegraph"""
+    require_admin(x_admin_token)
+    session = profiling.last_session
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session has been run")
+    if format == "html":
+        if session.state != "done" or not session.artifact.endswith(".html"):
+            raise HTTPException(status_code=404, detail="No HTML flamegraph available (use mode 'pyinstrument')")
+        with open(session.artifact, "r", encoding="utf-8") as f:
+            return HTMLResponse(f.read())
+    return session.describe()
+
+@app.delete("/admin/profile")
+async def stop_profiling(x_admin_token: Optional[str] = Header(None)):
+    """Stop the running profiling session early"""
+    require_admin(x_admin_token)
+    if profiling.active_session is None:
+        raise HTTPException(status_code=404, detail="No profiling session is running")
+    session = profiling.active_session
+    session.stop()
+    return session.describe()
+
 @app.get("/chromadb-status")
 async def get_chromadb_status():
     """Get ChromaDB collection statistics"""
@@ -955,7 +1506,8 @@ async def get_chromadb_status():
             "collection_name": COLLECTION_NAME,
             "document_count": doc_count,
             "total_collections": len(collections),
-            "collection_exists": True
+            "collection_exists": True,
+            "retrieval": retrieval.describe() if retrieval is not None else None
         }
         
     except Exception as e:
@@ -973,8 +1525,9 @@ async def get_system_status():
     try:
         # AI Service Status
         ai_status = {
-            "status": "healthy" if model is not None else "unavailable",
-            "model_loaded": model is not None,
+            "status": "healthy" if backend is not None else "unavailable",
+            "model_loaded": backend is not None,
+            "backend": INFERENCE_BACKEND,
             "tokenizer_loaded": tokenizer is not None,
             "cuda_available": torch.cuda.is_available(),
             "device": "cuda" if torch.cuda.is_available() else "cpu"
@@ -997,11 +1550,13 @@ async def get_system_status():
                 "message": "ChromaDB not available"
             }
         
-        # Cache Status (placeholder for now)
+        # Cache Status (server-side caches record lookups in CACHE_REQUESTS)
+        cache_lookups = CACHE_REQUESTS.totals("result")
+        cache_total = int(sum(cache_lookups.values()))
         cache_status = {
             "enabled": True,
-            "hit_rate": 0,
-            "total_requests": 0
+            "hit_rate": round(cache_lookups.get("hit", 0) / cache_total, 3) if cache_total else 0,
+            "total_requests": cache_total
         }
         
         return SystemStatusResponse(
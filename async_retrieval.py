@@ -0,0 +1,139 @@
+"""
+Non-blocking ChromaDB queries for the async endpoints.
+
+chromadb's PersistentClient is synchronous (embedding + SQLite/HNSW reads), so
+AsyncRetrievalClient runs queries on a small thread pool and awaits them:
+- at most max_concurrency queries run at once; a slot is held until the worker
+  thread really finishes, so stuck reads cannot pile up threads
+- every query (including the wait for a slot) has a timeout
+- a circuit breaker opens after consecutive failures or timeouts, and queries
+  then fail immediately with RetrievalUnavailable until a trial query succeeds,
+  so endpoints fall back to non-RAG prompts instead of waiting
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+from metrics import RETRIEVAL_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+class RetrievalUnavailable(RuntimeError):
+    """The query timed out or was rejected by the open circuit breaker."""
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; after reset_seconds one trial call may pass."""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("ChromaDB circuit breaker closed")
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_cancelled(self):
+        """The call was cancelled before its outcome was known; a pending trial may be retried."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self._opened_at is None and self.failures >= self.failure_threshold):
+                logger.warning(f"ChromaDB circuit breaker open for {self.reset_seconds}s after {self.failures} failures")
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+class AsyncRetrievalClient:
+    """Awaitable collection.query() with a thread pool, concurrency limit, timeout and circuit breaker."""
+
+    def __init__(self, collection, max_concurrency: int = 4, timeout: float = 5.0,
+                 failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.collection = collection
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="chromadb")
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    def _release(self, future: asyncio.Future):
+        self._slots.release()
+        if not future.cancelled():
+            future.exception()  # Retrieved here so abandoned (timed out) failures are not reported as unhandled
+
+    def _failed(self, result: str):
+        RETRIEVAL_REQUESTS.inc(result=result)
+        self.breaker.record_failure()
+
+    async def query(self, **kwargs) -> dict:
+        """collection.query(**kwargs) without blocking the event loop."""
+        if not self.breaker.allow():
+            RETRIEVAL_REQUESTS.inc(result="circuit_open")
+            raise RetrievalUnavailable("ChromaDB circuit breaker is open")
+
+        try:
+            results = await self._run(**kwargs)
+        except asyncio.CancelledError:
+            # E.g. the client disconnected; without this a cancelled trial would keep the breaker open
+            self.breaker.record_cancelled()
+            raise
+        self.breaker.record_success()
+        RETRIEVAL_REQUESTS.inc(result="ok")
+        return results
+
+    async def _run(self, **kwargs) -> dict:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._failed("timeout")
+            raise RetrievalUnavailable(f"No ChromaDB slot free within {self.timeout}s")
+
+        future = loop.run_in_executor(self._executor, functools.partial(profiling.call, self.collection.query, **kwargs))
+        future.add_done_callback(self._release)
+        try:
+            # shield: a timed out query keeps its slot until the worker thread returns
+            return await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self._failed("timeout")
+            raise RetrievalUnavailable(f"ChromaDB query timed out after {self.timeout}s")
+        except Exception:
+            self._failed("error")
+            raise
+
+    def describe(self) -> dict:
+        return {"circuit_breaker": self.breaker.state, "consecutive_failures": self.breaker.failures,
+                "timeout_seconds": self.timeout, "max_concurrency": self.max_concurrency}
@@ -0,0 +1,279 @@
+"""
+Generation benchmark for the SmartClass model service.
+
+Runs a fixed set of prompts built with the service's own prompt builders through
+generate_text for each requested backend configuration (fp32, quantized,
+llama.cpp, speculative, stub) and records decode speed, prefill cost per prompt
+token, model size, peak RSS and the rate at which responses parse as the JSON the
+endpoints expect. Each configuration runs in a fresh process so peak RSS is its own.
+
+Results are written to a JSON file that can be saved as the baseline; later runs
+on the same corpus are compared against it and regressions fail the run:
+
+    python benchmark_generation.py --configs fp32 int8 --save-baseline
+    python benchmark_generation.py --configs fp32 int8          # exits 1 on regression
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+import api_model_service as service
+from api_model_service import ContentRequest, QuizRequest, create_content_prompt, create_quiz_prompt_coseaq_fallback
+from structured_generation import QUIZ_LAYOUTS
+from metrics import STAGE_SECONDS, TOKENS
+from quantization import model_size_mb
+from speculative import speculative_stats
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FILE = "./benchmark_results.json"
+BASELINE_FILE = "./benchmark_baseline.json"
+# A configuration fails the accuracy check if its JSON-validity rate drops more than this below fp32
+MAX_VALIDITY_DROP = 0.05
+# Relative change against the stored baseline that counts as a regression
+REGRESSION_TOLERANCE = 0.10
+SEED = 0
+
+# Service settings applied before loading each benchmarked configuration
+BENCHMARK_CONFIGS = {
+    "fp32": {"INFERENCE_BACKEND": "transformers", "QUANTIZATION": "none", "SPECULATIVE_DECODING": False},
+    "int8": {"INFERENCE_BACKEND": "transformers", "QUANTIZATION": "int8", "SPECULATIVE_DECODING": False},
+    "llama_cpp": {"INFERENCE_BACKEND": "llama_cpp", "QUANTIZATION": "none", "SPECULATIVE_DECODING": False},
+    "speculative": {"INFERENCE_BACKEND": "transformers", "QUANTIZATION": "none", "SPECULATIVE_DECODING": True},
+    "stub": {"INFERENCE_BACKEND": "stub", "QUANTIZATION": "none", "SPECULATIVE_DECODING": False},
+}
+CONTENT_CARDS = 3
+BASELINE_CONFIG = "fp32"
+
+BENCHMARK_LESSONS = [
+    ("mathematics", "math-numbers", "addition", "primary1"),
+    ("science", "sci-living", "plants", "primary3"),
+    ("english", "eng-reading", "comprehension", "primary4"),
+    ("social-studies", "soc-geography", "landforms", "primary5"),
+]
+
+REQUIRED_KEYS = {
+    "generate-content": {"title", "body"},
+    "generate-quiz": {"question", "correct_answer"},
+}
+
+# (metric, direction) checked against the baseline; +1 means higher is worse
+REGRESSION_CHECKS = [
+    ("tokens_per_second", -1),
+    ("prefill_ms_per_token", 1),
+    ("peak_rss_mb", 1),
+    ("model_mb", 1),
+]
+
+def build_prompt_corpus() -> List[Tuple[str, str, int]]:
+    """Return (endpoint, prompt, items requested) using the service prompt builders."""
+    corpus = []
+    for subject_id, topic_id, subtopic_id, grade_id in BENCHMARK_LESSONS:
+        fields = dict(subject_id=subject_id, topic_id=topic_id, subtopic_id=subtopic_id, grade_id=grade_id)
+        corpus.append(("generate-content", create_content_prompt(ContentRequest(num_cards=CONTENT_CARDS, **fields)),
+                       CONTENT_CARDS))
+        for quiz_type in ("mid", "final"):
+            corpus.append(("generate-quiz", create_quiz_prompt_coseaq_fallback(QuizRequest(quiz_type=quiz_type, **fields)),
+                           len(QUIZ_LAYOUTS[quiz_type])))
+    return corpus
+
+def corpus_fingerprint(corpus: List[Tuple[str, str, int]]) -> str:
+    """Short hash of the corpus; results are only comparable when it matches."""
+    digest = hashlib.sha256()
+    for endpoint, prompt, _ in corpus:
+        digest.update(f"{endpoint}\0{prompt}\0".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+def is_valid_response(endpoint: str, response_text: str) -> bool:
+    """True if the response contains a JSON array of objects with the endpoint's required keys."""
+    start_idx = response_text.find('[')
+    end_idx = response_text.rfind(']') + 1
+    if start_idx == -1 or end_idx <= start_idx:
+        return False
+    try:
+        data = json.loads(response_text[start_idx:end_idx])
+    except json.JSONDecodeError:
+        return False
+    return bool(data) and isinstance(data, list) and all(
+        isinstance(item, dict) and REQUIRED_KEYS[endpoint] <= item.keys() for item in data)
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return 0.0
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _stage_and_token_totals(endpoints: List[str]) -> Dict[str, float]:
+    """Prefill/decode seconds and prompt/generated tokens recorded by the backends so far."""
+    totals = {"prefill_s": 0.0, "decode_s": 0.0, "tokens_in": 0, "tokens_out": 0}
+    for endpoint in endpoints:
+        totals["prefill_s"] += STAGE_SECONDS.total(endpoint=endpoint, stage="prefill")[0]
+        totals["decode_s"] += STAGE_SECONDS.total(endpoint=endpoint, stage="decode")[0]
+        totals["tokens_in"] += TOKENS.value(endpoint=endpoint, direction="in")
+        totals["tokens_out"] += TOKENS.value(endpoint=endpoint, direction="out")
+    return totals
+
+def run_corpus(label: str, corpus: List[Tuple[str, str, int]]) -> Dict:
+    """Generate every prompt with the currently loaded model and collect metrics."""
+    torch.manual_seed(SEED)
+    endpoints = sorted({endpoint for endpoint, _, _ in corpus})
+    before = _stage_and_token_totals(endpoints)
+    generated_tokens = 0
+    valid = 0
+    elapsed = 0.0
+    for endpoint, prompt, items in corpus:
+        start_time = time.perf_counter()
+        response = service.generate_text(prompt, endpoint=endpoint, items=items)
+        elapsed += time.perf_counter() - start_time
+        generated_tokens += service.generated_tokens([response])[0]
+        valid += is_valid_response(endpoint, response)
+    after = _stage_and_token_totals(endpoints)
+    delta = {key: after[key] - before[key] for key in after}
+
+    result = {
+        "label": label,
+        "prompts": len(corpus),
+        "generated_tokens": generated_tokens,
+        "tokens_per_second": round(generated_tokens / elapsed, 2) if elapsed else 0.0,
+        "decode_tokens_per_second": round(delta["tokens_out"] / delta["decode_s"], 2) if delta["decode_s"] else None,
+        "prefill_ms_per_token": round(delta["prefill_s"] * 1000 / delta["tokens_in"], 3) if delta["tokens_in"] else None,
+        "seconds_per_prompt": round(elapsed / len(corpus), 3),
+        "json_validity_rate": round(valid / len(corpus), 3),
+        "model_mb": round(model_size_mb(service.model), 1) if isinstance(service.model, torch.nn.Module) else None,
+        "rss_mb": round(current_rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    if service.SPECULATIVE_DECODING:
+        result["speculative"] = speculative_stats.snapshot()
+    logger.info(f"[{label}] {result}")
+    return result
+
+def run_config(name: str) -> Dict:
+    """Load one configuration and benchmark it in the current process."""
+    for setting, value in BENCHMARK_CONFIGS[name].items():
+        setattr(service, setting, value)
+    # A fixed max_new_tokens, so results don't depend on budgets learned from earlier generations
+    service.TOKEN_BUDGET = False
+    service.model = service.backend = None
+    service.load_model_and_tokenizer()
+    return run_corpus(name, build_prompt_corpus())
+
+def benchmark_configs(config_names: List[str], isolate: bool = True) -> List[Dict]:
+    """Benchmark each configuration, by default in its own process so models and peak RSS don't accumulate."""
+    results = []
+    for name in config_names:
+        if isolate:
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                results.append(pool.apply(run_config, (name,)))
+        else:
+            results.append(run_config(name))
+
+    baseline = next((r for r in results if r["label"] == BASELINE_CONFIG), None)
+    if baseline is not None:
+        for result in results:
+            result["validity_drop"] = round(baseline["json_validity_rate"] - result["json_validity_rate"], 3)
+            result["speedup"] = round(result["tokens_per_second"] / baseline["tokens_per_second"], 2) if baseline["tokens_per_second"] else None
+            result["accuracy_check"] = "pass" if result["validity_drop"] <= MAX_VALIDITY_DROP else "fail"
+    return results
+
+def environment_info() -> Dict:
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.is_available(),
+    }
+
+def compare_to_baseline(report: Dict, baseline: Dict, tolerance: float = REGRESSION_TOLERANCE) -> List[str]:
+    """Regressions of this run against a baseline report for the same corpus."""
+    if baseline.get("corpus_id") != report["corpus_id"]:
+        logger.warning(f"Baseline corpus {baseline.get('corpus_id')} differs from {report['corpus_id']}; "
+                       "re-save the baseline to compare")
+        return []
+    baseline_results = {r["label"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        previous = baseline_results.get(result["label"])
+        if previous is None:
+            continue
+        for metric, direction in REGRESSION_CHECKS:
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > tolerance:
+                regressions.append(f"{result['label']}: {metric} {old} -> {new} ({change:+.0%})")
+        drop = previous["json_validity_rate"] - result["json_validity_rate"]
+        if drop > MAX_VALIDITY_DROP:
+            regressions.append(f"{result['label']}: json_validity_rate {previous['json_validity_rate']} -> "
+                               f"{result['json_validity_rate']}")
+    return regressions
+
+def load_baseline(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark generation speed and JSON validity.")
+    parser.add_argument("--configs", nargs="+", default=["fp32", "int8"], choices=list(BENCHMARK_CONFIGS),
+                        help=f"Configurations to compare (include '{BASELINE_CONFIG}' for the accuracy check)")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Stored results to check for regressions")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="Relative change that counts as a regression")
+    parser.add_argument("--no-isolate", action="store_true", help="Run all configurations in this process")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    results = benchmark_configs(args.configs, isolate=not args.no_isolate)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "corpus_id": corpus_fingerprint(build_prompt_corpus()),
+        "environment": environment_info(),
+        "results": results,
+    }
+
+    baseline = None if args.save_baseline else load_baseline(args.baseline)
+    report["regressions"] = compare_to_baseline(report, baseline, args.tolerance) if baseline else []
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    print(f"\n{'config':<22}{'tok/s':>8}{'speedup':>9}{'prefill ms/tok':>16}{'json ok':>9}{'model MB':>10}{'peak MB':>9}  check")
+    for r in results:
+        print(f"{r['label']:<22}{r['tokens_per_second']:>8}{str(r.get('speedup', '-')):>9}"
+              f"{str(r['prefill_ms_per_token']):>16}{r['json_validity_rate']:>9}{str(r['model_mb']):>10}{r['peak_rss_mb']:>9}"
+              f"  {r.get('accuracy_check', '-')}")
+    for regression in report["regressions"]:
+        print(f"REGRESSION {regression}")
+    if any(r.get("accuracy_check") == "fail" for r in results) or report["regressions"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
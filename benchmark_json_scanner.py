@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: JSONScanner vs. the endpoints' previous JSON extraction.
+
+The previous approach took the text between the first '[' and the last ']' and
+ran json.loads on it, and on failure ran a one-level-nesting regex over the
+whole response and json.loads on every match. Both are timed on typical model
+outputs (clean, wrapped in prose, truncated, with trailing commas or single
+quotes, nested) together with the number of objects each recovers.
+"""
+
+import argparse
+import json
+import re
+import timeit
+from typing import Dict, List
+
+from json_scanner import JSONScanner, scan_json_objects
+
+_LEGACY_OBJECT = re.compile(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}')
+
+def legacy_extract(response_text: str) -> List[Dict]:
+    """Method 1 + Method 2 as they were in generate_content/generate_topics."""
+    start_idx = response_text.find('[')
+    end_idx = response_text.rfind(']') + 1
+    if start_idx != -1 and end_idx > start_idx:
+        try:
+            return json.loads(response_text[start_idx:end_idx])
+        except json.JSONDecodeError:
+            pass
+    objects = []
+    for obj_str in _LEGACY_OBJECT.findall(response_text):
+        try:
+            objects.append(json.loads(obj_str))
+        except json.JSONDecodeError:
+            continue
+    return objects
+
+def _card(i: int) -> Dict:
+    return {"title": f"Card {i}: Counting Objects",
+            "body": "<p>We count objects one by one, saying one number for each object. " * 4 + "</p>",
+            "card_type": "content"}
+
+def build_cases(num_cards: int) -> Dict[str, str]:
+    cards = [_card(i) for i in range(num_cards)]
+    clean = json.dumps(cards, indent=2)
+    nested = json.dumps([{**card, "meta": {"source": {"pdf": "MATHS-B1-B3.pdf", "pages": [3, 4]}}} for card in cards])
+    return {
+        "clean": clean,
+        "prose": f"Here's the content you asked for:\n{clean}\nLet me know if you'd like more cards!",
+        "truncated": clean[:int(len(clean) * 0.8)],
+        "trailing_commas": clean.replace('"\n  }', '",\n  }').replace("}\n]", "},\n]"),
+        "single_quotes": clean.replace('"', "'"),
+        "nested": nested,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Time JSON extraction from model responses.")
+    parser.add_argument("--cards", type=int, default=5)
+    parser.add_argument("--number", type=int, default=2000, help="Calls per measurement")
+    args = parser.parse_args()
+
+    print(f"{'case':<17}{'legacy us':>10}{'objs':>6}{'scanner us':>12}{'objs':>6}{'stream us':>11}")
+    for name, text in build_cases(args.cards).items():
+        legacy_us = timeit.timeit(lambda: legacy_extract(text), number=args.number) / args.number * 1e6
+        scanner_us = timeit.timeit(lambda: scan_json_objects(text), number=args.number) / args.number * 1e6
+        # Incremental use: fed in ~4-character pieces, like decoded tokens
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+
+        def stream():
+            scanner = JSONScanner()
+            for piece in pieces:
+                scanner.feed(piece)
+        stream_us = timeit.timeit(stream, number=max(args.number // 10, 1)) / max(args.number // 10, 1) * 1e6
+        legacy_objects = len(legacy_extract(text))
+        scanner_objects = len(scan_json_objects(text).items)
+        print(f"{name:<17}{legacy_us:>10.1f}{legacy_objects:>6}{scanner_us:>12.1f}{scanner_objects:>6}{stream_us:>11.1f}")
+
+if __name__ == "__main__":
+    main()
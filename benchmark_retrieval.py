@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality-vs-latency benchmark.
+
+A labeled query set is built from the curriculum tree: every subtopic is mapped
+to the syllabus PDF pages of its subject that share the most keywords with its
+title and description. A retrieved chunk counts as relevant when it comes from
+one of those PDFs and overlaps one of those pages.
+
+Indexes under test are the service's persisted collection (`--include-existing`)
+and in-memory collections ingested for every CHUNK_SIZE x CHUNK_OVERLAP x
+embedding model combination given on the command line. Each index is queried in
+four modes:
+- "query": one query per call, like the endpoints
+- "filtered": restricted to the subject's PDFs with a where clause
+- "batched": `--batch-size` queries per call (latency is per query, amortized)
+- "exact": brute-force cosine over the stored embeddings, the recall ceiling for HNSW
+
+    python benchmark_retrieval.py --chunk-sizes 500 1000 --chunk-overlaps 0 150 \\
+        --embedding-models all-MiniLM-L6-v2 all-mpnet-base-v2 --include-existing
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import chromadb
+import numpy as np
+from chromadb.utils import embedding_functions
+
+from curriculum_tree import keywords, load_curriculum_tree, subject_for_pdf
+from pdftovector import (CHROMA_DB_PATH, CHUNK_OVERLAP, CHUNK_SIZE, COLLECTION_NAME, EMBEDDING_MODEL_NAME,
+                         PDF_DIRECTORY, chunk_text, extract_pages_from_pdf)
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FILE = "./retrieval_benchmark_results.json"
+K_VALUES = (1, 3, 5, 10)
+MODES = ("query", "filtered", "batched", "exact")
+QUERY_STYLES = ("natural", "service")
+# A page is labeled relevant when it shares at least this many keywords with the subtopic...
+MIN_LABEL_OVERLAP = 2
+# ...and scores within this fraction of the subtopic's best page
+LABEL_SCORE_FRACTION = 0.75
+MAX_LABEL_PAGES = 3
+ADD_BATCH_SIZE = 500
+
+class SyllabusText:
+    """The cleaned text of one PDF with page offsets, to map any chunk back to its pages."""
+
+    def __init__(self, pdf_name: str, pages: List[str]):
+        self.pdf_name = pdf_name
+        self.pages = pages
+        self.offsets = []
+        parts, position = [], 0
+        for page in pages:
+            self.offsets.append(position)
+            if page:
+                parts.append(page)
+                position += len(page) + 1
+        # Same text pdftovector ingests: non-empty pages joined by single spaces
+        self.text = ' '.join(parts)
+
+    def page_range(self, chunk: str) -> Optional[Tuple[int, int]]:
+        """First and last page (0-based) covered by chunk, or None if it is not in this PDF."""
+        start = self.text.find(chunk[:200])
+        if start == -1:
+            return None
+        first = bisect.bisect_right(self.offsets, start) - 1
+        last = bisect.bisect_right(self.offsets, start + len(chunk) - 1) - 1
+        return first, last
+
+def load_syllabus(pdf_directory: str) -> Dict[str, SyllabusText]:
+    syllabus = {}
+    for name in sorted(os.listdir(pdf_directory)):
+        if name.lower().endswith(".pdf"):
+            pages = extract_pages_from_pdf(os.path.join(pdf_directory, name))
+            if pages:
+                syllabus[name] = SyllabusText(name, pages)
+    return syllabus
+
+def _subject_matches(topic_subject: str, pdf_subject: Optional[str]) -> bool:
+    return pdf_subject is not None and topic_subject in (pdf_subject, pdf_subject.split('-')[0])
+
+def build_query_set(syllabus: Dict[str, SyllabusText], tree: List[Dict]) -> List[Dict]:
+    """One labeled query per subtopic that has at least one clearly matching page."""
+    page_keywords = {name: [keywords(page) for page in doc.pages] for name, doc in syllabus.items()}
+    queries = []
+    for topic in tree:
+        pdfs = [name for name in syllabus if _subject_matches(topic["subject_id"], subject_for_pdf(name))]
+        for subtopic in topic["subtopics"]:
+            words = keywords(f"{subtopic['title']} {subtopic['description']}")
+            relevant = {}
+            for name in pdfs:
+                scores = [len(words & page_words) for page_words in page_keywords[name]]
+                best = max(scores, default=0)
+                if best < MIN_LABEL_OVERLAP:
+                    continue
+                threshold = max(MIN_LABEL_OVERLAP, best * LABEL_SCORE_FRACTION)
+                ranked = sorted(range(len(scores)), key=lambda page: -scores[page])
+                relevant[name] = sorted(page for page in ranked[:MAX_LABEL_PAGES] if scores[page] >= threshold)
+            if not relevant:
+                continue
+            queries.append({
+                "subject_id": topic["subject_id"],
+                "topic_id": topic["topic_id"],
+                "subtopic_id": subtopic["subtopic_id"],
+                "natural": f"{subtopic['title']}: {subtopic['description']}",
+                # The first query the content endpoint sends
+                "service": f"{topic['subject_id']} {topic['topic_id']} {subtopic['subtopic_id']}",
+                "relevant": relevant,
+            })
+    return queries
+
+def ingest(client, syllabus: Dict[str, SyllabusText], name: str, chunk_size: int, chunk_overlap: int,
+           embedding_model: str):
+    """Chunk every PDF the way pdftovector does and add it to a fresh collection."""
+    embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=embedding_model)
+    collection = client.create_collection(name=name, embedding_function=embedding_function,
+                                          metadata={"hnsw:space": "cosine"})
+    documents, metadatas, ids = [], [], []
+    for pdf_name, doc in syllabus.items():
+        stem = pdf_name.rsplit('.', 1)[0]
+        for i, chunk in enumerate(chunk_text(doc.text, chunk_size, chunk_overlap)):
+            documents.append(chunk)
+            metadatas.append({"source_pdf": pdf_name, "chunk_number": i + 1})
+            ids.append(f"{stem}_chunk_{i + 1}")
+    start_time = time.perf_counter()
+    for start in range(0, len(documents), ADD_BATCH_SIZE):
+        end = start + ADD_BATCH_SIZE
+        collection.add(documents=documents[start:end], metadatas=metadatas[start:end], ids=ids[start:end])
+    logger.info(f"Ingested {len(documents)} chunks into {name} in {time.perf_counter() - start_time:.1f}s")
+    return collection, embedding_function, len(documents)
+
+def relevance_ranks(query: Dict, metadatas: List[Dict], documents: List[str],
+                    syllabus: Dict[str, SyllabusText]) -> List[List[Tuple[str, int]]]:
+    """For each retrieved chunk, the relevant (pdf, page) pairs it covers (empty when irrelevant)."""
+    ranks = []
+    for metadata, document in zip(metadatas, documents):
+        pdf_name = (metadata or {}).get("source_pdf")
+        pages = query["relevant"].get(pdf_name)
+        covered = []
+        if pages and pdf_name in syllabus:
+            page_range = syllabus[pdf_name].page_range(document)
+            if page_range is not None:
+                covered = [(pdf_name, page) for page in pages if page_range[0] <= page <= page_range[1]]
+        ranks.append(covered)
+    return ranks
+
+def score_query(ranks: List[List[Tuple[str, int]]], total_relevant: int) -> Dict[str, float]:
+    scores = {}
+    for k in K_VALUES:
+        covered = {pair for hit in ranks[:k] for pair in hit}
+        scores[f"recall@{k}"] = len(covered) / total_relevant
+    first_hit = next((rank for rank, hit in enumerate(ranks, 1) if hit), None)
+    scores["mrr"] = 1 / first_hit if first_hit else 0.0
+    return scores
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 2)
+
+def _subject_filter(query: Dict, syllabus: Dict[str, SyllabusText]) -> Dict:
+    pdfs = [name for name in syllabus if _subject_matches(query["subject_id"], subject_for_pdf(name))]
+    return {"source_pdf": pdfs[0]} if len(pdfs) == 1 else {"source_pdf": {"$in": pdfs}}
+
+class ExactIndex:
+    """Brute-force cosine search over a collection's stored embeddings."""
+
+    def __init__(self, collection, embedding_function):
+        stored = collection.get(include=["embeddings", "metadatas", "documents"])
+        vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+        self.vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self.metadatas = stored["metadatas"]
+        self.documents = stored["documents"]
+        self.embedding_function = embedding_function
+
+    def query(self, text: str, n_results: int) -> Tuple[List[Dict], List[str]]:
+        vector = np.asarray(self.embedding_function([text])[0], dtype=np.float32)
+        similarities = self.vectors @ (vector / max(np.linalg.norm(vector), 1e-12))
+        n_results = min(n_results, len(similarities))
+        top = np.argpartition(-similarities, n_results - 1)[:n_results]
+        top = top[np.argsort(-similarities[top])]
+        return [self.metadatas[i] for i in top], [self.documents[i] for i in top]
+
+def evaluate(collection, embedding_function, queries: List[Dict], syllabus: Dict[str, SyllabusText],
+             style: str, modes: List[str], batch_size: int) -> Dict[str, Dict]:
+    """recall@k, MRR and per-query latency for each mode."""
+    n_results = max(K_VALUES)
+    include = ["documents", "metadatas"]
+    results = {}
+    for mode in modes:
+        latencies, rows = [], []
+        if mode == "batched":
+            for start in range(0, len(queries), batch_size):
+                batch = queries[start:start + batch_size]
+                start_time = time.perf_counter()
+                response = collection.query(query_texts=[q[style] for q in batch], n_results=n_results, include=include)
+                elapsed_ms = (time.perf_counter() - start_time) * 1000
+                latencies.extend([elapsed_ms / len(batch)] * len(batch))
+                rows.extend(zip(batch, response["metadatas"], response["documents"]))
+        elif mode == "exact":
+            index = ExactIndex(collection, embedding_function)
+            for query in queries:
+                start_time = time.perf_counter()
+                metadatas, documents = index.query(query[style], n_results)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+                rows.append((query, metadatas, documents))
+        else:
+            for query in queries:
+                where = _subject_filter(query, syllabus) if mode == "filtered" else None
+                start_time = time.perf_counter()
+                response = collection.query(query_texts=[query[style]], n_results=n_results, where=where,
+                                            include=include)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+                rows.append((query, response["metadatas"][0], response["documents"][0]))
+
+        per_query = [score_query(relevance_ranks(query, metadatas, documents, syllabus),
+                                 sum(len(pages) for pages in query["relevant"].values()))
+                     for query, metadatas, documents in rows]
+        summary = {name: round(sum(s[name] for s in per_query) / len(per_query), 4) for name in per_query[0]}
+        summary["latency_ms"] = {"p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95),
+                                 "p99": percentile(latencies, 0.99)}
+        results[mode] = summary
+    return results
+
+def index_configs(args) -> List[Tuple[int, int, str]]:
+    return [(size, overlap, model) for size, overlap, model in
+            itertools.product(args.chunk_sizes, args.chunk_overlaps, args.embedding_models) if overlap < size]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure retrieval recall/MRR and latency across index settings.")
+    parser.add_argument("--pdf-dir", default=PDF_DIRECTORY)
+    parser.add_argument("--chunk-sizes", nargs="+", type=int, default=[CHUNK_SIZE])
+    parser.add_argument("--chunk-overlaps", nargs="+", type=int, default=[CHUNK_OVERLAP])
+    parser.add_argument("--embedding-models", nargs="+", default=[EMBEDDING_MODEL_NAME])
+    parser.add_argument("--include-existing", action="store_true",
+                        help=f"Also benchmark the persisted collection in {CHROMA_DB_PATH}")
+    parser.add_argument("--no-sweep", action="store_true", help="Only benchmark the persisted collection")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--query-styles", nargs="+", default=list(QUERY_STYLES), choices=QUERY_STYLES)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-queries", type=int, default=None)
+    parser.add_argument("--queries-file", default=None, help="Write (or, if it exists, reuse) the labeled query set")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    return parser.parse_args()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    syllabus = load_syllabus(args.pdf_dir)
+
+    if args.queries_file and os.path.exists(args.queries_file):
+        with open(args.queries_file, 'r', encoding='utf-8') as f:
+            queries = json.load(f)
+    else:
+        queries = build_query_set(syllabus, load_curriculum_tree())
+        if args.queries_file:
+            with open(args.queries_file, 'w', encoding='utf-8') as f:
+                json.dump(queries, f, indent=2)
+    queries = queries[:args.max_queries] if args.max_queries else queries
+    if not queries:
+        raise SystemExit(f"No labeled queries could be built from {args.pdf_dir}")
+    logger.info(f"{len(queries)} labeled queries over {len(syllabus)} PDFs")
+
+    indexes = []
+    if args.include_existing or args.no_sweep:
+        embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME)
+        collection = chromadb.PersistentClient(path=CHROMA_DB_PATH).get_collection(
+            name=COLLECTION_NAME, embedding_function=embedding_function)
+        indexes.append(({"index": "existing", "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP,
+                         "embedding_model": EMBEDDING_MODEL_NAME, "chunks": collection.count()},
+                        lambda: (collection, embedding_function)))
+    if not args.no_sweep:
+        client = chromadb.EphemeralClient()
+        for i, (size, overlap, model) in enumerate(index_configs(args)):
+            config = {"index": f"sweep-{i}", "chunk_size": size, "chunk_overlap": overlap, "embedding_model": model}
+
+            def build(config=config):
+                collection, embedding_function, chunks = ingest(client, syllabus, f"bench_{config['index']}",
+                                                               config["chunk_size"], config["chunk_overlap"],
+                                                               config["embedding_model"])
+                config["chunks"] = chunks
+                return collection, embedding_function
+            indexes.append((config, build))
+
+    report = []
+    for config, build in indexes:
+        collection, embedding_function = build()
+        for style in args.query_styles:
+            for mode, scores in evaluate(collection, embedding_function, queries, syllabus, style,
+                                         args.modes, args.batch_size).items():
+                report.append({**config, "query_style": style, "mode": mode, **scores})
+        if config["index"] != "existing":
+            client.delete_collection(collection.name)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"queries": len(queries), "results": report}, f, indent=2)
+
+    print(f"\n{'index':<10}{'chunk':>6}{'ovl':>5} {'model':<22}{'style':<9}{'mode':<9}"
+          f"{'R@1':>6}{'R@5':>6}{'R@10':>6}{'MRR':>6}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}")
+    for r in report:
+        latency = r["latency_ms"]
+        print(f"{r['index']:<10}{r['chunk_size']:>6}{r['chunk_overlap']:>5} {r['embedding_model'][:21]:<22}"
+              f"{r['query_style']:<9}{r['mode']:<9}{r['recall@1']:>6.2f}{r['recall@5']:>6.2f}{r['recall@10']:>6.2f}"
+              f"{r['mrr']:>6.2f}{latency['p50']:>8}{latency['p95']:>8}{latency['p99']:>8}")
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Throughput comparison between one service process and pre-forked workers.
+
+For each worker count the service is started with `start_api.py --workers N`,
+warmed up, and then hit with a fixed number of concurrent clients for a fixed
+duration. Requests/s and latency percentiles are printed side by side.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+QUIZ_REQUEST = {
+    "topic_id": "math-numbers",
+    "subtopic_id": "counting",
+    "subject_id": "mathematics",
+    "grade_id": "primary1",
+    "quiz_type": "mid",
+    "difficulty": 1
+}
+
+def wait_until_ready(base_url: str, timeout: float = 900) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=5).json().get("model_loaded"):
+                return True
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        time.sleep(2)
+    return False
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def drive_load(base_url: str, concurrency: int, duration: float) -> dict:
+    """Keep `concurrency` requests in flight for `duration` seconds."""
+    deadline = time.time() + duration
+
+    def client():
+        latencies, errors = [], 0
+        while time.time() < deadline:
+            start_time = time.perf_counter()
+            try:
+                response = requests.post(f"{base_url}/generate-quiz", json=QUIZ_REQUEST, timeout=300)
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start_time)
+                else:
+                    errors += 1
+            except requests.exceptions.RequestException:
+                errors += 1
+        return latencies, errors
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda _: client(), range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "requests_per_second": round(len(latencies) / elapsed, 3),
+        "p50_s": round(statistics.median(latencies), 2) if latencies else 0.0,
+        "p95_s": round(percentile(latencies, 0.95), 2),
+    }
+
+def benchmark_workers(worker_counts: list, port: int, concurrency: int, duration: float) -> list:
+    base_url = f"http://127.0.0.1:{port}"
+    results = []
+    for workers in worker_counts:
+        server = subprocess.Popen([sys.executable, "start_api.py", "--workers", str(workers), "--port", str(port)])
+        try:
+            if not wait_until_ready(base_url):
+                raise RuntimeError(f"Service with {workers} workers did not become ready")
+            # One request per worker so no measurement pays first-call costs
+            drive_load(base_url, workers, 1)
+            result = {"workers": workers, **drive_load(base_url, concurrency, duration)}
+            print(result)
+            results.append(result)
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare throughput of one process vs. pre-forked workers.")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, max(2, (os.cpu_count() or 2) // 4)])
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=120, help="Seconds of load per configuration")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    results = benchmark_workers(args.workers, args.port, args.concurrency, args.duration)
+    baseline = results[0]["requests_per_second"] if results else 0
+    print(f"\n{'workers':>8}{'req/s':>9}{'speedup':>9}{'p50 s':>8}{'p95 s':>8}{'errors':>8}")
+    for r in results:
+        speedup = round(r["requests_per_second"] / baseline, 2) if baseline else "-"
+        print(f"{r['workers']:>8}{r['requests_per_second']:>9}{speedup:>9}{r['p50_s']:>8}{r['p95_s']:>8}{r['errors']:>8}")
+
+if __name__ == "__main__":
+    main()
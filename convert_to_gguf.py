@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Convert the merged fine-tuned model to a quantized GGUF file for the llama.cpp backend.
+
+Steps:
+1. Make sure the pre-merged safetensors artifact exists (model_artifact.py export).
+2. Run llama.cpp's convert_hf_to_gguf.py to produce an f16 GGUF.
+3. Run llama-quantize to the requested type (Q4_K_M by default).
+
+Requires a llama.cpp checkout (pass --llama-cpp-dir or set LLAMA_CPP_DIR).
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+from model_artifact import MERGED_MODEL_PATH, export_merged_model, find_merged_artifact
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LLAMA_CPP_DIR = os.getenv("LLAMA_CPP_DIR", "./llama.cpp")
+DEFAULT_QUANT_TYPE = "Q4_K_M"
+
+def find_quantize_binary(llama_cpp_dir: str) -> str:
+    """Locate llama-quantize in a llama.cpp build tree or on PATH."""
+    candidates = [
+        os.path.join(llama_cpp_dir, "build", "bin", "llama-quantize"),
+        os.path.join(llama_cpp_dir, "llama-quantize"),
+        shutil.which("llama-quantize"),
+    ]
+    for candidate in candidates:
+        if candidate and os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(f"llama-quantize not found; build llama.cpp in {llama_cpp_dir} first")
+
+def convert(merged_dir: str, output_path: str, quant_type: str, llama_cpp_dir: str) -> str:
+    """Convert the merged HF model to GGUF and quantize it; returns the output path."""
+    if find_merged_artifact(merged_dir) is None:
+        logging.info(f"No up-to-date merged artifact at {merged_dir}, exporting it first...")
+        export_merged_model(merged_dir)
+
+    convert_script = os.path.join(llama_cpp_dir, "convert_hf_to_gguf.py")
+    if not os.path.exists(convert_script):
+        raise FileNotFoundError(f"{convert_script} not found; pass --llama-cpp-dir or set LLAMA_CPP_DIR")
+
+    f16_path = os.path.splitext(output_path)[0] + ".f16.gguf"
+    logging.info(f"Converting {merged_dir} to {f16_path}...")
+    subprocess.run([sys.executable, convert_script, merged_dir, "--outfile", f16_path, "--outtype", "f16"], check=True)
+
+    if quant_type.upper() == "F16":
+        os.replace(f16_path, output_path)
+    else:
+        logging.info(f"Quantizing to {quant_type}...")
+        subprocess.run([find_quantize_binary(llama_cpp_dir), f16_path, output_path, quant_type], check=True)
+        os.remove(f16_path)
+
+    logging.info(f"Wrote {output_path} ({os.path.getsize(output_path) / (1024 * 1024):.0f} MB)")
+    return output_path
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert the merged SmartClass model to GGUF for llama.cpp.")
+    parser.add_argument("--merged-dir", default=MERGED_MODEL_PATH)
+    parser.add_argument("--quant-type", default=DEFAULT_QUANT_TYPE, help="llama-quantize type, e.g. Q4_K_M, Q8_0 or F16")
+    parser.add_argument("--output", default=None, help="Output .gguf path")
+    parser.add_argument("--llama-cpp-dir", default=LLAMA_CPP_DIR)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    output_path = args.output or f"{args.merged_dir.rstrip('/')}.{args.quant_type}.gguf"
+    convert(args.merged_dir, output_path, args.quant_type, args.llama_cpp_dir)
+
+if __name__ == "__main__":
+    main()
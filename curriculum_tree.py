@@ -0,0 +1,84 @@
+"""
+Curriculum tree helpers shared by the data and benchmark scripts.
+Reads the topic/subtopic tree from the frontend data files and maps
+syllabus PDFs to the subject and grade ids used by the API.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+TOPICS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "smartclass", "data", "topics.ts")
+
+# Syllabus PDF filename keywords -> subject id used by the frontend and API
+PDF_SUBJECT_KEYWORDS = [
+    ("RELIGIOUS", "religious-moral-education"),
+    ("PHYSICAL", "physical-education"),
+    ("CREATIVE", "creative-arts"),
+    ("CAREER", "career-technology"),
+    ("COMPUTING", "computing"),
+    ("GHANAIAN", "ghanaian-language"),
+    ("FRENCH", "french-language"),
+    ("ENGLISH", "english-language"),
+    ("MATHS", "mathematics"),
+    ("SCIENCE", "science"),
+    ("OUR-WORLD", "social-studies"),
+    ("SOCIAL", "social-studies"),
+    ("HISTORY", "social-studies"),
+]
+
+_GRADE_RANGE = re.compile(r"B(\d)-B(\d)", re.IGNORECASE)
+_TOPIC_BLOCK = re.compile(r'\{\s*id:\s*"([^"]+)",\s*subjectId:\s*"([^"]+)",\s*title:\s*"([^"]+)"(.*?)\n  \},', re.DOTALL)
+_SUBTOPIC = re.compile(r'id:\s*"([^"]+)",\s*title:\s*"([^"]+)",\s*description:\s*"([^"]*)"')
+
+def subject_for_pdf(source_pdf: str) -> Optional[str]:
+    """Map a syllabus PDF filename to a subject id, or None if it is not recognised."""
+    name = os.path.basename(source_pdf).upper()
+    for keyword, subject_id in PDF_SUBJECT_KEYWORDS:
+        if keyword in name:
+            return subject_id
+    return None
+
+def grades_for_pdf(source_pdf: str) -> List[str]:
+    """Map a syllabus PDF filename (e.g. SCIENCE-LOWER-PRIMARY-B1-B3.pdf) to primary grade ids."""
+    match = _GRADE_RANGE.search(os.path.basename(source_pdf))
+    if not match:
+        return [f"primary{i}" for i in range(1, 7)]
+    low, high = int(match.group(1)), int(match.group(2))
+    return [f"primary{i}" for i in range(low, high + 1)]
+
+def load_curriculum_tree(topics_file: str = TOPICS_FILE) -> List[Dict]:
+    """
+    Parse the topic tree out of smartclass/data/topics.ts.
+    Returns a list of {"subject_id", "topic_id", "title", "subtopics": [{"subtopic_id", "title", "description"}]}.
+    """
+    with open(topics_file, 'r', encoding='utf-8') as f:
+        source = f.read()
+
+    tree = []
+    for topic_id, subject_id, title, body in _TOPIC_BLOCK.findall(source):
+        subtopics = [
+            {"subtopic_id": sub_id, "title": sub_title, "description": sub_description}
+            for sub_id, sub_title, sub_description in _SUBTOPIC.findall(body)
+        ]
+        tree.append({"subject_id": subject_id, "topic_id": topic_id, "title": title, "subtopics": subtopics})
+    return tree
+
+_STOPWORDS = {"the", "and", "for", "with", "from", "that", "this", "are", "learn", "learning", "understanding", "concept"}
+
+def keywords(text: str) -> set:
+    """Lower-case words of 3+ letters, minus stopwords, for overlap scoring."""
+    return {word for word in re.findall(r"[a-z]{3,}", text.lower()) if word not in _STOPWORDS}
+
+def best_subtopic_for_text(tree: List[Dict], subject_id: Optional[str], text: str) -> Optional[Tuple[str, str]]:
+    """Pick the (topic_id, subtopic_id) whose title/description shares the most words with text."""
+    text_words = keywords(text)
+    best, best_score = None, 0
+    for topic in tree:
+        if subject_id and topic["subject_id"] not in (subject_id, subject_id.split('-')[0]):
+            continue
+        for subtopic in topic["subtopics"]:
+            score = len(text_words & keywords(f"{subtopic['title']} {subtopic['description']}"))
+            if score > best_score:
+                best, best_score = (topic["topic_id"], subtopic["subtopic_id"]), score
+    return best
@@ -1,39 +1,144 @@
+import argparse
 import json
 import logging
+import multiprocessing as mp
+import re
+import time
+from collections import deque
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def fix_jsonl_format(input_file: str, output_file: str):
+# Streaming parameters
+READ_BUFFER_SIZE = 4 * 1024 * 1024  # Characters read per buffer
+RECORD_SEPARATOR = '\n\n'
+RECORDS_PER_TASK = 2000  # Records handed to a worker process at a time
+TASKS_IN_FLIGHT_PER_WORKER = 2  # Submitted but unwritten tasks, so reading never runs far ahead of writing
+
+# Characters that mean the record is not clean text: controls other than tab/newline, and U+FFFD from a bad decode
+_BAD_CHARACTERS = re.compile('[\x00-\x08\x0b-\x1f\x7f\ufffd]')
+
+def iter_records(f, buffer_size: int = READ_BUFFER_SIZE, separator: str = RECORD_SEPARATOR):
+    """
+    Yield the same chunks as f.read().split(separator), reading fixed-size buffers
+    so only one buffer plus the current partial record is held in memory.
+    """
+    pending = []  # Pieces of the current, unfinished record
+    while True:
+        buffer = f.read(buffer_size)
+        if not buffer:
+            break
+        # Only re-split when a separator can occur in this buffer (including across the boundary),
+        # so one very long record costs linear rather than quadratic time
+        boundary = pending[-1][-(len(separator) - 1):] if pending else ''
+        if separator not in boundary + buffer:
+            pending.append(buffer)
+            continue
+        parts = (''.join(pending) + buffer).split(separator)
+        # The last part may continue in the next buffer
+        pending = [parts.pop()]
+        yield from parts
+    yield ''.join(pending)
+
+def is_valid_text(text: str) -> bool:
+    """A usable training record: some letters or digits, and no control or replacement characters."""
+    return any(ch.isalnum() for ch in text) and not _BAD_CHARACTERS.search(text)
+
+def _format_records(chunks: list, validate: bool = False) -> tuple:
+    """Turn raw chunks into JSONL lines; returns (text, records, invalid)."""
+    lines = []
+    invalid = 0
+    for chunk in chunks:
+        text = chunk.strip()
+        if text:  # Skip empty chunks
+            if validate and not is_valid_text(text):
+                invalid += 1
+                continue
+            # Create a properly formatted JSON object, written as a single line
+            lines.append(json.dumps({"text": text}) + '\n')
+    return ''.join(lines), len(lines), invalid
+
+def _format_task(task: tuple) -> tuple:
+    return _format_records(*task)
+
+def _ordered_results(pool, tasks, max_in_flight: int):
+    """Results of _format_task in task order, submitting at most max_in_flight tasks ahead of the consumer."""
+    in_flight = deque()
+    for task in tasks:
+        in_flight.append(pool.apply_async(_format_task, (task,)))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().get()
+    while in_flight:
+        yield in_flight.popleft().get()
+
+def _batched(records, size: int):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def fix_jsonl_format(input_file: str, output_file: str, workers: int = 0, validate: bool = False,
+                     buffer_size: int = READ_BUFFER_SIZE):
     """
     Fix the format of the JSONL file by ensuring each line is a valid JSON object
     with a 'text' field.
+
+    The input is streamed in fixed-size buffers. With workers > 0, batches of
+    records are encoded (and optionally validated) in worker processes, with a
+    bounded number of batches in flight; output order always matches input order.
     """
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        # Split content into chunks (assuming each chunk is separated by newlines)
-        chunks = content.split('\n\n')
-        
-        # Write properly formatted JSONL
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for chunk in chunks:
-                if chunk.strip():  # Skip empty chunks
-                    # Create a properly formatted JSON object
-                    json_obj = {
-                        "text": chunk.strip()
-                    }
-                    # Write as a single line of JSON
-                    f.write(json.dumps(json_obj) + '\n')
-        
+        start_time = time.perf_counter()
+        records_written = 0
+        invalid_records = 0
+
+        with open(input_file, 'r', encoding='utf-8') as f_in, open(output_file, 'w', encoding='utf-8') as f_out:
+            tasks = ((batch, validate) for batch in _batched(iter_records(f_in, buffer_size), RECORDS_PER_TASK))
+
+            if workers > 0:
+                pool = mp.get_context("spawn").Pool(workers)
+                # Unlike imap, which drains the task generator as fast as it can, this reads the
+                # input only as fast as results are written
+                results = _ordered_results(pool, tasks, workers * TASKS_IN_FLIGHT_PER_WORKER)
+            else:
+                pool = None
+                results = map(_format_task, tasks)
+
+            try:
+                for text, count, invalid in results:
+                    f_out.write(text)
+                    records_written += count
+                    invalid_records += invalid
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+
+        elapsed = time.perf_counter() - start_time
+        rate = records_written / elapsed if elapsed > 0 else float('inf')
         logging.info(f"Successfully reformatted data from {input_file} to {output_file}")
-        
+        logging.info(f"Wrote {records_written} records in {elapsed:.2f}s ({rate:.0f} records/s)"
+                     + (f", skipped {invalid_records} invalid records" if validate else ""))
+        return records_written
+
     except Exception as e:
         logging.error(f"Error processing file: {e}")
         raise
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reformat blank-line separated text into JSONL with a 'text' field.")
+    parser.add_argument("input_file", nargs="?", default="syllabus_finetune_data.jsonl")
+    parser.add_argument("output_file", nargs="?", default="syllabus_finetune_data_fixed.jsonl")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes for encoding/validation (0 = in-process)")
+    parser.add_argument("--validate", action="store_true",
+                        help="Drop records without letters or digits, or with control or U+FFFD characters")
+    parser.add_argument("--buffer-size", type=int, default=READ_BUFFER_SIZE, help="Characters read per buffer")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    input_file = "syllabus_finetune_data.jsonl"
-    output_file = "syllabus_finetune_data_fixed.jsonl"
-    fix_jsonl_format(input_file, output_file) 
\ No newline at end of file
+    args = parse_args()
+    fix_jsonl_format(args.input_file, args.output_file, args.workers, args.validate, args.buffer_size)
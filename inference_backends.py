@@ -0,0 +1,532 @@
+"""
+Pluggable inference backends behind generate_text.
+
+Every backend takes a prompt and returns the generated continuation (without
+the prompt). The service picks one with INFERENCE_BACKEND:
+- "transformers": the merged fine-tuned model in PyTorch (optionally quantized)
+- "llama_cpp": a GGUF copy of the merged model served by llama-cpp-python
+- "remote": a client for the model-owning inference_server.py process
+- "stub": canned responses without a model, for tests and load generation
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+
+import torch
+from transformers import DynamicCache, StoppingCriteria, StoppingCriteriaList
+
+from ipc_protocol import (COUNT_PROMPT_TOKENS, COUNT_TOKENS, DEFAULT_SOCKET_PATH, DESCRIBE, ERROR, GENERATE, METRICS,
+                          UINT32, ProtocolError, encode_frame, pack_generate, read_frame, unpack_result)
+from metrics import CACHE_REQUESTS, STAGE_SECONDS, TOKENS, observe_stage
+from prompt_tokens import PromptTokenCache
+from tracing import record_span
+from speculative import PromptLookupDrafter, speculative_generate
+
+logger = logging.getLogger(__name__)
+
+# Sampling settings shared by all backends so benchmarks compare like with like
+GENERATION_SETTINGS = {
+    "max_new_tokens": 300,
+    "temperature": 0.3,
+    "top_p": 0.8,
+    "repetition_penalty": 1.1,
+}
+MAX_PROMPT_TOKENS = 512
+# Truncated generations whose KV cache is kept for generate_continuation (each can be tens of MB)
+MAX_KEPT_GENERATIONS = 4
+
+# Per-thread new-token counts of the latest generate call, see InferenceBackend.last_generated_tokens
+_generated_tokens = threading.local()
+
+def _set_generated_tokens(counts: List[int]):
+    _generated_tokens.counts = counts
+
+class _FirstTokenTimer(StoppingCriteria):
+    """Never stops generation; notes when the first new token exists, i.e. when prefill ended."""
+
+    def __init__(self):
+        self.first_token_time = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+def _observe_generation(endpoints: List[str], start_time: float, first_token_time: Optional[float]):
+    """Split a generate call into prefill (until the first token) and decode stages."""
+    end_time = time.perf_counter()
+    first_token_time = first_token_time or end_time
+    for endpoint in endpoints:
+        STAGE_SECONDS.observe(first_token_time - start_time, endpoint=endpoint, stage="prefill")
+        STAGE_SECONDS.observe(end_time - first_token_time, endpoint=endpoint, stage="decode")
+    record_span("prefill", start_time, first_token_time)
+    record_span("decode", first_token_time, end_time)
+
+class InferenceBackend:
+    """Interface every inference backend implements."""
+
+    name = "base"
+
+    def generate(self, prompt: str, max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                 endpoint: str = "default") -> str:
+        """Return the text generated after prompt; endpoint labels per-endpoint statistics."""
+        raise NotImplementedError
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                       endpoints: Optional[List[str]] = None) -> List[str]:
+        """Generate for several prompts at once; backends without real batching loop over generate()."""
+        endpoints = endpoints or ["default"] * len(prompts)
+        texts, counts = [], []
+        for prompt, endpoint in zip(prompts, endpoints):
+            texts.append(self.generate(prompt, max_new_tokens, endpoint))
+            counts.extend(self.last_generated_tokens())
+        _set_generated_tokens(counts)
+        return texts
+
+    def generate_continuation(self, prompt: str, generated_prefix: str,
+                              max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                              endpoint: str = "default") -> str:
+        """Resume a generation of prompt that stopped after generated_prefix; returns only the new text.
+
+        By default the prefix is simply appended to the prompt (llama.cpp reuses its KV cache for the
+        shared prefix on its own).
+        """
+        return self.generate(prompt + generated_prefix, max_new_tokens, endpoint)
+
+    def release_generation_state(self, prompt: str):
+        """Forget anything kept to continue the generation of prompt (called once its output is parsed)."""
+
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens text encodes to (without special tokens)."""
+        raise NotImplementedError
+
+    def count_prompt_tokens(self, prompt: str) -> int:
+        """Number of tokens generate() would feed the model for prompt (with BOS, before truncation)."""
+        return self.count_tokens(prompt) + 1
+
+    def last_generated_tokens(self) -> List[int]:
+        """New tokens per sequence of this thread's latest generate/generate_batch/generate_continuation call."""
+        return getattr(_generated_tokens, "counts", [])
+
+    def describe(self) -> dict:
+        return {"backend": self.name}
+
+class TransformersBackend(InferenceBackend):
+    """Hugging Face transformers model (the merged fine-tuned Llama)."""
+
+    name = "transformers"
+
+    def __init__(self, model, tokenizer, speculative: bool = False, num_draft_tokens: int = 8,
+                 keep_generation_state: bool = False):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.drafter = PromptLookupDrafter(num_draft_tokens) if speculative else None
+        self.prompt_tokens = PromptTokenCache(tokenizer)
+        # Generations that ran into max_new_tokens keep (prompt ids, sequence, KV cache) by prompt,
+        # so generate_continuation can resume them from any thread
+        self.keep_generation_state = keep_generation_state and not speculative
+        self._kept = OrderedDict()
+        self._kept_lock = threading.Lock()
+
+    def _keep(self, prompt: str, state: tuple):
+        with self._kept_lock:
+            self._kept[prompt] = state
+            self._kept.move_to_end(prompt)
+            while len(self._kept) > MAX_KEPT_GENERATIONS:
+                self._kept.popitem(last=False)
+
+    def release_generation_state(self, prompt: str):
+        with self._kept_lock:
+            self._kept.pop(prompt, None)
+
+    def generate(self, prompt: str, max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                 endpoint: str = "default") -> str:
+        start_time = time.perf_counter()
+        # Encode the prompt (mostly from cached paragraph ids) with attention mask
+        input_ids = torch.tensor([self.prompt_tokens.encode(prompt, MAX_PROMPT_TOKENS)])
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+        # Move to same device as model
+        if torch.cuda.is_available():
+            inputs = {k: v.cuda() for k, v in inputs.items()}
+        start_time = observe_stage(endpoint, "tokenize", start_time)
+        prompt_length = inputs["input_ids"].shape[1]
+        TOKENS.inc(prompt_length, endpoint=endpoint, direction="in")
+
+        if self.drafter is not None:
+            generated_ids = speculative_generate(
+                self.model,
+                inputs["input_ids"],
+                max_new_tokens=max_new_tokens,
+                eos_token_id=self.tokenizer.eos_token_id,
+                temperature=GENERATION_SETTINGS["temperature"],
+                top_p=GENERATION_SETTINGS["top_p"],
+                repetition_penalty=GENERATION_SETTINGS["repetition_penalty"],
+                drafter=self.drafter,
+                endpoint=endpoint,
+            )
+            TOKENS.inc(len(generated_ids), endpoint=endpoint, direction="out")
+            _set_generated_tokens([len(generated_ids)])
+            return self.tokenizer.decode(generated_ids, skip_special_tokens=True).strip()
+
+        # Generate response with more constrained settings for better JSON
+        first_token = _FirstTokenTimer()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                max_new_tokens=max_new_tokens,
+                temperature=GENERATION_SETTINGS["temperature"],  # Low for more deterministic output
+                top_p=GENERATION_SETTINGS["top_p"],
+                do_sample=True,
+                pad_token_id=self.tokenizer.eos_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                num_return_sequences=1,
+                repetition_penalty=GENERATION_SETTINGS["repetition_penalty"],  # Prevent repetition
+                stopping_criteria=StoppingCriteriaList([first_token]),
+                return_dict_in_generate=self.keep_generation_state
+            )
+        _observe_generation([endpoint], start_time, first_token.first_token_time)
+        if self.keep_generation_state:
+            # Only output cut off by the budget can need a continuation
+            if outputs.sequences.shape[1] - prompt_length >= max_new_tokens:
+                self._keep(prompt, (inputs["input_ids"], outputs.sequences, outputs.past_key_values))
+            outputs = outputs.sequences
+        TOKENS.inc(outputs.shape[1] - prompt_length, endpoint=endpoint, direction="out")
+        _set_generated_tokens([outputs.shape[1] - prompt_length])
+
+        # Decode only the new tokens
+        return self.tokenizer.decode(outputs[0, prompt_length:], skip_special_tokens=True).strip()
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                       endpoints: Optional[List[str]] = None) -> List[str]:
+        # Speculative decoding verifies one sequence at a time
+        if self.drafter is not None or len(prompts) == 1:
+            return super().generate_batch(prompts, max_new_tokens, endpoints)
+
+        endpoints = endpoints or ["default"] * len(prompts)
+        start_time = time.perf_counter()
+        self.tokenizer.padding_side = "left"
+        inputs = self.tokenizer.pad({"input_ids": [self.prompt_tokens.encode(prompt, MAX_PROMPT_TOKENS) for prompt in prompts]},
+                                    padding=True, return_tensors="pt")
+        if torch.cuda.is_available():
+            inputs = {k: v.cuda() for k, v in inputs.items()}
+        tokenize_seconds = time.perf_counter() - start_time
+        for endpoint, prompt_length in zip(endpoints, inputs["attention_mask"].sum(dim=1).tolist()):
+            STAGE_SECONDS.observe(tokenize_seconds, endpoint=endpoint, stage="tokenize")
+            TOKENS.inc(prompt_length, endpoint=endpoint, direction="in")
+        start_time = time.perf_counter()
+
+        first_token = _FirstTokenTimer()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                max_new_tokens=max_new_tokens,
+                temperature=GENERATION_SETTINGS["temperature"],
+                top_p=GENERATION_SETTINGS["top_p"],
+                do_sample=True,
+                pad_token_id=self.tokenizer.eos_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                repetition_penalty=GENERATION_SETTINGS["repetition_penalty"],
+                stopping_criteria=StoppingCriteriaList([first_token])
+            )
+        _observe_generation(endpoints, start_time, first_token.first_token_time)
+
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        counts = (new_tokens != self.tokenizer.pad_token_id).sum(dim=1).tolist()
+        for endpoint, generated in zip(endpoints, counts):
+            TOKENS.inc(generated, endpoint=endpoint, direction="out")
+        _set_generated_tokens(counts)
+        return [text.strip() for text in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+    def generate_continuation(self, prompt: str, generated_prefix: str,
+                              max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                              endpoint: str = "default") -> str:
+        with self._kept_lock:
+            last = self._kept.pop(prompt, None)
+        if last is None:
+            CACHE_REQUESTS.inc(cache="kv_continuation", result="miss")
+            return super().generate_continuation(prompt, generated_prefix, max_new_tokens, endpoint)
+        CACHE_REQUESTS.inc(cache="kv_continuation", result="hit")
+        prompt_ids, sequences, past_key_values = last
+
+        start_time = time.perf_counter()
+        prompt_length = prompt_ids.shape[1]
+        generated_ids = sequences[0, prompt_length:]
+        # Longest run of generated tokens that decodes to the start of generated_prefix
+        # (the caller may have cut the text back, e.g. to the last complete object)
+        kept, high = 0, generated_ids.shape[0]
+        while kept < high:
+            middle = (kept + high + 1) // 2
+            if generated_prefix.startswith(self.tokenizer.decode(generated_ids[:middle], skip_special_tokens=True).lstrip()):
+                kept = middle
+            else:
+                high = middle - 1
+        kept_text = self.tokenizer.decode(generated_ids[:kept], skip_special_tokens=True).lstrip()
+        new_ids = self.tokenizer(generated_prefix[len(kept_text):], add_special_tokens=False,
+                                 return_tensors="pt")["input_ids"].to(sequences.device)
+        input_ids = torch.cat([sequences[:, :prompt_length + kept], new_ids], dim=1)
+
+        # Drop cache entries past the kept tokens; at least one token must be left to run forward
+        if isinstance(past_key_values, tuple):
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        past_key_values.crop(min(prompt_length + kept, input_ids.shape[1] - 1))
+        start_time = observe_stage(endpoint, "tokenize", start_time)
+        TOKENS.inc(input_ids.shape[1] - past_key_values.get_seq_length(), endpoint=endpoint, direction="in")
+
+        first_token = _FirstTokenTimer()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                max_new_tokens=max_new_tokens,
+                temperature=GENERATION_SETTINGS["temperature"],
+                top_p=GENERATION_SETTINGS["top_p"],
+                do_sample=True,
+                pad_token_id=self.tokenizer.eos_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                repetition_penalty=GENERATION_SETTINGS["repetition_penalty"],
+                stopping_criteria=StoppingCriteriaList([first_token]),
+                return_dict_in_generate=True
+            )
+        _observe_generation([endpoint], start_time, first_token.first_token_time)
+        TOKENS.inc(outputs.sequences.shape[1] - input_ids.shape[1], endpoint=endpoint, direction="out")
+        _set_generated_tokens([outputs.sequences.shape[1] - input_ids.shape[1]])
+        if outputs.sequences.shape[1] - input_ids.shape[1] >= max_new_tokens:
+            self._keep(prompt, (prompt_ids, outputs.sequences, outputs.past_key_values))
+
+        # Decode together with the resumed text so word boundaries come out right
+        resumed = self.tokenizer.decode(input_ids[0, prompt_length:], skip_special_tokens=True)
+        full = self.tokenizer.decode(outputs.sequences[0, prompt_length:], skip_special_tokens=True)
+        return full[len(resumed):]
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def count_prompt_tokens(self, prompt: str) -> int:
+        return self.prompt_tokens.count(prompt)
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "device": str(next(self.model.parameters()).device),
+                "speculative": self.drafter is not None}
+
+class LlamaCppBackend(InferenceBackend):
+    """GGUF model served through llama-cpp-python (CPU-friendly, quantized)."""
+
+    name = "llama_cpp"
+
+    def __init__(self, gguf_path: str, n_ctx: int = 2048, n_threads: Optional[int] = None,
+                 speculative: bool = False, num_draft_tokens: int = 8):
+        try:
+            from llama_cpp import Llama
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+        except ImportError:
+            raise RuntimeError("INFERENCE_BACKEND=llama_cpp requires the 'llama-cpp-python' package")
+        if not os.path.exists(gguf_path):
+            raise FileNotFoundError(f"GGUF model not found at {gguf_path}; create it with 'python convert_to_gguf.py'")
+
+        self.gguf_path = gguf_path
+        # llama.cpp ships the same prompt-lookup drafting natively
+        draft_model = LlamaPromptLookupDecoding(num_pred_tokens=num_draft_tokens) if speculative else None
+        self.llm = Llama(model_path=gguf_path, n_ctx=n_ctx, n_threads=n_threads, draft_model=draft_model, verbose=False)
+        logger.info(f"Loaded GGUF model {gguf_path} (n_ctx={n_ctx}, n_threads={self.llm.n_threads})")
+
+    def generate(self, prompt: str, max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                 endpoint: str = "default") -> str:
+        TOKENS.inc(self.count_tokens(prompt), endpoint=endpoint, direction="in")
+        start_time = time.perf_counter()
+        first_token_time = None
+        pieces = []
+        # Streaming yields one chunk per token, which separates prefill from decode
+        for chunk in self.llm(
+            prompt,
+            max_tokens=max_new_tokens,
+            temperature=GENERATION_SETTINGS["temperature"],
+            top_p=GENERATION_SETTINGS["top_p"],
+            repeat_penalty=GENERATION_SETTINGS["repetition_penalty"],
+            stream=True,
+        ):
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            pieces.append(chunk["choices"][0]["text"])
+        _observe_generation([endpoint], start_time, first_token_time)
+        TOKENS.inc(len(pieces), endpoint=endpoint, direction="out")
+        _set_generated_tokens([len(pieces)])
+        return "".join(pieces).strip()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "gguf_path": self.gguf_path}
+
+class StubBackend(InferenceBackend):
+    """Model-free stand-in returning canned, valid JSON per endpoint (tests, CI, load generation)."""
+
+    name = "stub"
+
+    RESPONSES = {
+        "generate-quiz": [
+            {"question": "What is 2 + 3?", "question_type": "multiple_choice", "options": ["4", "5", "6", "7"],
+             "correct_answer": "5", "explanation": "Counting on 3 from 2 gives 5."},
+            {"question": "Which number is the largest?", "question_type": "multiple_choice", "options": ["3", "9", "6", "1"],
+             "correct_answer": "9", "explanation": "9 comes after the other numbers when counting."},
+            {"question": "True or False: 10 is more than 7", "question_type": "true_false", "options": ["True", "False"],
+             "correct_answer": "True", "explanation": "10 is three more than 7."},
+        ],
+        "generate-content": [
+            {"title": "Counting Objects", "body": "<p>We count objects one by one, saying one number for each.</p>", "card_type": "content"},
+            {"title": "Adding Groups", "body": "<p>Adding puts two groups together to find how many in all.</p>", "card_type": "content"},
+        ],
+        "generate-topics": [
+            {"topic_id": "numbers", "title": "Numbers and Operations", "description": "Counting, adding and taking away", "level": 1},
+            {"topic_id": "shapes", "title": "Shapes and Space", "description": "Naming and sorting shapes around us", "level": 2},
+        ],
+    }
+
+    def __init__(self, seconds_per_token: float = 0.0, prefill_seconds_per_token: float = 0.0):
+        # Optional simulated prefill/decode time so load tests see realistic latencies
+        self.seconds_per_token = seconds_per_token
+        self.prefill_seconds_per_token = prefill_seconds_per_token
+
+    def generate(self, prompt: str, max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                 endpoint: str = "default") -> str:
+        start_time = time.perf_counter()
+        text = json.dumps(self.RESPONSES.get(endpoint, self.RESPONSES["generate-content"]))
+        generated = min(self.count_tokens(text), max_new_tokens)
+        if self.prefill_seconds_per_token:
+            time.sleep(self.prefill_seconds_per_token * self.count_tokens(prompt))
+        first_token_time = time.perf_counter()
+        if self.seconds_per_token:
+            time.sleep(self.seconds_per_token * generated)
+        _observe_generation([endpoint], start_time, first_token_time)
+        TOKENS.inc(self.count_tokens(prompt), endpoint=endpoint, direction="in")
+        TOKENS.inc(generated, endpoint=endpoint, direction="out")
+        _set_generated_tokens([generated])
+        return text
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+class RemoteBackend(InferenceBackend):
+    """Client for inference_server.py; many requests are multiplexed over one Unix socket."""
+
+    name = "remote"
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 600.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._lock = threading.Lock()  # Guards the socket, request ids and pending replies
+        self._sock = None
+        self._pending = {}
+        self._next_id = 0
+        with self._lock:
+            self._connect()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise RuntimeError(f"Cannot reach inference server at {self.socket_path} ({e}); "
+                               "start it with 'python inference_server.py'")
+        self._sock = sock
+        self._pending = {}
+        threading.Thread(target=self._read_replies, args=(sock, self._pending), daemon=True).start()
+        logger.info(f"Connected to inference server at {self.socket_path}")
+
+    def _read_replies(self, sock: socket.socket, pending: dict):
+        try:
+            while True:
+                message_type, request_id, payload = read_frame(sock)
+                with self._lock:
+                    future = pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if message_type == ERROR:
+                    future.set_exception(RuntimeError(f"Inference server error: {payload.decode('utf-8')}"))
+                else:
+                    future.set_result(payload)
+        except (OSError, ProtocolError) as e:
+            with self._lock:
+                if self._sock is sock:
+                    self._sock = None
+                failed = list(pending.values())
+                pending.clear()
+            for future in failed:
+                future.set_exception(ConnectionError(f"Lost connection to inference server: {e}"))
+            sock.close()
+
+    def _send(self, frames: List[tuple]) -> tuple:
+        """Write (message_type, payload) frames back to back; returns their futures and the pending map."""
+        futures = []
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            pending = self._pending
+            for message_type, payload in frames:
+                self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+                future = Future()
+                pending[self._next_id] = future
+                futures.append((self._next_id, future))
+                try:
+                    self._sock.sendall(encode_frame(message_type, self._next_id, payload))
+                except OSError as e:
+                    for request_id, _ in futures:
+                        pending.pop(request_id, None)
+                    self._sock = None
+                    raise ConnectionError(f"Lost connection to inference server: {e}")
+        return futures, pending
+
+    def _wait(self, futures: List[tuple], pending: dict) -> List[bytes]:
+        deadline = time.monotonic() + self.timeout
+        try:
+            return [future.result(timeout=max(0.0, deadline - time.monotonic())) for _, future in futures]
+        finally:
+            # A timed out request would otherwise stay pending until its (late) reply or a disconnect
+            with self._lock:
+                for request_id, _ in futures:
+                    pending.pop(request_id, None)
+
+    def _call(self, message_type: int, payload: bytes = b"") -> bytes:
+        return self._wait(*self._send([(message_type, payload)]))[0]
+
+    def generate(self, prompt: str, max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                 endpoint: str = "default") -> str:
+        text, generated = unpack_result(self._call(GENERATE, pack_generate(prompt, max_new_tokens, endpoint)))
+        _set_generated_tokens([generated])
+        return text
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int = GENERATION_SETTINGS["max_new_tokens"],
+                       endpoints: Optional[List[str]] = None) -> List[str]:
+        """Send every prompt before waiting, so the server's scheduler can batch them together."""
+        endpoints = endpoints or ["default"] * len(prompts)
+        frames = [(GENERATE, pack_generate(prompt, max_new_tokens, endpoint))
+                  for prompt, endpoint in zip(prompts, endpoints)]
+        results = [unpack_result(payload) for payload in self._wait(*self._send(frames))]
+        _set_generated_tokens([generated for _, generated in results])
+        return [text for text, _ in results]
+
+    def count_tokens(self, text: str) -> int:
+        return UINT32.unpack(self._call(COUNT_TOKENS, text.encode("utf-8")))[0]
+
+    def count_prompt_tokens(self, prompt: str) -> int:
+        return UINT32.unpack(self._call(COUNT_PROMPT_TOKENS, prompt.encode("utf-8")))[0]
+
+    def metrics_text(self) -> str:
+        """The inference server's metrics, prefixed smartclass_inference_server_."""
+        return self._call(METRICS).decode("utf-8")
+
+    def describe(self) -> dict:
+        server = json.loads(self._call(DESCRIBE).decode("utf-8"))
+        return {"backend": self.name, "socket_path": self.socket_path, "server": server}
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Model-owning inference server.
+
+The HTTP tier (api_model_service with INFERENCE_BACKEND=remote, any number of
+workers) sends generation requests here over a Unix socket using the binary
+protocol in ipc_protocol. Every request goes through one BatchScheduler, which
+groups requests arriving within a short window into a single batched
+generate call, so batching works across all HTTP workers.
+
+    python inference_server.py                        # transformers model
+    python inference_server.py --backend llama_cpp
+    python inference_server.py --backend stub         # no model, for tests
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from inference_backends import InferenceBackend, StubBackend
+from ipc_protocol import (COUNT_PROMPT_TOKENS, COUNT_TOKENS, DEFAULT_SOCKET_PATH, DESCRIBE, DESCRIPTION, ERROR,
+                          GENERATE, METRICS, METRICS_TEXT, RESULT, TOKEN_COUNT, UINT32, ProtocolError, encode_frame,
+                          pack_result, read_frame_async, unpack_generate)
+from metrics import Gauge, Histogram, render as render_metrics
+from speculative import speculative_stats
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Configuration
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", DEFAULT_SOCKET_PATH)
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "10"))  # How long a batch waits for company
+
+BATCH_SIZE = Histogram("batch_size", "Requests per generate call", buckets=(1, 2, 4, 8, 16, 32))
+
+class BatchScheduler:
+    """Single request queue in front of the model that forms batches."""
+
+    def __init__(self, backend: InferenceBackend, max_batch_size: int = MAX_BATCH_SIZE,
+                 batch_wait_ms: float = BATCH_WAIT_MS):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.batch_wait_ms = batch_wait_ms
+        self.queue = asyncio.Queue()
+        # The model runs one batch at a time on its own thread, off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        Gauge("queue_depth", "Requests waiting for the batch scheduler", function=self.queue.qsize)
+
+    async def submit(self, prompt: str, max_new_tokens: int, endpoint: str) -> Tuple[str, int]:
+        """Queue one generation; returns (text, generated tokens)."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((prompt, max_new_tokens, endpoint, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests with the same generation budget share one generate call
+            groups = defaultdict(list)
+            for item in batch:
+                groups[item[1]].append(item)
+            for max_new_tokens, items in groups.items():
+                await self._run_group(max_new_tokens, items)
+
+    async def _run_group(self, max_new_tokens: int, items: list):
+        prompts = [prompt for prompt, _, _, _ in items]
+        endpoints = [endpoint for _, _, endpoint, _ in items]
+        self.requests += len(items)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(items))
+        BATCH_SIZE.observe(len(items))
+
+        try:
+            texts, counts = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._generate_batch, prompts, max_new_tokens, endpoints)
+        except Exception as e:
+            logger.error(f"Batch of {len(items)} failed: {e}")
+            for *_, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (*_, future), text, generated in zip(items, texts, counts):
+            if not future.done():
+                future.set_result((text, generated))
+
+    def _generate_batch(self, prompts: List[str], max_new_tokens: int, endpoints: List[str]) -> Tuple[List[str], List[int]]:
+        # Runs on the inference thread, which is where the backend notes its generated token counts
+        texts = self.backend.generate_batch(prompts, max_new_tokens, endpoints)
+        return texts, self.backend.last_generated_tokens()
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "queue_depth": self.queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "batch_wait_ms": self.batch_wait_ms,
+        }
+
+async def handle_request(scheduler: BatchScheduler, writer: asyncio.StreamWriter, message_type: int,
+                         request_id: int, payload: bytes):
+    """Answer one request frame; failures are returned to the caller as ERROR frames."""
+    try:
+        if message_type == GENERATE:
+            prompt, max_new_tokens, endpoint = unpack_generate(payload)
+            text, generated = await scheduler.submit(prompt, max_new_tokens, endpoint)
+            reply = encode_frame(RESULT, request_id, pack_result(text, generated))
+        elif message_type == COUNT_TOKENS:
+            count = scheduler.backend.count_tokens(payload.decode("utf-8"))
+            reply = encode_frame(TOKEN_COUNT, request_id, UINT32.pack(count))
+        elif message_type == COUNT_PROMPT_TOKENS:
+            count = scheduler.backend.count_prompt_tokens(payload.decode("utf-8"))
+            reply = encode_frame(TOKEN_COUNT, request_id, UINT32.pack(count))
+        elif message_type == DESCRIBE:
+            description = {**scheduler.backend.describe(), "scheduler": scheduler.snapshot(),
+                           "speculative": speculative_stats.snapshot()}
+            reply = encode_frame(DESCRIPTION, request_id, json.dumps(description).encode("utf-8"))
+        elif message_type == METRICS:
+            text = render_metrics("smartclass_inference_server")
+            reply = encode_frame(METRICS_TEXT, request_id, text.encode("utf-8"))
+        else:
+            raise ProtocolError(f"Unknown message type {message_type}")
+    except Exception as e:
+        reply = encode_frame(ERROR, request_id, str(e).encode("utf-8"))
+
+    if not writer.is_closing():
+        writer.write(reply)
+        await writer.drain()
+
+async def handle_connection(scheduler: BatchScheduler, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Read frames from one HTTP worker; each request is answered as soon as it is done."""
+    tasks = set()
+    try:
+        while True:
+            message_type, request_id, payload = await read_frame_async(reader)
+            task = asyncio.create_task(handle_request(scheduler, writer, message_type, request_id, payload))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, ConnectionError, ProtocolError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(backend: InferenceBackend, socket_path: str = INFERENCE_SOCKET, max_batch_size: int = MAX_BATCH_SIZE,
+                batch_wait_ms: float = BATCH_WAIT_MS):
+    """Accept connections on socket_path until cancelled."""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    scheduler = BatchScheduler(backend, max_batch_size, batch_wait_ms)
+    scheduler_task = asyncio.create_task(scheduler.run())
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: handle_connection(scheduler, reader, writer), path=socket_path)
+    os.chmod(socket_path, 0o600)
+    logger.info(f"Inference server ({backend.name}) listening on {socket_path} "
+                f"(max batch {max_batch_size}, wait {batch_wait_ms}ms)")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        scheduler_task.cancel()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+def load_backend(name: str, stub_seconds_per_token: float = 0.0, max_batch_size: int = MAX_BATCH_SIZE) -> InferenceBackend:
+    """Build the backend this process owns (the stub needs no model) and warm it up."""
+    if name == "stub":
+        return StubBackend(stub_seconds_per_token)
+
+    import api_model_service as service
+    service.INFERENCE_BACKEND = name
+    service.load_model_and_tokenizer()
+    if service.WARMUP:
+        # Single requests and full batches are the shapes the scheduler produces most
+        service.warmup_service(sorted({1, max_batch_size}))
+    return service.backend
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the model-owning inference server.")
+    parser.add_argument("--backend", default="transformers", choices=["transformers", "llama_cpp", "stub"])
+    parser.add_argument("--socket", default=INFERENCE_SOCKET)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--batch-wait-ms", type=float, default=BATCH_WAIT_MS)
+    parser.add_argument("--stub-seconds-per-token", type=float, default=0.0,
+                        help="Simulated decode time per token for --backend stub")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    backend = load_backend(args.backend, args.stub_seconds_per_token, args.max_batch_size)
+    try:
+        asyncio.run(serve(backend, args.socket, args.max_batch_size, args.batch_wait_ms))
+    except KeyboardInterrupt:
+        logger.info("Shutting down inference server...")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Binary protocol between the HTTP tier and the inference server.
+
+Every message is one frame on a Unix stream socket:
+
+    uint32 payload length | uint8 message type | uint32 request id | payload
+
+A GENERATE payload is `uint16 max_new_tokens | uint16 endpoint length |
+endpoint | prompt` (UTF-8). Replies carry the same request id, so one
+connection can have many requests in flight and replies may arrive out of
+order. A RESULT payload is `uint32 generated tokens | text`, ERROR/METRICS_TEXT
+payloads are UTF-8 text, TOKEN_COUNT is a uint32 and DESCRIPTION is UTF-8 JSON. COUNT_TOKENS and COUNT_PROMPT_TOKENS
+payloads are the UTF-8 text to count.
+"""
+
+import socket
+import struct
+from typing import Tuple
+
+DEFAULT_SOCKET_PATH = "/tmp/smartclass-inference.sock"
+
+# Request types
+GENERATE = 1
+COUNT_TOKENS = 2
+DESCRIBE = 3
+METRICS = 4
+COUNT_PROMPT_TOKENS = 5
+
+# Reply types
+RESULT = 64
+TOKEN_COUNT = 65
+DESCRIPTION = 66
+METRICS_TEXT = 67
+ERROR = 127
+
+FRAME_HEADER = struct.Struct("!IBI")
+GENERATE_HEADER = struct.Struct("!HH")
+UINT32 = struct.Struct("!I")
+MAX_PAYLOAD_BYTES = 16 * 1024 * 1024
+
+class ProtocolError(Exception):
+    """Malformed or oversized frame."""
+
+def encode_frame(message_type: int, request_id: int, payload: bytes = b"") -> bytes:
+    if len(payload) > MAX_PAYLOAD_BYTES:
+        raise ProtocolError(f"Payload of {len(payload)} bytes exceeds {MAX_PAYLOAD_BYTES}")
+    return FRAME_HEADER.pack(len(payload), message_type, request_id) + payload
+
+def _check_length(length: int):
+    if length > MAX_PAYLOAD_BYTES:
+        raise ProtocolError(f"Frame announces {length} bytes (limit {MAX_PAYLOAD_BYTES})")
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Inference server closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def read_frame(sock: socket.socket) -> Tuple[int, int, bytes]:
+    """Blocking read of one frame: (message type, request id, payload)."""
+    length, message_type, request_id = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size))
+    _check_length(length)
+    return message_type, request_id, _recv_exactly(sock, length) if length else b""
+
+async def read_frame_async(reader) -> Tuple[int, int, bytes]:
+    """asyncio StreamReader version of read_frame."""
+    length, message_type, request_id = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    _check_length(length)
+    return message_type, request_id, await reader.readexactly(length) if length else b""
+
+def pack_generate(prompt: str, max_new_tokens: int, endpoint: str) -> bytes:
+    endpoint_bytes = endpoint.encode("utf-8")
+    return GENERATE_HEADER.pack(max_new_tokens, len(endpoint_bytes)) + endpoint_bytes + prompt.encode("utf-8")
+
+def pack_result(text: str, generated_tokens: int) -> bytes:
+    return UINT32.pack(generated_tokens) + text.encode("utf-8")
+
+def unpack_result(payload: bytes) -> Tuple[str, int]:
+    """Return (text, generated tokens)."""
+    return payload[UINT32.size:].decode("utf-8"), UINT32.unpack_from(payload)[0]
+
+def unpack_generate(payload: bytes) -> Tuple[str, int, str]:
+    """Return (prompt, max_new_tokens, endpoint)."""
+    max_new_tokens, endpoint_length = GENERATE_HEADER.unpack_from(payload)
+    start = GENERATE_HEADER.size
+    endpoint = payload[start:start + endpoint_length].decode("utf-8")
+    prompt = payload[start + endpoint_length:].decode("utf-8")
+    return prompt, max_new_tokens, endpoint
@@ -0,0 +1,210 @@
+"""
+Tolerant, incremental extraction of JSON objects from model output.
+
+The model is asked for a JSON array of objects but may wrap it in prose, cut it
+off at max_new_tokens, or make small syntax mistakes. JSONScanner makes one
+pass over the text, jumping between structural characters with compiled
+regexes, and tracks strings (including escapes) and bracket depth. Every
+outermost object is parsed once, as soon as its closing brace arrives, so feed()
+can be called on each decoded chunk of a token stream. Where an object is
+already complete and valid it is decoded directly by json's C scanner; the
+character-level path only runs for objects that are still open or need repair.
+
+Repairs made while scanning:
+- single-quoted keys/values become double-quoted strings
+- trailing commas before } or ] are dropped
+- raw newlines, tabs and other control characters inside strings are escaped
+- a mismatched closing bracket closes the innermost open container
+
+Objects completed before a truncation are kept; `truncated` tells the caller
+that more was coming.
+"""
+
+import json
+import re
+from typing import Dict, List, Optional
+
+_OPENERS = re.compile(r"[\[{]")
+_STRUCTURAL = re.compile(r"""[\[\]{}"',]""")
+_DOUBLE_QUOTED_SPECIAL = re.compile(r'["\\\x00-\x1f]')
+_SINGLE_QUOTED_SPECIAL = re.compile(r"""['"\\\x00-\x1f]""")
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+# A single quote only opens a string where a JSON value or key may start
+_VALUE_START = "{[,:"
+_DECODER = json.JSONDecoder()
+_CLEAN_STRING = re.compile(r'"[^"\\\x00-\x1f]*(?:\\.[^"\\\x00-\x1f]*)*"')
+
+class JSONScanner:
+    """Collects every outermost JSON object in the text fed so far."""
+
+    def __init__(self):
+        self.items: List[Dict] = []
+        self.failed = 0          # Complete objects that were still invalid after repair
+        self.closed = False      # The outermost array was closed
+        self._buffer = ""
+        self._stack = []         # Open '[' / '{'
+        self._quote = None       # '"' or "'" while inside a string
+        self.last_item_end = 0   # Raw offset just past the last object that parsed
+        self._item = None        # Repaired pieces of the object being collected
+        self._consumed = 0       # Raw characters scanned by earlier feed() calls
+        self._comma_at = None    # Index in _item of a comma that nothing significant has followed yet
+        self._last = ""          # Last significant character outside strings
+
+    @property
+    def truncated(self) -> bool:
+        """True if the text ended inside an object, string or array."""
+        return bool(self._stack) or self._quote is not None
+
+    @property
+    def complete(self) -> bool:
+        """The array was closed and every object in it parsed."""
+        return self.closed and not self.truncated and not self.failed
+
+    def _emit(self, piece: str, significant: bool = True):
+        if self._item is not None:
+            self._item.append(piece)
+        if significant:
+            self._comma_at = None
+
+    def _emit_run(self, run: str):
+        """Copy text between structural characters (numbers, literals, colons, whitespace)."""
+        if not run:
+            return
+        stripped = run.strip()
+        if self._item is not None:
+            self._item.append(run)
+        if stripped:
+            self._comma_at = None
+            self._last = stripped[-1]
+
+    def _finish_item(self) -> Optional[Dict]:
+        text = "".join(self._item)
+        self._item = None
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError:
+            self.failed += 1
+            return None
+        self.items.append(obj)
+        return obj
+
+    def feed(self, text: str) -> List[Dict]:
+        """Scan more text; returns the objects completed by it."""
+        buf = self._buffer + text
+        pos = 0
+        completed = []
+        while pos < len(buf):
+            if self._quote is not None:
+                pattern = _DOUBLE_QUOTED_SPECIAL if self._quote == '"' else _SINGLE_QUOTED_SPECIAL
+                match = pattern.search(buf, pos)
+                if match is None:
+                    self._emit(buf[pos:])
+                    pos = len(buf)
+                    break
+                self._emit(buf[pos:match.start()])
+                char, pos = match.group(), match.end()
+                if char == "\\":
+                    if pos == len(buf):
+                        pos -= 1  # Wait for the escaped character
+                        break
+                    escaped = buf[pos]
+                    pos += 1
+                    self._emit("'" if self._quote == "'" and escaped == "'" else "\\" + escaped)
+                elif char == self._quote:
+                    self._emit('"')
+                    self._quote = None
+                    self._last = '"'
+                elif char == '"':
+                    self._emit('\\"')  # Double quote inside a single-quoted string
+                else:
+                    self._emit(_CONTROL_ESCAPES.get(char, f"\\u{ord(char):04x}"))
+                continue
+
+            if not self._stack:
+                # Outside any container only an opening bracket matters (skips surrounding prose)
+                match = _OPENERS.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                pos = match.start()
+
+            match = _STRUCTURAL.search(buf, pos)
+            if match is None:
+                self._emit_run(buf[pos:])
+                pos = len(buf)
+                break
+            self._emit_run(buf[pos:match.start()])
+            char, pos = match.group(), match.end()
+
+            if char in "[{":
+                if char == "{" and self._item is None:
+                    # Fast path: a well-formed object is decoded in C and skipped over in one step
+                    try:
+                        obj, end = _DECODER.raw_decode(buf, match.start())
+                    except json.JSONDecodeError:
+                        pass
+                    else:
+                        self.items.append(obj)
+                        completed.append(obj)
+                        pos = end
+                        self.last_item_end = self._consumed + pos
+                        self._last = "}"
+                        continue
+                    self._item = []
+                self._stack.append(char)
+                self._emit(char)
+                self._last = char
+            elif char in "]}":
+                if not self._stack:
+                    continue
+                char = "}" if self._stack.pop() == "{" else "]"  # Close what is actually open
+                if self._comma_at is not None and self._item is not None:
+                    self._item[self._comma_at] = ""  # Trailing comma
+                self._emit(char)
+                self._last = char
+                if char == "}" and self._item is not None and "{" not in self._stack:
+                    obj = self._finish_item()
+                    if obj is not None:
+                        completed.append(obj)
+                        self.last_item_end = self._consumed + pos
+                if not self._stack and char == "]":
+                    self.closed = True
+            elif char == ",":
+                self._emit(",")
+                if self._item is not None:
+                    self._comma_at = len(self._item) - 1
+                self._last = ","
+            elif char == "'" and self._last not in _VALUE_START:
+                self._emit_run(char)  # Apostrophe in an unquoted word
+            else:
+                string = _CLEAN_STRING.match(buf, match.start()) if char == '"' else None
+                if string is not None:
+                    self._emit(string.group())  # Whole string needs no repair
+                    pos = string.end()
+                    self._last = '"'
+                else:
+                    self._quote = char
+                    self._emit('"')
+
+        self._consumed += pos
+        self._buffer = buf[pos:]
+        return completed
+
+def scan_json_objects(text: str) -> JSONScanner:
+    """One-shot scan of a complete model response."""
+    scanner = JSONScanner()
+    # Common case: the response is (or contains) one well-formed array of objects
+    start_idx = text.find('[')
+    if start_idx != -1:
+        try:
+            data, end = _DECODER.raw_decode(text, start_idx)
+        except json.JSONDecodeError:
+            pass
+        else:
+            if data and all(isinstance(item, dict) for item in data):
+                scanner.items = data
+                scanner.closed = True
+                scanner.last_item_end = text.rfind("}", start_idx, end) + 1
+                return scanner
+    scanner.feed(text)
+    return scanner
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+End-to-end load generator for the model service.
+
+Replays classroom-shaped traffic: a teacher opens a lesson and the whole class
+requests the same subtopic within a few seconds, so requests arrive in bursts
+of identical (subject, topic, subtopic, grade) with a configurable quiz/content
+mix, while different classes cover many grades and subjects. `--concurrency`
+virtual users pull requests from the shared schedule for `--duration` seconds
+(or until `--requests` are sent).
+
+Reported per endpoint and overall: throughput, error rate, p50/p95/p99 latency,
+time to first byte and time to first token. The endpoints do not stream, so
+TTFT is derived from the response's Server-Timing header as the client latency
+minus the server's decode and parse spans.
+
+`--spawn-stub` starts the service itself with INFERENCE_BACKEND=stub (canned
+JSON, no weights), which is what CI runs:
+
+    python load_test.py --spawn-stub --duration 30 --concurrency 16 --max-error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from curriculum_tree import load_curriculum_tree
+from warmup import DEFAULT_SAMPLE
+
+DEFAULT_GRADES = [f"b{n}" for n in range(1, 10)]
+# Server-Timing spans that happen after the first generated token
+POST_FIRST_TOKEN_SPANS = ("decode", "parse")
+
+def lesson_pool(limit: int = 200) -> List[Dict[str, str]]:
+    """(subject, topic, subtopic) triples from the curriculum tree."""
+    try:
+        tree = load_curriculum_tree()
+    except OSError:
+        tree = []
+    lessons = [{"subject_id": topic["subject_id"], "topic_id": topic["topic_id"],
+                "subtopic_id": subtopic["subtopic_id"]}
+               for topic in tree for subtopic in topic["subtopics"]]
+    if not lessons:
+        lessons = [{key: DEFAULT_SAMPLE[key] for key in ("subject_id", "topic_id", "subtopic_id")}]
+    return lessons[:limit]
+
+def classroom_bursts(rng: random.Random, lessons: List[Dict[str, str]], grades: List[str],
+                     class_size: int, quiz_ratio: float, num_cards: int):
+    """Endless stream of (endpoint, payload); each burst is one class on one subtopic and grade."""
+    while True:
+        lesson = {**rng.choice(lessons), "grade_id": rng.choice(grades)}
+        for _ in range(class_size):
+            if rng.random() < quiz_ratio:
+                yield "generate-quiz", {**lesson, "quiz_type": rng.choice(["mid", "final"]),
+                                        "difficulty": rng.randint(1, 3)}
+            else:
+                yield "generate-content", {**lesson, "user_level": rng.randint(1, 3), "num_cards": num_cards}
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """'retrieval;dur=12.3, decode;dur=40.1;desc="2 calls"' -> {"retrieval": 12.3, "decode": 40.1}"""
+    timings = {}
+    for entry in header.split(","):
+        parts = [part.strip() for part in entry.split(";")]
+        if not parts[0]:
+            continue
+        for part in parts[1:]:
+            if part.startswith("dur="):
+                try:
+                    timings[parts[0]] = float(part[4:])
+                except ValueError:
+                    pass
+    return timings
+
+def send_request(session: requests.Session, base_url: str, endpoint: str, payload: Dict, timeout: float) -> Dict:
+    """One blocking request; runs on the executor so the event loop only schedules."""
+    result = {"endpoint": endpoint, "ok": False, "status": None, "latency_ms": None,
+              "ttfb_ms": None, "ttft_ms": None, "error": None}
+    start_time = time.perf_counter()
+    try:
+        # stream=True returns once the headers are in, which gives time to first byte
+        response = session.post(f"{base_url}/{endpoint}", json=payload, timeout=timeout, stream=True)
+        result["ttfb_ms"] = (time.perf_counter() - start_time) * 1000
+        body = response.content
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        result.update(status=response.status_code, latency_ms=latency_ms)
+        if response.status_code != 200:
+            result["error"] = f"HTTP {response.status_code}"
+            return result
+        json.loads(body)
+        result["ok"] = True
+        timings = parse_server_timing(response.headers.get("Server-Timing", ""))
+        if "decode" in timings:
+            result["ttft_ms"] = max(latency_ms - sum(timings.get(name, 0.0) for name in POST_FIRST_TOKEN_SPANS), 0.0)
+    except requests.exceptions.RequestException as e:
+        result["latency_ms"] = (time.perf_counter() - start_time) * 1000
+        result["error"] = type(e).__name__
+    except ValueError:
+        result["error"] = "invalid JSON"
+    return result
+
+async def run_load(base_url: str, traffic, concurrency: int, duration: float,
+                   max_requests: Optional[int], timeout: float) -> Tuple[List[Dict], float]:
+    """Keep `concurrency` requests in flight until the duration or request budget runs out."""
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(concurrency)
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency))
+    deadline = time.perf_counter() + duration
+    results = []
+    sent = 0
+
+    async def virtual_user():
+        nonlocal sent
+        while time.perf_counter() < deadline and (max_requests is None or sent < max_requests):
+            sent += 1
+            endpoint, payload = next(traffic)
+            results.append(await loop.run_in_executor(executor, send_request, session, base_url,
+                                                      endpoint, payload, timeout))
+
+    start_time = time.perf_counter()
+    try:
+        await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+    finally:
+        executor.shutdown(wait=False)
+        session.close()
+    return results, time.perf_counter() - start_time
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+def summarize(results: List[Dict], elapsed: float) -> Dict:
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency_ms"] for r in ok]
+    ttfbs = [r["ttfb_ms"] for r in ok]
+    ttfts = [r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        "error_kinds": errors,
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {"p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95),
+                       "p99": percentile(latencies, 0.99),
+                       "mean": round(statistics.mean(latencies), 1) if latencies else None},
+        "ttfb_ms": {"p50": percentile(ttfbs, 0.50), "p95": percentile(ttfbs, 0.95)},
+        "ttft_ms": {"p50": percentile(ttfts, 0.50), "p95": percentile(ttfts, 0.95), "p99": percentile(ttfts, 0.99)},
+    }
+
+def wait_until_ready(base_url: str, timeout: float = 900) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=5).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+def spawn_stub_service(port: int, seconds_per_token: float) -> subprocess.Popen:
+    """Start the real API with the model replaced by StubBackend."""
+    env = {**os.environ, "INFERENCE_BACKEND": "stub", "STUB_SECONDS_PER_TOKEN": str(seconds_per_token)}
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "api_model_service:app",
+                             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"], env=env)
+
+def print_report(report: Dict):
+    print(f"\n{'endpoint':<18}{'reqs':>6}{'err%':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'ttfb p50':>10}{'ttft p50':>10}{'ttft p95':>10}")
+    for name, stats in [("all", report["overall"])] + sorted(report["endpoints"].items()):
+        latency, ttfb, ttft = stats["latency_ms"], stats["ttfb_ms"], stats["ttft_ms"]
+        cells = [latency["p50"], latency["p95"], latency["p99"], ttfb["p50"], ttft["p50"], ttft["p95"]]
+        cells = ["-" if value is None else value for value in cells]
+        print(f"{name:<18}{stats['requests']:>6}{stats['error_rate'] * 100:>7.1f}{stats['throughput_rps']:>8}"
+              f"{cells[0]:>9}{cells[1]:>9}{cells[2]:>9}{cells[3]:>10}{cells[4]:>10}{cells[5]:>10}")
+    if report["overall"]["error_kinds"]:
+        print(f"errors: {report['overall']['error_kinds']}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay classroom traffic against the model service.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=8, help="Virtual users with one request in flight each")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of load")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after this many requests instead")
+    parser.add_argument("--class-size", type=int, default=25, help="Requests per burst on the same subtopic and grade")
+    parser.add_argument("--quiz-ratio", type=float, default=0.5, help="Fraction of requests that are quizzes")
+    parser.add_argument("--grades", default=",".join(DEFAULT_GRADES))
+    parser.add_argument("--num-cards", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="Exit 1 when the error rate is higher")
+    parser.add_argument("--spawn-stub", action="store_true", help="Start the service with INFERENCE_BACKEND=stub")
+    parser.add_argument("--port", type=int, default=8020, help="Port for --spawn-stub")
+    parser.add_argument("--stub-seconds-per-token", type=float, default=0.0)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    base_url = args.base_url.rstrip("/")
+    server = None
+    if args.spawn_stub:
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = spawn_stub_service(args.port, args.stub_seconds_per_token)
+
+    try:
+        if not wait_until_ready(base_url, timeout=120 if server else 900):
+            print(f"Service at {base_url} did not become ready")
+            sys.exit(1)
+
+        traffic = classroom_bursts(random.Random(args.seed), lesson_pool(), args.grades.split(","),
+                                   args.class_size, args.quiz_ratio, args.num_cards)
+        results, elapsed = asyncio.run(run_load(base_url, traffic, args.concurrency, args.duration,
+                                                args.requests, args.timeout))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    by_endpoint = {}
+    for r in results:
+        by_endpoint.setdefault(r["endpoint"], []).append(r)
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_s": round(elapsed, 2),
+        "overall": summarize(results, elapsed),
+        "endpoints": {endpoint: summarize(rs, elapsed) for endpoint, rs in by_endpoint.items()},
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if args.max_error_rate is not None and report["overall"]["error_rate"] > args.max_error_rate:
+        print(f"Error rate {report['overall']['error_rate']} exceeds {args.max_error_rate}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
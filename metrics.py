@@ -0,0 +1,178 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+Recording is a lock, a dict lookup and (for histograms) a bisect, so it is
+cheap enough for the generation hot path. No client library is needed; the
+/metrics endpoint calls render().
+"""
+
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from tracing import record_span, writer as trace_writer
+
+# Stage latencies span sub-millisecond parsing to multi-minute CPU decodes
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self, name: str) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, namespace: str) -> List[str]:
+        name = f"{namespace}_{self.name}" if namespace else self.name
+        return [f"# HELP {name} {self.documentation}", f"# TYPE {name} {self.kind}"] + self.samples(name)
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def totals(self, labelname: str) -> Dict[str, float]:
+        """Sum over all other labels, keyed by the value of labelname."""
+        index = self.labelnames.index(labelname)
+        result = {}
+        with self._lock:
+            for key, value in self._values.items():
+                result[key[index]] = result.get(key[index], 0) + value
+        return result
+
+    def samples(self, name: str) -> List[str]:
+        with self._lock:
+            return [f"{name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+class Gauge(_Metric):
+    """Current value per label set, or a callback evaluated at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self, name: str) -> List[str]:
+        if self.function is not None:
+            return [f"{name} {self.function()}"]
+        with self._lock:
+            return [f"{name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def total(self, **labels) -> Tuple[float, int]:
+        """(sum, count) of the observations for one label set."""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[1], state[2]) if state else (0.0, 0)
+
+    def samples(self, name: str) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    bucket_labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+REGISTRY: List[_Metric] = []
+
+def render(namespace: str = "smartclass") -> str:
+    """All registered metrics in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(namespace))
+    return "\n".join(lines) + "\n"
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds", "Latency of each request stage (retrieval, prompt_build, tokenize, prefill, decode, parse, total)",
+    ["endpoint", "stage"])
+TOKENS = Counter("tokens_total", "Prompt (in) and generated (out) tokens", ["endpoint", "direction"])
+PARSE_PATH = Counter("parse_path_total", "How the model output was turned into a response", ["endpoint", "method"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Server-side cache lookups", ["cache", "result"])
+BUDGET_OUTCOMES = Counter("generation_budget_total", "Generations that fit their max_new_tokens budget or ran into it",
+                          ["endpoint", "result"])
+UNUSED_BUDGET_TOKENS = Counter("budget_unused_tokens_total", "max_new_tokens left unused by generations that fit",
+                               ["endpoint"])
+PROMPT_FITS = Counter("prompt_fit_total", "RAG prompts that fit the prompt token limit, or had their curriculum shrunk or dropped",
+                      ["endpoint", "result"])
+RETRIEVAL_REQUESTS = Counter("retrieval_requests_total", "ChromaDB queries by outcome (ok, error, timeout, circuit_open)",
+                             ["result"])
+INFLIGHT = Gauge("inflight_requests", "Requests currently being handled", ["endpoint"])
+TRACE_QUEUE = Gauge("trace_queue_depth", "Finished traces waiting to be written to TRACE_FILE", function=trace_writer.pending)
+TRACES_DROPPED = Gauge("traces_dropped", "Traces discarded since startup because the trace writer fell behind",
+                       function=lambda: trace_writer.dropped)
+
+def observe_stage(endpoint: str, stage: str, start_time: float) -> float:
+    """Record the time since start_time (a perf_counter value) for a stage and trace span; returns now."""
+    now = time.perf_counter()
+    STAGE_SECONDS.observe(now - start_time, endpoint=endpoint, stage=stage)
+    record_span(stage, start_time, now)
+    return now
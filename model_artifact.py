@@ -0,0 +1,200 @@
+"""
+Pre-merged model artifact for fast service startup.
+
+`python model_artifact.py export` loads the base model, applies the fine-tuned
+PEFT adapter, merges it once and writes the merged weights as safetensors plus
+a manifest that fingerprints the base model and adapter it came from.
+At startup the service checks the manifest and, when it still matches,
+memory-maps the safetensors straight into an empty model skeleton instead of
+downloading/merging on every boot.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import torch
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Configuration
+BASE_MODEL = "meta-llama/Llama-3.2-1B"
+FINETUNED_MODEL_PATH = "./llama3.2-1b-syllabus-finetuned"
+MERGED_MODEL_PATH = os.getenv("MERGED_MODEL_PATH", "./llama3.2-1b-syllabus-merged")
+MANIFEST_FILE = "smartclass_manifest.json"
+MANIFEST_VERSION = 1
+# Only these adapter files feed the merge; checkpoint-*/ and trainer state are ignored
+ADAPTER_FILE_PREFIXES = ("adapter_config.json", "adapter_model.")
+
+DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+def _sha256_file(path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _base_model_revision(base_model: str) -> str:
+    """Resolve the commit hash of the base model from the local HF cache (never the hub)."""
+    try:
+        from transformers import AutoConfig
+        return getattr(AutoConfig.from_pretrained(base_model, local_files_only=True), "_commit_hash", None) or "unknown"
+    except Exception as e:
+        logger.warning(f"Could not resolve base model revision for {base_model}: {e}")
+        return "unknown"
+
+def _adapter_files(adapter_path: str, known: Optional[Dict] = None) -> Dict[str, Dict]:
+    """Size, mtime and sha256 of each adapter file; a file whose size and mtime match known is not re-hashed."""
+    known = known or {}
+    files = {}
+    for name in sorted(os.listdir(adapter_path)):
+        path = os.path.join(adapter_path, name)
+        if not name.startswith(ADAPTER_FILE_PREFIXES) or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        previous = known.get(name) or {}
+        if previous.get("size") == entry["size"] and previous.get("mtime_ns") == entry["mtime_ns"] and previous.get("sha256"):
+            entry["sha256"] = previous["sha256"]
+        else:
+            entry["sha256"] = _sha256_file(path)
+        files[name] = entry
+    return files
+
+def compute_source_hash(base_model: str = BASE_MODEL, adapter_path: str = FINETUNED_MODEL_PATH,
+                        known_files: Optional[Dict] = None) -> Dict:
+    """Fingerprint the base model (id + revision) and the adapter's config and weights."""
+    adapter_files = _adapter_files(adapter_path, known_files)
+    adapter_digest = hashlib.sha256()
+    for name, entry in adapter_files.items():
+        adapter_digest.update(name.encode('utf-8'))
+        adapter_digest.update(entry["sha256"].encode('utf-8'))
+
+    base_revision = _base_model_revision(base_model)
+    source_hash = hashlib.sha256(f"{base_model}@{base_revision}:{adapter_digest.hexdigest()}".encode('utf-8')).hexdigest()
+    return {
+        "base_model": base_model,
+        "base_revision": base_revision,
+        "adapter_sha256": adapter_digest.hexdigest(),
+        "adapter_files": adapter_files,
+        "source_sha256": source_hash,
+    }
+
+def export_merged_model(output_dir: str = MERGED_MODEL_PATH, base_model: str = BASE_MODEL,
+                        adapter_path: str = FINETUNED_MODEL_PATH, dtype: str = "float32") -> Dict:
+    """Merge the adapter into the base model once and write safetensors + manifest."""
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    start_time = time.perf_counter()
+    logger.info(f"Loading {base_model} and adapter {adapter_path} for export...")
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=DTYPES[dtype])
+    model = PeftModel.from_pretrained(model, adapter_path).merge_and_unload()
+
+    os.makedirs(output_dir, exist_ok=True)
+    # One large shard keeps the startup path to a single mmap
+    model.save_pretrained(output_dir, safe_serialization=True, max_shard_size="20GB")
+    tokenizer.save_pretrained(output_dir)
+
+    weight_files = sorted(name for name in os.listdir(output_dir) if name.endswith(".safetensors"))
+    manifest = {
+        "manifest_version": MANIFEST_VERSION,
+        "dtype": dtype,
+        "weights": {name: _sha256_file(os.path.join(output_dir, name)) for name in weight_files},
+        **compute_source_hash(base_model, adapter_path),
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    logger.info(f"Exported merged model to {output_dir} in {time.perf_counter() - start_time:.1f}s")
+    return manifest
+
+def find_merged_artifact(output_dir: str = MERGED_MODEL_PATH, base_model: str = BASE_MODEL,
+                         adapter_path: str = FINETUNED_MODEL_PATH) -> Optional[Dict]:
+    """Return the artifact manifest if it exists and matches the current base model + adapter."""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if manifest.get("manifest_version") != MANIFEST_VERSION:
+        logger.warning(f"Merged artifact at {output_dir} has an unsupported manifest version, ignoring it")
+        return None
+    # Without the adapter directory there is nothing to compare against; trust the artifact
+    if os.path.isdir(adapter_path):
+        # Unchanged adapter files (same size and mtime) reuse the manifest's hashes
+        current = compute_source_hash(base_model, adapter_path, manifest.get("adapter_files"))
+        if current["adapter_sha256"] != manifest.get("adapter_sha256") or (
+                current["base_revision"] != "unknown" and current["base_revision"] != manifest.get("base_revision")):
+            logger.warning(f"Merged artifact at {output_dir} is stale (base model or adapter changed); re-run "
+                           f"'python model_artifact.py export'")
+            return None
+    return manifest
+
+def load_merged_model(output_dir: str = MERGED_MODEL_PATH, manifest: Optional[Dict] = None):
+    """
+    Load the merged weights with zero-copy on CPU: build the model skeleton on the
+    meta device and assign memory-mapped safetensors tensors as its parameters.
+    """
+    from accelerate import init_empty_weights
+    from safetensors.torch import load_file
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    manifest = manifest or find_merged_artifact(output_dir)
+    dtype = DTYPES[manifest.get("dtype", "float32")] if manifest else torch.float32
+    config = AutoConfig.from_pretrained(output_dir)
+
+    # Parameters stay on the meta device; buffers such as rotary frequencies are materialized normally
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+
+    state_dict = {}
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith(".safetensors"):
+            state_dict.update(load_file(os.path.join(output_dir, name), device="cpu"))
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    still_empty = [name for name, param in model.named_parameters() if param.is_meta]
+    if still_empty:
+        raise RuntimeError(f"Merged artifact at {output_dir} is missing weights: {still_empty[:5]}")
+    return model.eval()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export or inspect the pre-merged SmartClass model artifact.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Merge the adapter and write safetensors + manifest")
+    export_parser.add_argument("--output", default=MERGED_MODEL_PATH)
+    export_parser.add_argument("--base-model", default=BASE_MODEL)
+    export_parser.add_argument("--adapter", default=FINETUNED_MODEL_PATH)
+    export_parser.add_argument("--dtype", choices=list(DTYPES), default="float32",
+                               help="Stored dtype; match the serving dtype for zero-copy loading")
+
+    verify_parser = subparsers.add_parser("verify", help="Check the artifact against the current base model + adapter")
+    verify_parser.add_argument("--output", default=MERGED_MODEL_PATH)
+    verify_parser.add_argument("--adapter", default=FINETUNED_MODEL_PATH)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.command == "export":
+        export_merged_model(args.output, args.base_model, args.adapter, args.dtype)
+    else:
+        manifest = find_merged_artifact(args.output, adapter_path=args.adapter)
+        if manifest is None:
+            logger.error(f"No up-to-date merged artifact at {args.output}")
+            raise SystemExit(1)
+        logger.info(f"Merged artifact at {args.output} is up to date (source {manifest['source_sha256'][:12]})")
+
+if __name__ == "__main__":
+    main()
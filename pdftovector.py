@@ -26,21 +26,25 @@ CHUNK_OVERLAP = 150  # Characters to overlap between chunks
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extracts all text content from a PDF file."""
+def extract_pages_from_pdf(pdf_path: str) -> list[str]:
+    """Extracts the text of each page, with whitespace collapsed."""
     try:
         doc = fitz.open(pdf_path)
-        full_text = ""
+        pages = []
         for page_num in range(len(doc)):
             page = doc.load_page(page_num)
-            full_text += page.get_text("text") + "\n"  # Add newline between pages for clarity
+            pages.append(' '.join(page.get_text("text").split()))
         doc.close()
-        # Basic cleaning: remove excessive newlines and leading/trailing whitespace
-        cleaned_text = ' '.join(full_text.split())
-        return cleaned_text
+        return pages
     except Exception as e:
         logging.error(f"Error extracting text from {pdf_path}: {e}")
-        return ""
+        return []
+
+
+def extract_text_from_pdf(pdf_path: str) -> str:
+    """Extracts all text content from a PDF file."""
+    # Basic cleaning: remove excessive newlines and leading/trailing whitespace
+    return ' '.join(page for page in extract_pages_from_pdf(pdf_path) if page)
 
 
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> list[str]:
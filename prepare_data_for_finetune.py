@@ -1,7 +1,11 @@
+import argparse
+import array
+import gzip
 import chromadb
 import json
 import logging
 import os
+import sys
 
 # --- Configuration ---
 # Ensure these match your existing ChromaDB setup
@@ -11,6 +15,14 @@ COLLECTION_NAME = "syllabus_collection" # Name of your collection in ChromaDB
 # Output file for the fine-tuning dataset
 OUTPUT_FINETUNE_DATA_FILE = "./syllabus_finetune_data.jsonl"
 
+# Streaming export parameters
+PAGE_SIZE = 500  # Documents fetched from ChromaDB per page
+SHARD_SIZE_MB = 0  # Uncompressed MB per shard; 0 writes a single file
+COMPRESSION = "none"  # "none", "gzip" or "zstd"
+
+# Tokenizer used for the pre-tokenized variant (must match the base model being fine-tuned)
+TOKENIZER_NAME = "meta-llama/Llama-3.2-1B"
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -26,29 +38,190 @@ def format_for_llama3_finetuning(chunk_text: str, source_pdf: str, chunk_num: in
 
     return f"<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n{user_prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n{assistant_response}<|eot_id|>"
 
+def iter_collection_pages(collection, page_size: int = PAGE_SIZE):
+    """
+    Yields (documents, metadatas) pages from the collection using limit/offset,
+    so the whole collection is never held in memory at once.
+    """
+    offset = 0
+    while True:
+        results = collection.get(include=['documents', 'metadatas'], limit=page_size, offset=offset)
+        documents = results.get('documents') or []
+        metadatas = results.get('metadatas') or []
+        if not documents:
+            break
+        yield documents, metadatas
+        offset += len(documents)
+        if len(documents) < page_size:
+            break
+
+def _open_compressed(path: str, compression: str):
+    """Open a binary output stream with the requested compression."""
+    if compression == "gzip":
+        return gzip.open(path, 'wb', compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression requires the 'zstandard' package (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'), closefd=True)
+    return open(path, 'wb')
+
+class ShardedJSONLWriter:
+    """
+    Writes JSONL records incrementally, rolling over to a new shard once the
+    current one reaches shard_size_bytes of uncompressed data.
+    """
+
+    EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(self, output_file: str, shard_size_bytes: int = 0, compression: str = "none"):
+        if compression not in self.EXTENSIONS:
+            raise ValueError(f"Unsupported compression '{compression}'. Choose from {list(self.EXTENSIONS)}")
+        self.output_file = output_file
+        self.shard_size_bytes = shard_size_bytes
+        self.compression = compression
+        self.shard_paths = []
+        self.records_written = 0
+        self._stream = None
+        self._shard_bytes = 0
+
+    def _shard_path(self, index: int) -> str:
+        extension = self.EXTENSIONS[self.compression]
+        if not self.shard_size_bytes:
+            return self.output_file + extension
+        root, ext = os.path.splitext(self.output_file)
+        return f"{root}-{index:05d}{ext or '.jsonl'}{extension}"
+
+    def _roll_over(self):
+        self.close()
+        path = self._shard_path(len(self.shard_paths))
+        self._stream = _open_compressed(path, self.compression)
+        self.shard_paths.append(path)
+        self._shard_bytes = 0
+
+    def write(self, entry: dict):
+        line = (json.dumps(entry) + '\n').encode('utf-8')
+        if self._stream is None or (self.shard_size_bytes and self._shard_bytes >= self.shard_size_bytes):
+            self._roll_over()
+        self._stream.write(line)
+        self._shard_bytes += len(line)
+        self.records_written += 1
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TokenizedWriter:
+    """
+    Writes a pre-tokenized copy of the dataset so training does not re-tokenize every epoch.
+
+    <prefix>.bin holds every token id back to back as little-endian uint32
+    (the Llama 3 vocabulary does not fit in uint16). <prefix>.idx holds
+    little-endian int64 document boundaries: N+1 offsets into the token array,
+    so document i is tokens[idx[i]:idx[i+1]]. Both files can be np.memmap'ed.
+    """
+
+    def __init__(self, prefix: str, tokenizer):
+        self.prefix = prefix
+        self.tokenizer = tokenizer
+        self.bin_path = prefix + ".bin"
+        self.idx_path = prefix + ".idx"
+        self._bin = open(self.bin_path, 'wb')
+        self._offsets = array.array('q', [0])
+        self.num_tokens = 0
+
+    def write_batch(self, texts: list):
+        # The chat template already carries <|begin_of_text|>, so don't add special tokens twice
+        encoded = self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        for ids in encoded:
+            tokens = array.array('I', ids)
+            if sys.byteorder != 'little':
+                tokens.byteswap()
+            tokens.tofile(self._bin)
+            self.num_tokens += len(ids)
+            self._offsets.append(self.num_tokens)
+
+    def close(self):
+        self._bin.close()
+        offsets = self._offsets
+        if sys.byteorder != 'little':
+            offsets = array.array('q', offsets)
+            offsets.byteswap()
+        with open(self.idx_path, 'wb') as f:
+            offsets.tofile(f)
+
+def export_finetune_data(collection, output_file: str = OUTPUT_FINETUNE_DATA_FILE, page_size: int = PAGE_SIZE,
+                         shard_size_mb: float = SHARD_SIZE_MB, compression: str = COMPRESSION, tokenizer=None):
+    """
+    Streams the collection page by page into (optionally sharded and compressed) JSONL,
+    and into a pre-tokenized binary dataset when a tokenizer is given.
+    """
+    token_writer = None
+    if tokenizer is not None:
+        token_writer = TokenizedWriter(os.path.splitext(output_file)[0] + ".tokens", tokenizer)
+
+    with ShardedJSONLWriter(output_file, int(shard_size_mb * 1024 * 1024), compression) as writer:
+        for page_num, (documents, metadatas) in enumerate(iter_collection_pages(collection, page_size)):
+            page_texts = []
+            for doc_text, meta in zip(documents, metadatas):
+                if doc_text and meta: # Ensure both document text and metadata exist
+                    source_pdf = meta.get('source_pdf', 'Unknown_PDF_Source')
+                    chunk_num = meta.get('chunk_number', 0)
+                    formatted_entry_text = format_for_llama3_finetuning(doc_text, source_pdf, chunk_num)
+                    writer.write({"text": formatted_entry_text})
+                    page_texts.append(formatted_entry_text)
+
+            if token_writer is not None and page_texts:
+                token_writer.write_batch(page_texts)
+            logging.info(f"Page {page_num + 1}: {writer.records_written} entries written so far")
+
+    if token_writer is not None:
+        token_writer.close()
+        logging.info(f"Wrote {token_writer.num_tokens} tokens to {token_writer.bin_path} (index: {token_writer.idx_path})")
+
+    logging.info(f"Successfully wrote {writer.records_written} formatted entries to {len(writer.shard_paths)} file(s): {', '.join(writer.shard_paths)}")
+    return writer.shard_paths
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the syllabus collection as a Llama 3 fine-tuning dataset.")
+    parser.add_argument("--output", default=OUTPUT_FINETUNE_DATA_FILE, help="Output JSONL path (shards get a -NNNNN suffix)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="Documents fetched from ChromaDB per page")
+    parser.add_argument("--shard-size-mb", type=float, default=SHARD_SIZE_MB, help="Uncompressed MB per shard (0 = single file)")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default=COMPRESSION)
+    parser.add_argument("--tokenize", action="store_true", help="Also write a pre-tokenized .bin/.idx dataset")
+    parser.add_argument("--tokenizer", default=TOKENIZER_NAME, help="Tokenizer used with --tokenize")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     logging.info("Starting data preparation for fine-tuning...")
     client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
     logging.info(f"Attempting to connect to ChromaDB collection: '{COLLECTION_NAME}' at path '{CHROMA_DB_PATH}'")
     collection = client.get_collection(name=COLLECTION_NAME)
     logging.info(f"Successfully connected to collection. Total documents: {collection.count()}")
 
-    results = collection.get(include=['documents', 'metadatas'])
-    documents = results.get('documents', [])
-    metadatas = results.get('metadatas', [])
-
-    finetuning_data_entries = []
-    for doc_text, meta in zip(documents, metadatas):
-        if doc_text and meta: # Ensure both document text and metadata exist
-            source_pdf = meta.get('source_pdf', 'Unknown_PDF_Source')
-            chunk_num = meta.get('chunk_number', 0)
-            formatted_entry_text = format_for_llama3_finetuning(doc_text, source_pdf, chunk_num)
-            finetuning_data_entries.append({"text": formatted_entry_text})
+    tokenizer = None
+    if args.tokenize:
+        from transformers import AutoTokenizer
+        logging.info(f"Loading tokenizer '{args.tokenizer}' for the pre-tokenized dataset...")
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
 
-    with open(OUTPUT_FINETUNE_DATA_FILE, 'w', encoding='utf-8') as f:
-        for entry in finetuning_data_entries:
-            f.write(json.dumps(entry) + '\n')
-    logging.info(f"Successfully wrote {len(finetuning_data_entries)} formatted entries to {OUTPUT_FINETUNE_DATA_FILE}")
+    export_finetune_data(
+        collection,
+        output_file=args.output,
+        page_size=args.page_size,
+        shard_size_mb=args.shard_size_mb,
+        compression=args.compression,
+        tokenizer=tokenizer,
+    )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
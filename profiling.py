@@ -0,0 +1,192 @@
+"""
+On-demand profiling of the request hot paths.
+
+An admin starts a session for the next N requests or T seconds; it is stopped
+by the HTTP middleware or a timer. The endpoints run generation, JSON recovery
+and ChromaDB queries on worker threads, and cProfile and pyinstrument only see
+the thread they were started on. So besides the event-loop thread, every
+blocking call the service hands to a worker goes through call(), which
+profiles it on its own thread; the per-thread results are merged when the
+session stops. While no session exists the only costs are the middleware's and
+call()'s `active_session is not None` checks.
+
+Modes:
+- "cprofile": stdlib deterministic profiler, pstats summary + .prof file
+- "pyinstrument": sampling profiler (optional package), text summary + HTML flamegraph
+- "torch": torch.profiler operator table + Chrome trace (view in chrome://tracing or Perfetto);
+  it records operators on all threads by itself
+"""
+
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MODES = ("cprofile", "pyinstrument", "torch")
+SUMMARY_ROWS = 40
+
+class ProfilingSession:
+    """One profiler run covering a number of requests and/or a time window."""
+
+    def __init__(self, mode: str, max_requests: Optional[int] = None, seconds: Optional[float] = None):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}'; choose from {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.max_requests = max_requests
+        self.seconds = seconds
+        self.requests = 0
+        self.state = "idle"
+        self.started_at = None
+        self.summary = None
+        self.artifact = None
+        self._profiler = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._thread_results = []  # cProfile.Profile objects or pyinstrument sessions from worker calls
+
+    def _new_profiler(self):
+        if self.mode == "cprofile":
+            return cProfile.Profile()
+        from pyinstrument import Profiler
+        return Profiler(async_mode="disabled")
+
+    def start(self):
+        """Start profiling the calling (event-loop) thread; worker threads are profiled through call()."""
+        if self.mode == "cprofile":
+            self._profiler = self._new_profiler()
+            self._profiler.enable()
+        elif self.mode == "pyinstrument":
+            try:
+                self._profiler = self._new_profiler()
+            except ImportError:
+                raise ValueError("Profiling mode 'pyinstrument' requires the 'pyinstrument' package")
+            self._profiler.start()
+        else:
+            import torch
+            self._profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                                    record_shapes=True)
+            self._profiler.__enter__()
+
+        self.state = "running"
+        self.started_at = time.time()
+        if self.seconds:
+            self._timer = asyncio.get_running_loop().call_later(self.seconds, self.stop)
+        logger.info(f"Profiling ({self.mode}) started for "
+                    f"{self.max_requests or 'unlimited'} requests / {self.seconds or 'unlimited'} seconds")
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Run func profiled on the current thread and keep the result for the merged report."""
+        if self.state != "running" or self.mode == "torch" or getattr(_profiled_thread, "active", False):
+            return func(*args, **kwargs)
+        profiler = self._new_profiler()
+        _profiled_thread.active = True
+        if self.mode == "cprofile":
+            profiler.enable()
+        else:
+            profiler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if self.mode == "cprofile":
+                profiler.disable()
+            else:
+                profiler.stop()
+            _profiled_thread.active = False
+            with self._lock:
+                if self.state == "running":
+                    self._thread_results.append(profiler if self.mode == "cprofile" else profiler.last_session)
+
+    def request_done(self):
+        """Called by the middleware after every request while the session is running."""
+        self.requests += 1
+        if self.max_requests and self.requests >= self.max_requests:
+            self.stop()
+
+    def stop(self):
+        global active_session
+        if self.state != "running":
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        with self._lock:
+            self.state = "stopping"  # Worker calls finishing from now on are not merged
+            thread_results = self._thread_results
+            self._thread_results = []
+
+        if self.mode == "cprofile":
+            self._profiler.disable()
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=stream)
+            if thread_results:
+                stats.add(*thread_results)
+            stats.sort_stats("cumulative").print_stats(SUMMARY_ROWS)
+            self.summary = stream.getvalue()
+            self.artifact = os.path.join(PROFILE_DIR, f"profile-{stamp}.prof")
+            stats.dump_stats(self.artifact)
+        elif self.mode == "pyinstrument":
+            from pyinstrument.renderers import ConsoleRenderer, HTMLRenderer
+            from pyinstrument.session import Session
+            self._profiler.stop()
+            session = functools.reduce(Session.combine, thread_results, self._profiler.last_session)
+            self.summary = ConsoleRenderer(unicode=True).render(session)
+            self.artifact = os.path.join(PROFILE_DIR, f"profile-{stamp}.html")
+            with open(self.artifact, "w", encoding="utf-8") as f:
+                f.write(HTMLRenderer().render(session))
+        else:
+            self._profiler.__exit__(None, None, None)
+            self.summary = self._profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=SUMMARY_ROWS)
+            self.artifact = os.path.join(PROFILE_DIR, f"trace-{stamp}.json")
+            self._profiler.export_chrome_trace(self.artifact)
+
+        self._profiler = None
+        self.state = "done"
+        if active_session is self:
+            active_session = None
+        logger.info(f"Profiling ({self.mode}) finished after {self.requests} requests; wrote {self.artifact}")
+
+    def describe(self) -> dict:
+        return {
+            "state": self.state,
+            "mode": self.mode,
+            "requests_profiled": self.requests,
+            "max_requests": self.max_requests,
+            "seconds": self.seconds,
+            "started_at": self.started_at,
+            "artifact": self.artifact,
+            "summary": self.summary,
+        }
+
+# The running session (checked by the middleware) and the most recent one (for results)
+active_session: Optional[ProfilingSession] = None
+last_session: Optional[ProfilingSession] = None
+_profiled_thread = threading.local()  # Set while a thread runs inside ProfilingSession.call
+
+def call(func: Callable, *args, **kwargs):
+    """func(*args, **kwargs), profiled on the current worker thread while a session is running."""
+    session = active_session
+    if session is None:
+        return func(*args, **kwargs)
+    return session.call(func, *args, **kwargs)
+
+def start_session(mode: str, max_requests: Optional[int] = None, seconds: Optional[float] = None) -> ProfilingSession:
+    """Start a session from the event-loop thread; only one session may run at a time."""
+    global active_session, last_session
+    if active_session is not None:
+        raise RuntimeError("A profiling session is already running")
+    if not max_requests and not seconds:
+        raise ValueError("Set a number of requests and/or a number of seconds to profile")
+    session = ProfilingSession(mode, max_requests, seconds)
+    session.start()
+    active_session = last_session = session
+    return session
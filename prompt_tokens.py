@@ -0,0 +1,76 @@
+"""
+Prompt tokenization from cached paragraph token ids.
+
+Prompts are assembled from a few fixed template paragraphs and retrieved
+curriculum text, separated by blank lines, and consecutive requests for the
+same subtopic share most of them. PromptTokenCache splits a prompt after each
+blank line, looks every paragraph up in an LRU cache of token ids and only runs
+the tokenizer on paragraphs it has not seen. The ids are concatenated at the
+token level.
+
+Concatenation is only equivalent to tokenizing the whole prompt if the
+tokenizer never merges across a blank line (true for Llama 3's BPE, whose
+pre-tokenizer splits there). The cache checks this on a probe text when it is
+created and otherwise tokenizes whole prompts.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import List
+
+from metrics import CACHE_REQUESTS
+
+# Split after a blank line when the next paragraph starts with a non-space character
+_PARAGRAPH_END = re.compile(r"(?<=\n\n)(?=\S)")
+_PROBE = ('Generate 5 educational content cards for MATHS Grade B1.\n\nTopic: numbers\nSubtopic: counting\n\n'
+          'CURRICULUM CONTENT FROM SYLLABUS:\nB1.1.1.1 Count up to 100.\n\n\nIndicators: 3.\n\n'
+          'Return ONLY valid JSON array:\n[{"title":"Lesson Title","body":"<p>x</p>"}]\n\nJSON:')
+
+class PromptTokenCache:
+    """Thread-safe tokenization of prompts from cached paragraph token ids."""
+
+    def __init__(self, tokenizer, max_entries: int = 2048):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._special_prefix = tokenizer("", add_special_tokens=True)["input_ids"]  # BOS for Llama
+        self.enabled = self._encode_paragraphs(_PROBE, record=False) == tokenizer(_PROBE)["input_ids"]
+
+    def _paragraph_ids(self, paragraph: str, record: bool) -> List[int]:
+        with self._lock:
+            ids = self._entries.get(paragraph)
+            if ids is not None:
+                self._entries.move_to_end(paragraph)
+        if record:
+            CACHE_REQUESTS.inc(cache="prompt_tokens", result="hit" if ids is not None else "miss")
+        if ids is None:
+            ids = self.tokenizer(paragraph, add_special_tokens=False)["input_ids"]
+            with self._lock:
+                self._entries[paragraph] = ids
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return ids
+
+    def _encode_paragraphs(self, prompt: str, record: bool = True) -> List[int]:
+        ids = list(self._special_prefix)
+        for paragraph in _PARAGRAPH_END.split(prompt):
+            ids.extend(self._paragraph_ids(paragraph, record))
+        return ids
+
+    def count(self, prompt: str) -> int:
+        """Number of token ids encode() produces for prompt before truncation."""
+        return len(self._encode_paragraphs(prompt) if self.enabled else self.tokenizer(prompt)["input_ids"])
+
+    def encode(self, prompt: str, max_length: int) -> List[int]:
+        """Token ids of prompt (with special tokens), at most max_length.
+
+        Prompts end with their instructions and the JSON cue, so an overlong prompt loses tokens
+        from the start of the text instead (the service fits prompts before they get here).
+        """
+        ids = self._encode_paragraphs(prompt) if self.enabled else self.tokenizer(prompt)["input_ids"]
+        if len(ids) <= max_length:
+            return ids
+        prefix = len(self._special_prefix)
+        return ids[:prefix] + ids[len(ids) - (max_length - prefix):]
@@ -0,0 +1,43 @@
+"""
+CPU quantized execution modes for the merged SmartClass model.
+
+- int8: dynamic int8 quantization of every nn.Linear (torch.ao quantized kernels);
+  weights are stored as int8 and activations are quantized per batch on the fly.
+
+There is no int4 mode: PyTorch's packed int4 CPU kernels are not available in
+the torch versions requirements.txt allows. For 4-bit CPU inference convert the
+merged model to a Q4_K_M GGUF (convert_to_gguf.py) and use the llama_cpp backend.
+"""
+
+import logging
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "int8")
+
+def quantize_model(model: nn.Module, mode: str) -> nn.Module:
+    """Return the model converted to the requested CPU quantization mode."""
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}'. Choose from {QUANTIZATION_MODES}")
+    if mode == "none":
+        return model
+    if next(model.parameters()).device.type != "cpu":
+        logger.warning(f"Quantization mode '{mode}' is CPU-only; keeping the model unquantized on GPU")
+        return model
+
+    model = torch.ao.quantization.quantize_dynamic(model.float().eval(), {nn.Linear}, dtype=torch.qint8)
+    logger.info("Applied dynamic int8 quantization to linear layers")
+    return model
+
+def model_size_mb(model: nn.Module) -> float:
+    """Approximate resident size of parameters, buffers and packed int8 weights."""
+    total = sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+    for module in model.modules():
+        packed = getattr(module, "_packed_params", None)
+        if packed is not None:
+            weight, bias = packed._weight_bias()
+            total += weight.numel() * weight.element_size() + (bias.numel() * bias.element_size() if bias is not None else 0)
+    return total / (1024 * 1024)
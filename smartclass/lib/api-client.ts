@@ -13,6 +13,7 @@ export interface ContentRequest {
   grade_id: string;
   user_level?: number;
   num_cards?: number;
+  structured?: boolean;
 }
 
 export interface QuizRequest {
@@ -22,6 +23,7 @@ export interface QuizRequest {
   grade_id: string;
   quiz_type: 'mid' | 'final';
   difficulty?: number;
+  structured?: boolean;
 }
 
 export interface TopicDescriptionRequest {
@@ -84,6 +86,56 @@ export interface TopicDescriptionResponse {
   };
 }
 
+export interface LessonBundleRequest {
+  topic_id: string;
+  subtopic_id: string;
+  subject_id: string;
+  grade_id: string;
+  user_level?: number;
+  num_cards?: number;
+  difficulty?: number;
+}
+
+export interface LessonBundleResponse {
+  success: boolean;
+  content: ContentResponse;
+  mid_quiz: QuizResponse;
+  final_quiz: QuizResponse;
+}
+
+export type LessonBundlePart =
+  | { part: 'content'; data: ContentResponse }
+  | { part: 'mid_quiz' | 'final_quiz'; data: QuizResponse };
+
+export interface ServerTimingEntry {
+  name: string;
+  duration: number; // milliseconds
+  description?: string;
+}
+
+export interface RequestTiming {
+  endpoint: string;
+  traceId: string | null;
+  entries: ServerTimingEntry[];
+}
+
+/**
+ * Parse a Server-Timing header, e.g. `chroma_query;dur=812.4;desc="3 calls", decode;dur=30551.0`
+ */
+export function parseServerTiming(header: string | null): ServerTimingEntry[] {
+  if (!header) return [];
+  return header.split(',').map(part => {
+    const [name, ...params] = part.trim().split(';');
+    const entry: ServerTimingEntry = { name: name.trim(), duration: 0 };
+    for (const param of params) {
+      const [key, value = ''] = param.trim().split('=');
+      if (key === 'dur') entry.duration = parseFloat(value) || 0;
+      if (key === 'desc') entry.description = value.replace(/^"|"$/g, '');
+    }
+    return entry;
+  }).filter(entry => entry.name);
+}
+
 export interface HealthResponse {
   status: string;
   model_loaded: boolean;
@@ -94,11 +146,19 @@ export interface HealthResponse {
 
 class ApiClient {
   private baseUrl: string;
+  private lastTiming: RequestTiming | null = null;
 
   constructor(baseUrl: string = API_BASE_URL) {
     this.baseUrl = baseUrl;
   }
 
+  /**
+   * Server-side span timings (retrieval, tokenize, prefill, decode, parse...) of the last request
+   */
+  getLastTiming(): RequestTiming | null {
+    return this.lastTiming;
+  }
+
   private async makeRequest<T>(
     endpoint: string,
     options: RequestInit = {}
@@ -114,6 +174,14 @@ class ApiClient {
 
     const response = await fetch(url, { ...defaultOptions, ...options });
 
+    const entries = parseServerTiming(response.headers.get('Server-Timing'));
+    if (entries.length > 0) {
+      this.lastTiming = { endpoint, traceId: response.headers.get('X-Trace-Id'), entries };
+      if (process.env.NODE_ENV === 'development') {
+        console.debug(`${endpoint} timing:`, entries.map(e => `${e.name}=${Math.round(e.duration)}ms`).join(' '));
+      }
+    }
+
     if (!response.ok) {
       const errorText = await response.text();
       throw new Error(`API Error ${response.status}: ${errorText}`);
@@ -159,6 +227,52 @@ class ApiClient {
     });
   }
 
+  /**
+   * Generate content plus mid and final quizzes in one request (one retrieval, one batched generation).
+   * With onPart the bundle is streamed and each part is delivered as soon as it is ready;
+   * content arrives before the quizzes.
+   */
+  async generateLessonBundle(
+    request: LessonBundleRequest,
+    onPart?: (part: LessonBundlePart) => void
+  ): Promise<LessonBundleResponse> {
+    if (!onPart) {
+      return this.makeRequest<LessonBundleResponse>('/generate-lesson-bundle', {
+        method: 'POST',
+        body: JSON.stringify(request),
+      });
+    }
+
+    const response = await fetch(`${this.baseUrl}/generate-lesson-bundle`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ ...request, stream: true }),
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`API Error ${response.status}: ${await response.text()}`);
+    }
+
+    const bundle: Partial<LessonBundleResponse> = { success: true };
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      buffer += decoder.decode(value, { stream: !done });
+      const lines = buffer.split('\n');
+      buffer = done ? '' : lines.pop() ?? '';
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const message = JSON.parse(line);
+        if (message.part === 'error') throw new Error(message.detail);
+        (bundle as Record<string, unknown>)[message.part] = message.data;
+        onPart(message as LessonBundlePart);
+      }
+      if (done) break;
+    }
+    return bundle as LessonBundleResponse;
+  }
+
   /**
    * Check if the API service is available
    */
@@ -1,34 +1,150 @@
 #!/usr/bin/env python3
 """
 Startup script for SmartClass AI Model Service
+
+Development (default): a single uvicorn process with --reload.
+Production (--workers N): the model is loaded once in the parent and N
+workers are forked from it, so the weights are shared copy-on-write (or via
+the page cache when the pre-merged artifact is memory-mapped). Each worker is
+pinned to its own slice of CPU cores with a matching intra-op thread count.
 """
 
+import argparse
+import gc
+import os
+import signal
+import socket
 import subprocess
 import sys
-import os
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Start the SmartClass AI Model Service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Pre-forked production workers sharing one model copy (0 = development server with --reload)")
+    parser.add_argument("--no-pin", action="store_true", help="Do not pin workers to CPU cores")
+    return parser.parse_args()
+
+def partition_cores(workers: int) -> list:
+    """Split the CPUs this process may use into contiguous, non-overlapping groups."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    per_worker = max(1, len(cores) // workers)
+    return [cores[i * per_worker:(i + 1) * per_worker] or cores for i in range(workers)]
+
+def run_worker(index: int, sock: socket.socket, cores: list, pin: bool):
+    """Body of a forked worker: pin, size thread pools, then serve on the shared socket."""
+    import torch
+    import uvicorn
+    import api_model_service as service
+
+    if pin and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Already fixed by the parent
+    print(f"Worker {index} (pid {os.getpid()}) using cores {cores} with {len(cores)} intra-op threads")
+
+    config = uvicorn.Config(service.app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+def serve_prefork(host: str, port: int, workers: int, pin: bool = True):
+    """Load the model once, then fork workers that share its memory."""
+    import torch
+    import api_model_service as service
+
+    # Keep the parent single-threaded so no OpenMP pool exists at fork time (libgomp is not fork-safe)
+    torch.set_num_threads(1)
+    # With a remote backend there are no weights to share, and each worker needs its own connection
+    if service.INFERENCE_BACKEND != "remote":
+        service.load_model_and_tokenizer()
+    # Move everything allocated so far out of the GC's reach so collections in the
+    # workers don't touch (and therefore copy) pages shared with the parent
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    core_groups = partition_cores(workers)
+    children = {}
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_worker(index, sock, core_groups[index], pin)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    for index in range(workers):
+        spawn(index)
+    print(f"Serving on http://{host}:{port} with {workers} workers sharing one model copy")
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"Worker {index} (pid {pid}) exited with status {status}; restarting")
+            spawn(index)
+    sock.close()
 
 def main():
     """Start the FastAPI model service"""
+    args = parse_args()
     print("Starting SmartClass AI Model Service...")
     print("This will load your fine-tuned Llama model and start the API server.")
-    print("The service will be available at: http://127.0.0.1:8000")
-    print("API documentation will be available at: http://127.0.0.1:8000/docs")
+    print(f"The service will be available at: http://{args.host}:{args.port}")
+    print(f"API documentation will be available at: http://{args.host}:{args.port}/docs")
     print("\nPress Ctrl+C to stop the service.\n")
-    
-    # Check if model directory exists
-    if not os.path.exists("./llama3.2-1b-syllabus-finetuned"):
+
+    # Check if model directory (or a pre-merged artifact) exists
+    merged_model_path = os.getenv("MERGED_MODEL_PATH", "./llama3.2-1b-syllabus-merged")
+    remote = os.getenv("INFERENCE_BACKEND") in ("remote", "stub")  # The model lives in inference_server.py, or none is used
+    if not remote and not os.path.exists("./llama3.2-1b-syllabus-finetuned") and not os.path.exists(merged_model_path):
         print("ERROR: Fine-tuned model directory not found!")
-        print("Expected: ./llama3.2-1b-syllabus-finetuned")
+        print(f"Expected: ./llama3.2-1b-syllabus-finetuned (or a merged artifact at {merged_model_path})")
         print("Please ensure your fine-tuned model is in the correct location.")
         sys.exit(1)
-    
+
+    if args.workers > 0:
+        serve_prefork(args.host, args.port, args.workers, pin=not args.no_pin)
+        return
+
     try:
         # Start the FastAPI service
         subprocess.run([
-            sys.executable, "-m", "uvicorn", 
+            sys.executable, "-m", "uvicorn",
             "api_model_service:app",
-            "--host", "127.0.0.1",
-            "--port", "8000",
+            "--host", args.host,
+            "--port", str(args.port),
             "--reload"
         ])
     except KeyboardInterrupt:
@@ -38,4 +154,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,248 @@
+"""
+Template-skeleton decoding for quizzes and content cards.
+
+Most of a quiz/card response is fixed structure: key names, punctuation,
+["True","False"] options. Instead of decoding those tokens one at a time the
+server writes the JSON skeleton itself and runs the model only for the
+free-text value slots:
+
+- each slot is filled by continuing the prompt + skeleton-so-far up to the
+  slot's opening quote and stopping at the closing quote;
+- questions/cards are filled one after another, so item k's skeleton holds
+  the finished items 0..k-1 and the model does not restart the list (a
+  repeated question or title is resampled once, then dropped);
+- correct_answer is picked by scoring the candidate options (no decoding).
+"""
+
+import json
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from inference_backends import GENERATION_SETTINGS
+
+# Maximum tokens generated per slot
+SLOT_TOKEN_LIMITS = {
+    "question": 48,
+    "option": 16,
+    "explanation": 64,
+    "title": 16,
+    "body": 160,
+}
+
+# Question layouts matching what the quiz prompts ask for
+QUIZ_LAYOUTS = {
+    "mid": ["multiple_choice", "multiple_choice", "multiple_choice"],
+    "final": ["multiple_choice", "multiple_choice", "true_false"],
+}
+NUM_OPTIONS = 4
+TRUE_FALSE_OPTIONS = ["True", "False"]
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def _cut_at_closing_quote(text: str) -> Optional[str]:
+    """Return text up to the first unescaped double quote, or None if there is none yet."""
+    escaped = False
+    for i, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            return text[:i]
+    return None
+
+def _is_repeat(value: str, seen: set) -> bool:
+    return value.strip().lower() in seen
+
+def _unescape(raw: str) -> str:
+    try:
+        return json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        return raw.replace('\\"', '"')
+
+class _ClosingQuoteCriteria(StoppingCriteria):
+    """Per-row stop once the generated slot text contains its closing quote."""
+
+    def __init__(self, tokenizer, prompt_length: int):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        return torch.tensor([_cut_at_closing_quote(text) is not None for text in texts], device=input_ids.device)
+
+class StructuredStats:
+    """Tokens generated by the model vs. emitted by the server skeleton, per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, generated_tokens: int, skeleton_tokens: int, generate_calls: int):
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats["requests"] += 1
+            stats["generated_tokens"] += generated_tokens
+            stats["skeleton_tokens"] += skeleton_tokens
+            stats["generate_calls"] += generate_calls
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                endpoint: {
+                    **stats,
+                    "generated_tokens_per_request": round(stats["generated_tokens"] / stats["requests"], 1),
+                    "skeleton_share": round(stats["skeleton_tokens"] / max(stats["generated_tokens"] + stats["skeleton_tokens"], 1), 3),
+                }
+                for endpoint, stats in self._stats.items()
+            }
+
+structured_stats = StructuredStats()
+
+class SkeletonDecoder:
+    """Fill the value slots of server-built JSON skeletons with batched slot generation."""
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generated_tokens = 0
+        self.generate_calls = 0
+
+    def _encode(self, texts: List[str]):
+        self.tokenizer.padding_side = "left"
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
+        return {k: v.to(self.model.device) for k, v in inputs.items()}
+
+    @torch.no_grad()
+    def fill(self, prefixes: List[str], slot: str) -> List[str]:
+        """Generate one string value per prefix; each prefix ends just after the slot's opening quote."""
+        inputs = self._encode(prefixes)
+        prompt_length = inputs["input_ids"].shape[1]
+        outputs = self.model.generate(
+            **inputs,
+            max_new_tokens=SLOT_TOKEN_LIMITS[slot],
+            temperature=GENERATION_SETTINGS["temperature"],
+            top_p=GENERATION_SETTINGS["top_p"],
+            do_sample=True,
+            repetition_penalty=GENERATION_SETTINGS["repetition_penalty"],
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+            stopping_criteria=StoppingCriteriaList([_ClosingQuoteCriteria(self.tokenizer, prompt_length)]),
+        )
+        new_tokens = outputs[:, prompt_length:]
+        self.generated_tokens += int((new_tokens != self.tokenizer.pad_token_id).sum())
+        self.generate_calls += 1
+
+        values = []
+        for text in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True):
+            raw = _cut_at_closing_quote(text)
+            values.append(_unescape(raw if raw is not None else text).strip())
+        return values
+
+    @torch.no_grad()
+    def choose(self, prefixes: List[str], candidates: List[List[str]]) -> List[str]:
+        """For each prefix pick the candidate string value with the highest mean token log-likelihood."""
+        texts, spans = [], []
+        for prefix, options in zip(prefixes, candidates):
+            prefix_length = len(self.tokenizer(prefix)["input_ids"])
+            for option in options:
+                texts.append(prefix + _dumps(option)[1:])  # prefix already holds the opening quote
+                spans.append(prefix_length)
+
+        inputs = self._encode(texts)
+        log_probs = torch.log_softmax(self.model(**inputs).logits[:, :-1].float(), dim=-1)
+        targets = inputs["input_ids"][:, 1:]
+        token_scores = log_probs.gather(-1, targets.unsqueeze(-1)).squeeze(-1)
+        padding = (inputs["attention_mask"] == 0).sum(dim=1)
+
+        scores = []
+        for row, prefix_length in enumerate(spans):
+            start = int(padding[row]) + prefix_length - 1
+            scores.append(token_scores[row, start:].mean().item())
+
+        choices, offset = [], 0
+        for options in candidates:
+            best = max(range(len(options)), key=lambda i: scores[offset + i])
+            choices.append(options[best])
+            offset += len(options)
+        return choices
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def fill_distinct(self, prefix: str, slot: str, seen: set) -> Optional[str]:
+        """Fill one slot, resampling once if the value repeats one in seen; None if it still does."""
+        for _ in range(2):
+            value = self.fill([prefix], slot)[0]
+            if not _is_repeat(value, seen):
+                seen.add(value.strip().lower())
+                return value
+        return None
+
+def generate_quiz_structured(model, tokenizer, prompt: str, quiz_type: str) -> List[Dict]:
+    """Build the quiz JSON skeleton and let the model fill only the free-text slots."""
+    decoder = SkeletonDecoder(model, tokenizer)
+    layout = QUIZ_LAYOUTS.get(quiz_type, QUIZ_LAYOUTS["final"])
+    questions, seen = [], set()
+
+    for kind in layout:
+        # The finished questions stay in the skeleton so the next one follows them
+        open_item = prompt + " [" + ''.join(_dumps(q) + ',' for q in questions)
+        stem = "True or False: " if kind == "true_false" else ""
+        text = decoder.fill_distinct(open_item + '{"question":"' + stem, "question", seen)
+        if text is None:
+            continue
+        q = {"question": stem + text, "question_type": kind}
+        skeleton = (open_item + '{"question":' + _dumps(q["question"]) + ',"question_type":' + _dumps(kind)
+                    + ',"options":[')
+
+        # Options: one position at a time, each seeing the ones before it
+        if kind == "multiple_choice":
+            options = []
+            for _ in range(NUM_OPTIONS):
+                value = decoder.fill([skeleton + ''.join(_dumps(o) + ',' for o in options) + '"'], "option")[0]
+                options.append(value or f"Option {len(options) + 1}")
+        else:
+            options = list(TRUE_FALSE_OPTIONS)
+        q["options"] = options
+
+        # Correct answer: score each option instead of decoding it
+        answer_prefix = skeleton + ','.join(_dumps(o) for o in options) + '],"correct_answer":"'
+        q["correct_answer"] = decoder.choose([answer_prefix], [options])[0]
+
+        explanation_prefix = answer_prefix + _dumps(q["correct_answer"])[1:] + ',"explanation":"'
+        q["explanation"] = (decoder.fill([explanation_prefix], "explanation")[0]
+                            or f"The correct answer is {q['correct_answer']}.")
+        questions.append(q)
+
+    _record(decoder, "generate-quiz", questions)
+    return questions
+
+def generate_content_structured(model, tokenizer, prompt: str, num_cards: int) -> List[Dict]:
+    """Build the content-card skeleton and fill the title and body of each card in turn."""
+    decoder = SkeletonDecoder(model, tokenizer)
+    cards, seen = [], set()
+
+    for _ in range(max(1, num_cards)):
+        open_item = prompt + " [" + ''.join(_dumps(card) + ',' for card in cards)
+        title = decoder.fill_distinct(open_item + '{"title":"', "title", seen)
+        if title is None:
+            continue
+        title = title or f"Card {len(cards) + 1}"
+        body = decoder.fill([open_item + '{"title":' + _dumps(title) + ',"body":"<p>'], "body")[0]
+        body = body[:-4] if body.endswith("</p>") else body
+        cards.append({"title": title, "body": f"<p>{body}</p>", "card_type": "content"})
+
+    _record(decoder, "generate-content", cards)
+    return cards
+
+def _record(decoder: SkeletonDecoder, endpoint: str, items: List[Dict]):
+    """Compare tokens the model generated with the tokens of the full JSON the server returned."""
+    total_tokens = decoder.count_tokens(_dumps(items))
+    structured_stats.record(endpoint, decoder.generated_tokens, max(total_tokens - decoder.generated_tokens, 0),
+                            decoder.generate_calls)
@@ -0,0 +1,291 @@
+"""
+Synthesize instruction-tuning data in the exact request/response formats the API uses.
+
+For every syllabus chunk the base model is asked (batched, across several worker
+processes) to write grounded content cards and mid/final quizzes. Candidates are
+validated against the API's pydantic models, de-duplicated, and written as
+training examples whose prompt is the real RAG prompt from api_model_service and
+whose completion is short, compact JSON.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import random
+import re
+from typing import Dict, List, Optional
+
+import chromadb
+
+from api_model_service import (
+    ContentCard,
+    ContentRequest,
+    QuizQuestion,
+    QuizRequest,
+    create_content_prompt_with_rag,
+    create_quiz_prompt_with_rag,
+)
+from curriculum_tree import best_subtopic_for_text, grades_for_pdf, load_curriculum_tree, subject_for_pdf
+from prepare_data_for_finetune import CHROMA_DB_PATH, COLLECTION_NAME, PAGE_SIZE, ShardedJSONLWriter, iter_collection_pages
+
+# --- Configuration ---
+BASE_MODEL = "meta-llama/Llama-3.2-1B"
+OUTPUT_SYNTH_DATA_FILE = "./syllabus_synth_data.jsonl"
+NUM_WORKERS = 2  # Generation processes, each holding one copy of the base model
+BATCH_SIZE = 8  # Prompts per generate() call
+MAX_NEW_TOKENS = 384
+TEMPERATURE = 0.7
+TOP_P = 0.9
+MAX_CARD_BODY_CHARS = 400  # Keeps targets short so the served model learns short outputs
+MIN_GROUNDING = 0.3  # Fraction of answer words that must appear in the source chunk
+SEED = 1234
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Synthesis prompts end with the opening of the JSON so the base model continues the structure
+SYNTH_CARD_PROMPT = """Syllabus excerpt:
+{chunk}
+
+Write {num_cards} short lesson cards for {subject} Grade {grade} using only facts from the excerpt above.
+Each card is a JSON object with "title", "body" (one or two simple sentences inside <p></p> tags) and "card_type":"content".
+
+JSON array:
+[{{"title":\""""
+
+SYNTH_QUIZ_PROMPT = """Syllabus excerpt:
+{chunk}
+
+Write {description} for {subject} Grade {grade} using only facts from the excerpt above.
+Multiple-choice questions have exactly 4 options and the correct_answer is copied from the options.
+True/false questions have the options ["True","False"].
+
+JSON array:
+[{{"question":\""""
+
+QUIZ_LAYOUTS = {
+    "mid": {"description": "3 multiple-choice questions", "multiple_choice": 3, "true_false": 0},
+    "final": {"description": "3 questions: 2 multiple-choice, 1 true/false", "multiple_choice": 2, "true_false": 1},
+}
+
+CARD_PREFILL = '[{"title":"'
+QUIZ_PREFILL = '[{"question":"'
+
+# Per-process model state, populated by _init_worker
+_worker_model = None
+_worker_tokenizer = None
+
+def _init_worker(model_name: str, device_queue, threads_per_worker: int):
+    """Load the base model once per worker process."""
+    global _worker_model, _worker_tokenizer
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    device = device_queue.get()
+    torch.set_num_threads(threads_per_worker)
+    _worker_tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
+    if _worker_tokenizer.pad_token is None:
+        _worker_tokenizer.pad_token = _worker_tokenizer.eos_token
+    _worker_model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        torch_dtype=torch.float16 if device.startswith("cuda") else torch.float32,
+    ).to(device).eval()
+    logging.info(f"Worker {os.getpid()} loaded {model_name} on {device}")
+
+def _generate_batch(jobs: List[Dict]) -> List[Dict]:
+    """Run one batched generate() call for a list of synthesis jobs."""
+    import torch
+
+    prompts = [job["synth_prompt"] for job in jobs]
+    inputs = _worker_tokenizer(prompts, return_tensors="pt", padding=True).to(_worker_model.device)
+    with torch.no_grad():
+        outputs = _worker_model.generate(
+            **inputs,
+            max_new_tokens=MAX_NEW_TOKENS,
+            temperature=TEMPERATURE,
+            top_p=TOP_P,
+            do_sample=True,
+            pad_token_id=_worker_tokenizer.pad_token_id,
+            eos_token_id=_worker_tokenizer.eos_token_id,
+            repetition_penalty=1.1,
+        )
+    new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+    completions = _worker_tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+    return [dict(job, raw=completion) for job, completion in zip(jobs, completions)]
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+def _grounding(text: str, chunk: str) -> float:
+    """Fraction of the content words in text that also occur in the source chunk."""
+    words = [word for word in re.findall(r"[a-z]{4,}", text.lower())]
+    if not words:
+        return 0.0
+    chunk_words = set(re.findall(r"[a-z]{4,}", chunk.lower()))
+    return sum(word in chunk_words for word in words) / len(words)
+
+def _parse_array(prefill: str, raw: str) -> Optional[list]:
+    """Re-attach the prefill and parse the first complete JSON array in the completion."""
+    text = prefill + raw
+    end_idx = text.find(']', len(prefill) - 1)
+    while end_idx != -1:
+        try:
+            data = json.loads(text[:end_idx + 1])
+            return data if isinstance(data, list) else None
+        except json.JSONDecodeError:
+            end_idx = text.find(']', end_idx + 1)
+    return None
+
+def validate_cards(job: Dict, seen: set) -> Optional[List[Dict]]:
+    """Return schema-valid, grounded, de-duplicated content cards, or None if the sample is unusable."""
+    data = _parse_array(CARD_PREFILL, job["raw"])
+    if not data:
+        return None
+
+    cards = []
+    for item in data:
+        try:
+            card = ContentCard(**item)
+        except Exception:
+            continue
+        body_text = re.sub(r"<[^>]+>", " ", card.body)
+        key = _normalize(card.title)
+        if (not key or key in seen or card.card_type != "content" or not card.body.startswith("<p>")
+                or len(card.body) > MAX_CARD_BODY_CHARS or _grounding(body_text, job["chunk"]) < MIN_GROUNDING):
+            continue
+        seen.add(key)
+        cards.append(card.model_dump())
+        if len(cards) == job["num_cards"]:
+            break
+    return cards or None
+
+def validate_quiz(job: Dict, seen: set) -> Optional[List[Dict]]:
+    """Return a schema-valid quiz with the layout the API prompt asks for, or None."""
+    data = _parse_array(QUIZ_PREFILL, job["raw"])
+    if not data:
+        return None
+
+    layout = QUIZ_LAYOUTS[job["quiz_type"]]
+    picked = {"multiple_choice": [], "true_false": []}
+    for item in data:
+        try:
+            question = QuizQuestion(**item)
+        except Exception:
+            continue
+        key = _normalize(question.question)
+        if not key or key in seen or question.question_type not in picked:
+            continue
+        if question.question_type == "multiple_choice":
+            options = question.options or []
+            if len(options) != 4 or len({_normalize(o) for o in options}) != 4 or question.correct_answer not in options:
+                continue
+        elif question.options != ["True", "False"] or question.correct_answer not in ("True", "False"):
+            continue
+        if _grounding(f"{question.question} {question.explanation}", job["chunk"]) < MIN_GROUNDING:
+            continue
+        if len(picked[question.question_type]) < layout[question.question_type]:
+            picked[question.question_type].append(question)
+
+    if any(len(picked[kind]) < layout[kind] for kind in picked):
+        return None
+    questions = picked["multiple_choice"] + picked["true_false"]
+    seen.update(_normalize(q.question) for q in questions)
+    return [q.model_dump() for q in questions]
+
+def build_jobs(collection, tree: List[Dict], rng: random.Random):
+    """Yield one content job and one job per quiz type for every syllabus chunk."""
+    for documents, metadatas in iter_collection_pages(collection, PAGE_SIZE):
+        for doc_text, meta in zip(documents, metadatas):
+            if not doc_text or not meta:
+                continue
+            source_pdf = meta.get('source_pdf', '')
+            subject_id = subject_for_pdf(source_pdf) or "general"
+            grade_id = rng.choice(grades_for_pdf(source_pdf))
+            topic_id, subtopic_id = best_subtopic_for_text(tree, subject_id, doc_text) or (
+                f"{subject_id}-topic", "-".join(_normalize(doc_text).split()[:3]) or "overview")
+            base = {"chunk": doc_text, "subject_id": subject_id, "grade_id": grade_id,
+                    "topic_id": topic_id, "subtopic_id": subtopic_id}
+
+            num_cards = rng.randint(1, 5)
+            yield dict(base, kind="content", num_cards=num_cards, synth_prompt=SYNTH_CARD_PROMPT.format(
+                chunk=doc_text, num_cards=num_cards, subject=subject_id, grade=grade_id))
+            for quiz_type, layout in QUIZ_LAYOUTS.items():
+                yield dict(base, kind="quiz", quiz_type=quiz_type, synth_prompt=SYNTH_QUIZ_PROMPT.format(
+                    chunk=doc_text, description=layout["description"], subject=subject_id, grade=grade_id))
+
+def _batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def to_training_example(job: Dict, items: List[Dict], eos_token: str) -> Dict:
+    """Pair the API's own RAG prompt with a compact JSON completion."""
+    request_fields = {key: job[key] for key in ("topic_id", "subtopic_id", "subject_id", "grade_id")}
+    if job["kind"] == "content":
+        prompt = create_content_prompt_with_rag(ContentRequest(num_cards=len(items), **request_fields), job["chunk"])
+    else:
+        prompt = create_quiz_prompt_with_rag(QuizRequest(quiz_type=job["quiz_type"], **request_fields), job["chunk"])
+    completion = " " + json.dumps(items, separators=(',', ':'), ensure_ascii=False)
+    return {"text": prompt + completion + eos_token, "prompt": prompt, "completion": completion, "kind": job["kind"]}
+
+def synthesize(collection, output_file: str, num_workers: int = NUM_WORKERS, batch_size: int = BATCH_SIZE,
+               model_name: str = BASE_MODEL, compression: str = "none"):
+    """Generate, validate, de-duplicate and write the synthetic training set."""
+    import torch
+
+    rng = random.Random(SEED)
+    tree = load_curriculum_tree()
+    ctx = mp.get_context("spawn")
+    device_queue = ctx.Queue()
+    gpu_count = torch.cuda.device_count()
+    for i in range(num_workers):
+        device_queue.put(f"cuda:{i % gpu_count}" if gpu_count else "cpu")
+    threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+
+    seen_cards, seen_questions = set(), set()
+    stats = {"generated": 0, "content": 0, "quiz": 0, "rejected": 0}
+    with ctx.Pool(num_workers, initializer=_init_worker, initargs=(model_name, device_queue, threads_per_worker)) as pool, \
+            ShardedJSONLWriter(output_file, compression=compression) as writer:
+        eos_token = "<|end_of_text|>"
+        for results in pool.imap_unordered(_generate_batch, _batched(build_jobs(collection, tree, rng), batch_size)):
+            for job in results:
+                stats["generated"] += 1
+                if job["kind"] == "content":
+                    items = validate_cards(job, seen_cards)
+                else:
+                    items = validate_quiz(job, seen_questions)
+                if not items:
+                    stats["rejected"] += 1
+                    continue
+                writer.write(to_training_example(job, items, eos_token))
+                stats[job["kind"]] += 1
+            logging.info(f"Synthesis progress: {stats}")
+
+    logging.info(f"Wrote {writer.records_written} training examples to {', '.join(writer.shard_paths)} ({stats})")
+    return stats
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Synthesize card/quiz fine-tuning data from the syllabus collection.")
+    parser.add_argument("--output", default=OUTPUT_SYNTH_DATA_FILE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Generation processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Prompts per generate() call")
+    parser.add_argument("--model", default=BASE_MODEL, help="Model used to generate the targets")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="none")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    collection = client.get_collection(name=COLLECTION_NAME)
+    logging.info(f"Synthesizing from '{COLLECTION_NAME}' ({collection.count()} chunks) with {args.workers} worker(s)")
+    synthesize(collection, args.output, args.workers, args.batch_size, args.model, args.compression)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import argparse
+
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from peft import PeftModel
@@ -28,13 +30,14 @@ def load_model_and_tokenizer():
     
     return model, tokenizer
 
-def generate_response(model, tokenizer, prompt, max_length=512):
+def generate_response(model, tokenizer, prompt, max_new_tokens=300):
     """Generate a response from the model."""
     inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
     
+    # Budget new tokens only; max_length would count the prompt too
     outputs = model.generate(
         **inputs,
-        max_length=max_length,
+        max_new_tokens=max_new_tokens,
         num_return_sequences=1,
         temperature=0.7,
         top_p=0.9,
@@ -42,10 +45,19 @@ def generate_response(model, tokenizer, prompt, max_length=512):
         pad_token_id=tokenizer.eos_token_id
     )
     
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    response = tokenizer.decode(outputs[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True)
     return response
 
 def main():
+    parser = argparse.ArgumentParser(description="Sample answers from the fine-tuned model.")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Run benchmark_generation.py instead (remaining arguments are passed through)")
+    args, benchmark_args = parser.parse_known_args()
+    if args.benchmark:
+        import benchmark_generation
+        benchmark_generation.main(benchmark_args)
+        return
+    
     # Load model and tokenizer
     model, tokenizer = load_model_and_tokenizer()
     
@@ -0,0 +1,190 @@
+"""
+AsyncRetrievalClient against a local ChromaDB stand-in with configurable latency and errors.
+
+Run with `python -m pytest tests` from the repository root.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from async_retrieval import AsyncRetrievalClient, RetrievalUnavailable
+
+class FakeCollection:
+    """Stand-in for a chromadb collection: query() sleeps `delay` seconds and raises while `fail` is set."""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.running = 0
+        self.peak_running = 0
+        self._lock = threading.Lock()
+
+    def query(self, query_texts, n_results=3, include=None):
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.peak_running = max(self.peak_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("database is locked")
+            return {"documents": [[f"{text} curriculum {i}" for i in range(n_results)] for text in query_texts]}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+def make_client(collection, **kwargs) -> AsyncRetrievalClient:
+    settings = {"max_concurrency": 2, "timeout": 0.2, "failure_threshold": 2, "reset_seconds": 0.2}
+    settings.update(kwargs)
+    return AsyncRetrievalClient(collection, **settings)
+
+def test_query_returns_results_without_blocking_the_loop():
+    collection = FakeCollection(delay=0.05)
+    client = make_client(collection)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while ticks < 5:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        results, _ = await asyncio.gather(client.query(query_texts=["counting"], n_results=2), ticker())
+        return results, ticks
+
+    results, ticks = asyncio.run(run())
+    assert results["documents"] == [["counting curriculum 0", "counting curriculum 1"]]
+    assert ticks == 5
+
+def test_concurrency_limit():
+    collection = FakeCollection(delay=0.05)
+    client = make_client(collection, max_concurrency=2, timeout=1.0)
+
+    async def run():
+        return await asyncio.gather(*(client.query(query_texts=[str(i)]) for i in range(6)))
+
+    assert len(asyncio.run(run())) == 6
+    assert collection.peak_running == 2
+
+def test_timeout_raises_retrieval_unavailable():
+    client = make_client(FakeCollection(delay=0.5), timeout=0.05)
+
+    async def run():
+        start = time.perf_counter()
+        with pytest.raises(RetrievalUnavailable, match="timed out"):
+            await client.query(query_texts=["slow"])
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) < 0.3
+
+def test_timed_out_worker_keeps_its_slot():
+    collection = FakeCollection(delay=0.4)
+    client = make_client(collection, max_concurrency=1, timeout=0.1, failure_threshold=10)
+
+    async def run():
+        with pytest.raises(RetrievalUnavailable, match="timed out"):
+            await client.query(query_texts=["stuck"])
+        # The first worker is still sleeping, so the only slot is taken
+        with pytest.raises(RetrievalUnavailable, match="No ChromaDB slot"):
+            await client.query(query_texts=["waiting"])
+        assert collection.calls == 1
+        await asyncio.sleep(0.4)
+        collection.delay = 0.0
+        return await client.query(query_texts=["after"])
+
+    assert asyncio.run(run())["documents"]
+    assert collection.peak_running == 1
+
+def test_breaker_opens_half_opens_and_closes():
+    collection = FakeCollection(fail=True)
+    client = make_client(collection, failure_threshold=2, reset_seconds=0.1)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="locked"):
+                await client.query(query_texts=["x"])
+        assert client.breaker.state == "open"
+        with pytest.raises(RetrievalUnavailable, match="circuit breaker is open"):
+            await client.query(query_texts=["x"])
+        assert collection.calls == 2  # Rejected without touching the collection
+
+        await asyncio.sleep(0.15)
+        assert client.breaker.state == "half_open"
+        # A failed trial opens the breaker again straight away
+        with pytest.raises(RuntimeError):
+            await client.query(query_texts=["x"])
+        assert client.breaker.state == "open"
+
+        await asyncio.sleep(0.15)
+        collection.fail = False
+        await client.query(query_texts=["x"])
+        assert client.breaker.state == "closed"
+        assert client.breaker.failures == 0
+
+    asyncio.run(run())
+
+def test_cancelled_trial_does_not_wedge_the_breaker():
+    collection = FakeCollection(fail=True)
+    client = make_client(collection, failure_threshold=1, reset_seconds=0.05, timeout=1.0)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await client.query(query_texts=["x"])
+        await asyncio.sleep(0.1)
+        collection.fail, collection.delay = False, 0.3
+        trial = asyncio.create_task(client.query(query_texts=["x"]))
+        await asyncio.sleep(0.05)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        await asyncio.sleep(0.3)
+        collection.delay = 0.0
+        await client.query(query_texts=["x"])
+        assert client.breaker.state == "closed"
+
+    asyncio.run(run())
+
+def test_endpoint_falls_back_to_non_rag_prompt_when_retrieval_fails():
+    service = pytest.importorskip("api_model_service")
+    from inference_backends import StubBackend
+
+    class RecordingBackend(StubBackend):
+        def __init__(self):
+            super().__init__()
+            self.prompts = []
+
+        def generate(self, prompt, max_new_tokens=300, endpoint="default"):
+            self.prompts.append(prompt)
+            return super().generate(prompt, max_new_tokens, endpoint)
+
+    backend = RecordingBackend()
+    collection = FakeCollection()
+    request = service.ContentRequest(topic_id="numbers", subtopic_id="counting", subject_id="maths",
+                                     grade_id="b1", num_cards=2)
+    saved = service.backend, service.retrieval
+    service.backend = backend
+    try:
+        async def run():
+            service.retrieval = make_client(collection, failure_threshold=1, reset_seconds=60)
+            response = await service.generate_content(request)
+            assert response.content
+            assert "CURRICULUM CONTENT FROM SYLLABUS" in backend.prompts[-1]
+
+            collection.fail = True
+            response = await service.generate_content(request)  # Fails and opens the breaker
+            assert response.content
+            assert "CURRICULUM CONTENT" not in backend.prompts[-1]
+            calls = collection.calls
+            await service.generate_content(request)  # Rejected by the open breaker
+            assert collection.calls == calls
+            assert "CURRICULUM CONTENT" not in backend.prompts[-1]
+
+        asyncio.run(run())
+    finally:
+        service.backend, service.retrieval = saved
@@ -0,0 +1,98 @@
+"""
+Per-request max_new_tokens budgets learned from observed output lengths.
+
+A response is roughly a fixed JSON overhead plus a similar number of tokens per
+item (content card, quiz question or topic), so the budget for a request is
+overhead + items * tokens-per-item. Tokens-per-item starts from a prior and is
+then the TARGET_QUANTILE of a rolling window of completed generations for that
+endpoint. A generation that used its whole budget only gives a lower bound, so
+it is recorded inflated by TRUNCATED_GROWTH to push the estimate up.
+
+Budgets are rounded up to BUDGET_STEP tokens so that requests of similar size
+still share a batch in inference_server.py (it batches by max_new_tokens).
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Dict
+
+from metrics import BUDGET_OUTCOMES, UNUSED_BUDGET_TOKENS
+
+# Tokens per item before any generation has been observed
+PRIOR_TOKENS_PER_ITEM = {
+    "generate-content": 80,
+    "generate-quiz": 65,
+    "generate-topics": 50,
+}
+DEFAULT_TOKENS_PER_ITEM = 80
+OVERHEAD_TOKENS = 8        # Array brackets, separators and trailing text
+TARGET_QUANTILE = 0.9
+HEADROOM = 0.1
+TRUNCATED_GROWTH = 1.5
+TRUNCATION_SLACK = 4       # Output ending this close to the budget (e.g. just before EOS) counts as truncated
+BUDGET_STEP = 32
+WINDOW = 200
+
+class TokenBudget:
+    """Thread-safe budget model; record() every generation made with a predicted budget."""
+
+    def __init__(self, min_tokens: int = 64, max_tokens: int = 1024):
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def _window(self, endpoint: str) -> deque:
+        if endpoint not in self._samples:
+            prior = PRIOR_TOKENS_PER_ITEM.get(endpoint, DEFAULT_TOKENS_PER_ITEM)
+            self._samples[endpoint] = deque([prior], maxlen=WINDOW)
+            self._counts[endpoint] = {"requests": 0, "truncated": 0, "unused_tokens": 0, "generated_tokens": 0}
+        return self._samples[endpoint]
+
+    def tokens_per_item(self, endpoint: str) -> float:
+        with self._lock:
+            samples = sorted(self._window(endpoint))
+        return samples[math.ceil(TARGET_QUANTILE * len(samples)) - 1]  # Nearest-rank quantile
+
+    def predict(self, endpoint: str, items: int) -> int:
+        """max_new_tokens for a request expected to produce items objects."""
+        need = OVERHEAD_TOKENS + max(items, 1) * self.tokens_per_item(endpoint) * (1 + HEADROOM)
+        budget = math.ceil(need / BUDGET_STEP) * BUDGET_STEP
+        return max(self.min_tokens, min(self.max_tokens, budget))
+
+    def record(self, endpoint: str, items: int, budget: int, generated: int) -> bool:
+        """Learn from one generation; returns True if it ran into its budget."""
+        truncated = generated >= budget - TRUNCATION_SLACK
+        per_item = max(generated - OVERHEAD_TOKENS, 1) / max(items, 1)
+        with self._lock:
+            self._window(endpoint).append(per_item * TRUNCATED_GROWTH if truncated else per_item)
+            counts = self._counts[endpoint]
+            counts["requests"] += 1
+            counts["generated_tokens"] += generated
+            if truncated:
+                counts["truncated"] += 1
+            else:
+                counts["unused_tokens"] += budget - generated
+        BUDGET_OUTCOMES.inc(endpoint=endpoint, result="truncated" if truncated else "fit")
+        if not truncated:
+            UNUSED_BUDGET_TOKENS.inc(budget - generated, endpoint=endpoint)
+        return truncated
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            endpoints = list(self._samples)
+            counts = {endpoint: dict(self._counts[endpoint]) for endpoint in endpoints}
+        snapshot = {}
+        for endpoint in endpoints:
+            stats = counts[endpoint]
+            requests = stats["requests"]
+            snapshot[endpoint] = {
+                **stats,
+                "tokens_per_item": round(self.tokens_per_item(endpoint), 1),
+                "truncation_rate": round(stats["truncated"] / requests, 3) if requests else 0.0,
+                "unused_token_ratio": (round(stats["unused_tokens"] / (stats["unused_tokens"] + stats["generated_tokens"]), 3)
+                                       if requests else 0.0),
+            }
+        return snapshot
@@ -0,0 +1,179 @@
+"""
+Request-scoped tracing.
+
+The HTTP middleware starts a Trace per request and stores it in a context
+variable. Code on the request path adds spans with `with span("name"):` (or
+record_span for intervals measured elsewhere); outside a request both are
+no-ops. Finished traces are summarized in a Server-Timing response header and
+queued for a background thread that appends them to a JSONL file, rotating it
+at TRACE_MAX_BYTES. A process forked after import (start_api.py --workers)
+writes its own TRACE_FILE with its pid inserted, so no two processes append to
+or rotate the same file. Probe and metrics requests are not traced.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+TRACING = os.getenv("TRACING", "1") == "1"
+TRACE_FILE = os.getenv("TRACE_FILE", "./traces.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))  # Then moved to TRACE_FILE.1
+TRACE_QUEUE_SIZE = 10000  # Traces beyond this many unwritten ones are dropped
+UNTRACED_ENDPOINTS = ("livez", "readyz", "health", "metrics")
+
+logger = logging.getLogger(__name__)
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("smartclass_trace", default=None)
+
+class Trace:
+    """Spans recorded for one request; times are perf_counter seconds."""
+
+    def __init__(self, endpoint: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()  # Spans may be added from worker threads
+
+    def add(self, name: str, start: float, end: float, **attributes):
+        record = {"name": name, "start_ms": round((start - self.start) * 1000, 2),
+                  "duration_ms": round((end - start) * 1000, 2)}
+        if attributes:
+            record["attributes"] = attributes
+        with self._lock:
+            self.spans.append(record)
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one entry per span name with the summed duration."""
+        totals, counts = {}, {}
+        with self._lock:
+            for record in self.spans:
+                totals[record["name"]] = totals.get(record["name"], 0.0) + record["duration_ms"]
+                counts[record["name"]] = counts.get(record["name"], 0) + 1
+        entries = []
+        for name, duration in totals.items():
+            entry = f"{name};dur={duration:.1f}"
+            if counts[name] > 1:
+                entry += f';desc="{counts[name]} calls"'
+            entries.append(entry)
+        return ", ".join(entries)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "endpoint": self.endpoint,
+            "timestamp": self.wall_start,
+            "duration_ms": round(((self.end or time.perf_counter()) - self.start) * 1000, 2),
+            "spans": self.spans,
+        }
+
+class TraceWriter:
+    """Appends queued trace lines to a file on a daemon thread, so requests never wait for disk."""
+
+    def __init__(self, path: str, max_bytes: int = TRACE_MAX_BYTES, queue_size: int = TRACE_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def write(self, line: str):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Trace writer is behind; {self.dropped} traces dropped so far")
+
+    def reset_after_fork(self):
+        """Switch a forked child to its own file and a fresh queue; the parent's thread did not survive the fork."""
+        root, ext = os.path.splitext(self.path)
+        self.path = f"{root}.{os.getpid()}{ext}"
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self, timeout: float = 5.0):
+        """Wait (up to timeout seconds) until every queued trace is written."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            while len(lines) < 1000:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            data = "".join(line + "\n" for line in lines)
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(data)
+            except OSError as e:
+                logger.error(f"Writing traces to {self.path} failed: {e}")
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+
+writer = TraceWriter(TRACE_FILE)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=writer.reset_after_fork)
+
+def start_trace(endpoint: str) -> Optional[Trace]:
+    if not TRACING or endpoint in UNTRACED_ENDPOINTS:
+        return None
+    trace = Trace(endpoint)
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace: Optional[Trace]):
+    """Close the trace and queue it for TRACE_FILE."""
+    if trace is None:
+        return
+    trace.end = time.perf_counter()
+    writer.write(json.dumps(trace.to_dict()))
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def record_span(name: str, start: float, end: Optional[float] = None, **attributes):
+    """Add an already measured interval to the current request's trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, end if end is not None else time.perf_counter(), **attributes)
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a span of the current request (no-op outside a request)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter(), **attributes)
@@ -0,0 +1,79 @@
+"""
+Startup warmup so the first real requests run at steady-state latency.
+
+The first call into each path pays one-off costs: allocator growth for the
+KV cache at a given batch size, tokenizer initialization, the MiniLM
+embedding model's first forward pass and cold SQLite pages in the Chroma
+store. Warmup runs representative prompts per endpoint at each expected
+batch size plus sample retrieval queries, and logs cold vs. warm latency.
+"""
+
+import logging
+import statistics
+import time
+from typing import Dict, List
+
+from curriculum_tree import load_curriculum_tree
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE = {"subject_id": "mathematics", "topic_id": "math-numbers", "subtopic_id": "counting", "grade_id": "b1"}
+
+def warmup_samples(limit: int = 3) -> List[Dict[str, str]]:
+    """One (subject, topic, subtopic) per subject from the curriculum tree, so retrieval touches different regions."""
+    try:
+        tree = load_curriculum_tree()
+    except OSError:
+        return [DEFAULT_SAMPLE]
+
+    samples, seen_subjects = [], set()
+    for topic in tree:
+        if topic["subject_id"] in seen_subjects or not topic["subtopics"]:
+            continue
+        seen_subjects.add(topic["subject_id"])
+        samples.append({"subject_id": topic["subject_id"], "topic_id": topic["topic_id"],
+                        "subtopic_id": topic["subtopics"][0]["subtopic_id"], "grade_id": "b1"})
+        if len(samples) == limit:
+            break
+    return samples or [DEFAULT_SAMPLE]
+
+def _timed_ms(fn, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start_time) * 1000
+
+def _log_cold_warm(label: str, cold_ms: float, warm_ms: List[float]) -> Dict[str, float]:
+    warm = statistics.median(warm_ms) if warm_ms else None
+    if warm is None:
+        logger.info(f"Warmup {label}: cold {cold_ms:.0f}ms")
+    else:
+        logger.info(f"Warmup {label}: cold {cold_ms:.0f}ms, warm {warm:.0f}ms ({cold_ms / max(warm, 1e-3):.1f}x)")
+    return {"cold_ms": round(cold_ms, 1), "warm_ms": round(warm, 1) if warm is not None else None}
+
+def warm_retrieval(collection, queries: List[str], n_results: int = 3) -> Dict:
+    """Run each sample query twice; the very first query is the cold one."""
+    documents = {}
+    latencies = []
+    for query in queries + queries:
+        results, elapsed_ms = _timed_ms(collection.query, query_texts=[query], n_results=n_results,
+                                        include=["documents", "metadatas"])
+        latencies.append(elapsed_ms)
+        if results["documents"] and results["documents"][0]:
+            documents[query] = results["documents"][0]
+    return {"latency": _log_cold_warm("retrieval", latencies[0], latencies[1:]), "documents": documents}
+
+def warm_generation(backend, prompts: Dict[str, str], batch_sizes: List[int], max_new_tokens: int,
+                    rounds: int = 2) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Run each endpoint's prompt at each batch size `rounds` times; the first round is the cold one."""
+    report = {}
+    for endpoint, prompt in prompts.items():
+        report[endpoint] = {}
+        for batch_size in batch_sizes:
+            latencies = []
+            for _ in range(max(rounds, 1)):
+                _, elapsed_ms = _timed_ms(backend.generate_batch, [prompt] * batch_size, max_new_tokens,
+                                          [f"warmup:{endpoint}"] * batch_size)
+                latencies.append(elapsed_ms)
+            report[endpoint][f"batch_{batch_size}"] = _log_cold_warm(f"{endpoint} batch={batch_size}",
+                                                                     latencies[0], latencies[1:])
+    return report